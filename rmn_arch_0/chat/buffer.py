@@ -0,0 +1,134 @@
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+import asyncio
+import collections
+import logging
+import weakref
+
+from . import db
+from .models import Message
+from .unread import flag_unread
+
+
+logger = logging.getLogger(__name__)
+
+# one buffer per event loop, i.e. per worker process
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_buffer():
+    """
+    Return the MessageBuffer of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _buffers:
+        _buffers[loop] = MessageBuffer(settings.CHAT_BUFFER_SIZE, settings.CHAT_BUFFER_DELAY,
+            settings.CHAT_ASYNC_DB)
+    return _buffers[loop]
+
+
+class MessageBuffer:
+    """
+    Write-behind buffer of chat messages, flushed with a single bulk insert once it holds
+    size messages or delay seconds after the first buffered one
+    Messages get their id when added, from a block of size ids reserved from the sequence
+    and dropped at the next flush, so within a worker their ids follow the order they were
+    received in, across workers they are ordered up to the flush delay
+    Buffered messages are lost if the worker dies before the flush
+    """
+    def __init__(self, size, delay, async_db=False):
+        self.size = size
+        self.delay = delay
+        self.async_db = async_db
+        self.messages = []
+        self.ids = collections.deque()
+        self.timer = None
+        self.lock = asyncio.Lock()
+        self.reserving = asyncio.Lock()
+
+    async def reserve_id(self):
+        """
+        Return the next reserved id, reserving a new block through the async pool
+        with async_db once the current one is used up
+        """
+        async with self.reserving:
+            if not self.ids:
+                if self.async_db:
+                    ids = await db.reserve_ids(self.size)
+                else:
+                    ids = await database_sync_to_async(Message.objects.reserve_ids)(self.size)
+                self.ids.extend(ids)
+            return self.ids.popleft()
+
+    async def add(self, message):
+        """
+        Give the unsaved Message its id and buffer it, flushing right away once the buffer is full
+        """
+        message.id = await self.reserve_id()
+        self.messages.append(message)
+        if len(self.messages) >= self.size:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.delay, self.flush_later)
+        return
+
+    def flush_later(self):
+        """
+        Timer callback, schedule a flush on the event loop
+        """
+        self.timer = None
+        asyncio.ensure_future(self.flush())
+        return
+
+    async def flush(self):
+        """
+        Save the buffered messages, the lock keeps consecutive flushes in order
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        async with self.lock:
+            messages, self.messages = self.messages, []
+            self.ids.clear()
+            if messages and self.async_db:
+                await self.save_async(messages)
+            elif messages:
+                await database_sync_to_async(self.save)(messages)
+        return
+
+    @staticmethod
+    async def save_async(messages):
+        """
+        Same as save through the async pool, one transaction per attempt,
+        the recipients are flagged unread once their messages are saved
+        """
+        user_ids = set()
+        try:
+            user_ids = await db.save_messages(messages)
+        except Exception:
+            for message in messages:
+                try:
+                    user_ids |= await db.save_messages([message])
+                except Exception:
+                    logger.exception('Could not save buffered chat message')
+        await sync_to_async(flag_unread, thread_sensitive=False)(user_ids)
+        return
+
+    @staticmethod
+    def save(messages):
+        """
+        Bulk insert messages, on failure save them one by one so one bad message,
+        e.g. to a room deleted meanwhile, does not drop the others
+        """
+        try:
+            Message.objects.bulk_save(messages)
+        except Exception:
+            for message in messages:
+                message._state.adding = True
+                try:
+                    message.save(force_insert=True)
+                except Exception:
+                    logger.exception('Could not save buffered chat message')
+        return
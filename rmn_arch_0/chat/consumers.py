@@ -1,8 +1,17 @@
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 
+import asyncio
+
+from . import db
+from .buffer import get_buffer
 from .models import Room, Message, UserRoomStatus
-from rmn_arch_0.users.models import User
+from .unread import cache_read, forget_reads, mark_read
+from rmn_arch_0.users.cards import get_card
 
 
 FROM = 'from'
@@ -12,81 +21,303 @@ BODY = 'body'
 
 
 class ChatConsumer(AsyncJsonWebsocketConsumer):
-    BASE_CHANNEL = 'root'
     CHAT_NEW = 'chat_new'
     CHAT_MSG = 'chat_message'
     CHAT_READ = 'chat_read'
+    CHAT_SYNC = 'chat_sync'
+    # CHAT_DELIVERY modes, see settings
+    ROOM_DELIVERY = 'room'
+    USER_DELIVERY = 'user'
+    # CHAT_MESSAGE_WRITE modes, see settings
+    SYNC_WRITE = 'sync'
+    BUFFERED_WRITE = 'buffered'
+
+    @staticmethod
+    def user_group(user_id):
+        """
+        Return the name of the group every connection of the given user joins
+        """
+        return f'user_{user_id}'
 
     @database_sync_to_async
-    def get_rooms(self):
-        return list(Room.objects.get_user_rooms(self.user))
+    def load_rooms(self):
+        return {room.name: room.id for room in Room.objects.get_user_rooms(self.user)}
+
+    async def get_rooms(self):
+        """
+        Return {room name: room id} of self.user's rooms, through the async pool with CHAT_ASYNC_DB
+        """
+        if self.async_db:
+            return await db.get_rooms(self.user.id)
+        return await self.load_rooms()
+
+    @property
+    def per_user(self):
+        """
+        True if messages are delivered to the recipients' user groups instead of the room groups
+        """
+        return self.delivery == self.USER_DELIVERY
+
+    async def join_groups(self):
+        """
+        Add the connection to the user group, and to the group of every room in room delivery
+        """
+        await self.channel_layer.group_add(self.user_group(self.user.id), self.channel_name)
+        if not self.per_user:
+            for room in self.rooms:
+                await self.channel_layer.group_add(room, self.channel_name)
+        return
+
+    async def leave_groups(self):
+        """
+        Discard the connection from the groups joined by join_groups
+        """
+        await self.channel_layer.group_discard(self.user_group(self.user.id), self.channel_name)
+        if not self.per_user:
+            for room in self.rooms:
+                await self.channel_layer.group_discard(room, self.channel_name)
+        return
 
     async def connect(self):
         """
         Handles websocket connection
         Reject unauthenticated user
-        otherwise add user to BASE_CHANNEL and any of their current rooms
+        otherwise load their current rooms and join the groups of the delivery mode
         """
         self.user = self.scope['user']
         if not self.user.is_authenticated:
             return  # reject unauthenticated user
-        await self.channel_layer.group_add(self.BASE_CHANNEL, self.channel_name)
-        self.rooms = {}
-        rooms = await self.get_rooms()
-        for room in rooms:
-            self.rooms[room.name] = room.id
-            await self.channel_layer.group_add(room.name, self.channel_name)
+        self.delivery = settings.CHAT_DELIVERY
+        self.buffered = settings.CHAT_MESSAGE_WRITE == self.BUFFERED_WRITE
+        self.async_db = settings.CHAT_ASYNC_DB
+        self.recipients = {}
+        self.reads = {}     # room id: (time, cursor) of the latest read receipt not written yet
+        self.seen = {}      # room name: id of the last message forwarded to the client
+        self.read_timer = None
+        self.rooms = await self.get_rooms()
+        await self.join_groups()
         await self.accept()
         return
 
     async def disconnect(self, close_code):
         """
         Handles websocket disconnect, discard current user from their groups
+        and write the buffered messages
         """
-        await self.channel_layer.group_discard(self.BASE_CHANNEL, self.channel_name)
-        for room in self.rooms:
-            await self.channel_layer.group_discard(room, self.channel_name)
+        if not self.user.is_authenticated:
+            return
+        await self.leave_groups()
+        if self.buffered:
+            # the read cursors only point at written messages
+            await get_buffer().flush()
+        await self.flush_reads()
         return
 
     @database_sync_to_async
     def handle_chat_new(self, content):
         """
         Get or create new room for user, then create the new chat message
+        Return the room, the message, the ids of the users to deliver to (the non-blocking ones)
+        and the sender's info, resolved once here instead of by every receiver
         """
         try:
             room = Room.objects.get(name=content[TO])
         except Room.DoesNotExist:
             room = Room.objects.create_by_name(self.user, content[TO])
-        Message.objects.create(
+        message = Message.objects.create(
             user = self.user,
             room = room,
             content = content[BODY],
         )
-        return
+        user_ids = self.get_room_user_ids(room.id)
+        self.recipients[room.name] = user_ids
+        return room, message, user_ids, get_card(self.user.id)
+
+    def get_room_user_ids(self, room_id):
+        """
+        Return the ids of the non-blocking users of the given room
+        """
+        return list(UserRoomStatus.objects.filter(room_id=room_id, block=False).values_list(
+            'user_id', flat=True))
+
+    async def get_recipients(self, room_name):
+        """
+        Return the ids of the users to deliver the room's messages to in user delivery,
+        loaded once per connection, as the room groups are joined once in room delivery
+        """
+        if room_name not in self.recipients:
+            if self.async_db:
+                user_ids = await db.get_room_user_ids(self.rooms[room_name])
+            else:
+                user_ids = await database_sync_to_async(self.get_room_user_ids)(self.rooms[room_name])
+            self.recipients[room_name] = user_ids
+        return self.recipients[room_name]
 
     @database_sync_to_async
     def handle_chat_msg(self, content):
         """
         Create the new chat message
         """
-        Message.objects.create(
+        return Message.objects.create(
             user = self.user,
             room_id = self.rooms[content[TO]],
             content = content[BODY],
         )
+
+    async def save_chat_msg(self, content):
+        """
+        Create the new chat message, in the worker's write-behind buffer in buffered write
+        Return the id of the message, reserved right away when it is buffered
+        """
+        if not self.buffered:
+            return (await self.handle_chat_msg(content)).id
+        message = Message(
+            user_id = self.user.id,
+            room_id = self.rooms[content[TO]],
+            content = content[BODY],
+        )
+        await get_buffer().add(message)
+        return message.id
+
+    async def handle_chat_read(self, content):
+        """
+        Record that self.user read the given room up to the message id of the receipt,
+        or the last message forwarded in the room without one, the receipts are written
+        at most once per CHAT_READ_INTERVAL seconds, only the latest one of each room
+        """
+        if content[TO] not in self.rooms:
+            return
+        room_id = self.rooms[content[TO]]
+        try:
+            cursor = int(content.get('id') or self.seen.get(content[TO], 0))
+        except (TypeError, ValueError):
+            return
+        if room_id in self.reads:
+            cursor = max(cursor, self.reads[room_id][1])
+        self.reads[room_id] = (timezone.now(), cursor)
+        if settings.CHAT_READ_CACHE:
+            await self.cache_receipt(room_id, cursor)
+        if self.read_timer is None:
+            self.read_timer = asyncio.get_running_loop().call_later(
+                settings.CHAT_READ_INTERVAL, self.flush_reads_later)
+        return
+
+    @sync_to_async(thread_sensitive=False)
+    def cache_receipt(self, room_id, cursor):
+        """
+        Cache the read receipt until it is written, and drop the user's cached unread flag
+        Only touches the cache, so it runs outside the thread serializing the database access
+        """
+        cache_read(self.user.id, room_id, cursor)
+        mark_read(self.user)
+        return
+
+    def flush_reads_later(self):
+        """
+        Timer callback, schedule writing the read receipts on the event loop
+        """
+        self.read_timer = None
+        asyncio.ensure_future(self.flush_reads())
+        return
+
+    async def flush_reads(self):
+        """
+        Write the pending read receipts, then drop the cached ones of the rooms not read again meanwhile
+        """
+        if self.read_timer is not None:
+            self.read_timer.cancel()
+            self.read_timer = None
+        reads, self.reads = self.reads, {}
+        if not reads:
+            return
+        if self.async_db:
+            for room_id, (when, cursor) in reads.items():
+                await db.read_room(self.user.id, room_id, when, cursor)
+            await sync_to_async(mark_read, thread_sensitive=False)(self.user)
+        else:
+            await self.save_reads(reads)
+        await sync_to_async(forget_reads, thread_sensitive=False)(
+            self.user.id, [room_id for room_id in reads if room_id not in self.reads])
         return
 
     @database_sync_to_async
-    def handle_chat_read(self, content):
+    def save_reads(self, reads):
         """
-        Update self.user's last view status for the given room
+        Advance self.user's read cursors of the given rooms, one UPDATE per room
         """
-        if content[TO] in self.rooms:
-            stat = UserRoomStatus.objects.get(
-                user = self.user,
-                room_id = self.rooms[content[TO]]
-            )
-            stat.update_last_view()
+        for room_id, (when, cursor) in reads.items():
+            UserRoomStatus.objects.read_room(self.user.id, room_id, when, cursor)
+        mark_read(self.user)
+        return
+
+    def get_missed_messages(self, cursors, since, after=0):
+        """
+        Return the messages of self.user's rooms newer than the room's cursor and after, by id
+        @param  cursors: {room id: id of the last message seen}
+        @param  since: id of the last message seen in the rooms without a cursor
+        """
+        if not self.rooms:
+            return Message.objects.none()
+        missed = Q()
+        for room_id in self.rooms.values():
+            missed |= Q(room_id=room_id, id__gt=max(cursors.get(room_id, since), after))
+        return Message.objects.filter(missed).order_by('id')
+
+    @database_sync_to_async
+    def count_missed_messages(self, cursors, since, limit):
+        """
+        Return the number of missed messages, counting up to limit only
+        """
+        return self.get_missed_messages(cursors, since)[:limit].count()
+
+    @database_sync_to_async
+    def get_sync_batch(self, cursors, since, after, known):
+        """
+        Return the next CHAT_SYNC_BATCH missed messages with an id above after, as compact dicts,
+        the sender's info is added for the rooms unknown to the client
+        """
+        messages = self.get_missed_messages(cursors, since, after).select_related(
+            'room').with_cards()[:settings.CHAT_SYNC_BATCH]
+        batch = []
+        for message in messages:
+            msg = {'id': message.id, FROM: message.user_card['username'], TO: message.room.name,
+                BODY: message.content}
+            if message.room.name not in known:
+                msg['user_info'] = message.user_card
+            batch.append(msg)
+        return batch
+
+    async def handle_chat_sync(self, body):
+        """
+        Stream the messages missed since the last ones seen by the client, in batches of
+        CHAT_SYNC_BATCH messages, then a done frame, or a reset frame when more than
+        CHAT_SYNC_LIMIT messages were missed and the client should reload instead
+        @param  body: {'since': id of the last message seen in any room,
+                       'rooms': {room name: id of the last message seen in the room}}
+        """
+        try:
+            since = int(body.get('since') or 0)
+            known = body.get('rooms') or {}
+            cursors = {self.rooms[name]: int(id or 0) for name, id in known.items()
+                if name in self.rooms}
+        except (AttributeError, TypeError, ValueError):
+            return
+        if self.buffered:
+            # the missed messages are read from the database
+            await get_buffer().flush()
+        if await self.count_missed_messages(cursors, since, settings.CHAT_SYNC_LIMIT + 1) \
+                > settings.CHAT_SYNC_LIMIT:
+            await self.send_json({TYPE: self.CHAT_SYNC, 'reset': True})
+            return
+        after = 0
+        while True:
+            batch = await self.get_sync_batch(cursors, since, after, known)
+            if batch:
+                await self.send_json({TYPE: self.CHAT_SYNC, 'messages': batch})
+                after = batch[-1]['id']
+            if len(batch) < settings.CHAT_SYNC_BATCH:
+                break
+        await self.send_json({TYPE: self.CHAT_SYNC, 'done': True})
         return
 
     async def receive_json(self, content):
@@ -97,49 +328,49 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         room_name = content.get(TO)
         type = content.get(TYPE)
         body = content.get(BODY)
-        if not type or not room_name or not body or not user:
+        if type == self.CHAT_SYNC:
+            await self.handle_chat_sync(body)
+            return
+        elif not type or not room_name or not body or not user:
             return
         elif type == self.CHAT_NEW:
-            await self.handle_chat_new(content)
+            room, message, user_ids, user_info = await self.handle_chat_new(content)
+            content['id'] = message.id
+            content['room_id'] = room.id
+            content['user_info'] = user_info
+            for user_id in user_ids:
+                await self.channel_layer.group_send(self.user_group(user_id), content)
+            return
         elif type == self.CHAT_MSG:
-            await self.handle_chat_msg(content)
+            if room_name not in self.rooms:
+                return
+            content['id'] = await self.save_chat_msg(content)
+            if not self.per_user:
+                await self.channel_layer.group_send(room_name, content)
+                return
+            for user_id in await self.get_recipients(room_name):
+                await self.channel_layer.group_send(self.user_group(user_id), content)
         elif type == self.CHAT_READ:
             await self.handle_chat_read(content)
-            return
-
-        await self.channel_layer.group_send(
-            self.BASE_CHANNEL if type == self.CHAT_NEW else room_name,
-            content,
-        )
         return
 
-    @database_sync_to_async
-    def get_user_info(self, username):
-        user = User.objects.get(username=username)
-        return {
-            'username': user.username,
-            'name': user.name,
-            'img_url': user.profile_image_url,
-        }
-
     async def chat_new(self, event):
         """
-        Add user to new group if not blocking, then forward event to client
-        """
-        if self.user.username in event[TO].split('-'):
-            room = await database_sync_to_async(Room.objects.get)(name=event[TO])
-            stat = await database_sync_to_async(room.get_user_stat)(self.user)
-            if stat.block:
-                return  # reject if self.user is blocking new msg
-            self.rooms[room.name] = room.id
-            await self.channel_layer.group_add(room.name, self.channel_name)
-            event['user_info'] = await self.get_user_info(event[FROM])
-            await self.send_json(event)
+        Add the new room to the user's rooms, and its group in room delivery,
+        then forward event to client
+        Only sent to the user groups of the non-blocking participants
+        """
+        if event[TO] not in self.rooms:
+            self.rooms[event[TO]] = event['room_id']
+            if not self.per_user:
+                await self.channel_layer.group_add(event[TO], self.channel_name)
+        await self.chat_message(event)
         return
 
     async def chat_message(self, event):
         """
-        Forward event to client
+        Forward event to client, remembering its id for the read receipts without one
         """
+        self.seen[event[TO]] = max(self.seen.get(event[TO], 0), event['id'])
         await self.send_json(event)
         return
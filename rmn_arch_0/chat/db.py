@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.db import connections
+
+import asyncio
+import asyncpg
+
+from .models import Message, Room, UserRoomStatus, recipients, summarize
+
+
+# one connection pool per event loop, i.e. per worker process
+_pools = {}
+
+ROOM = Room._meta.db_table
+STATUS = UserRoomStatus._meta.db_table
+MESSAGE = Message._meta.db_table
+
+
+async def create_pool():
+    """
+    Return a new asyncpg pool of CHAT_DB_POOL_SIZE connections to the default database
+    """
+    db = connections['default'].settings_dict
+    return await asyncpg.create_pool(
+        host=db['HOST'] or None,
+        port=int(db['PORT']) if db['PORT'] else None,
+        user=db['USER'],
+        password=db['PASSWORD'],
+        database=db['NAME'],
+        min_size=1,
+        max_size=settings.CHAT_DB_POOL_SIZE,
+    )
+
+
+async def get_pool():
+    """
+    Return the pool of the running event loop, created on first use
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _pools:
+        # store the task so concurrent first uses share the same pool
+        _pools[loop] = loop.create_task(create_pool())
+    return await _pools[loop]
+
+
+async def close_pool():
+    """
+    Close the pool of the running event loop, if any
+    """
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await (await pool).close()
+    return
+
+
+async def get_rooms(user_id):
+    """
+    Return {room name: room id} of the user's non-blocked rooms with messages,
+    the rooms of RoomManager.get_user_rooms
+    """
+    pool = await get_pool()
+    rows = await pool.fetch(f'''
+        SELECT r.name, r.id FROM {ROOM} r JOIN {STATUS} s ON s.room_id = r.id
+        WHERE s.user_id = $1 AND NOT s.block AND r.last_message_id IS NOT NULL
+        ''', user_id)
+    return {row['name']: row['id'] for row in rows}
+
+
+async def get_room_user_ids(room_id):
+    """
+    Return the ids of the non-blocking users of the given room
+    """
+    pool = await get_pool()
+    rows = await pool.fetch(
+        f'SELECT user_id FROM {STATUS} WHERE room_id = $1 AND NOT block', room_id)
+    return [row['user_id'] for row in rows]
+
+
+async def reserve_ids(count):
+    """
+    Take count ids from the message id sequence, as MessageManager.reserve_ids
+    """
+    pool = await get_pool()
+    rows = await pool.fetch(
+        "SELECT nextval(pg_get_serial_sequence($1, 'id')) AS id FROM generate_series(1, $2)",
+        MESSAGE, count)
+    return sorted(row['id'] for row in rows)
+
+
+async def save_messages(messages):
+    """
+    Insert the given messages, whose ids are reserved, and update the room summaries in one
+    transaction, the queries of MessageManager.bulk_save with one UPDATE per table
+    @return: ids of the users to flag unread once saved
+    """
+    newest, cursors, senders = summarize(messages)
+    pool = await get_pool()
+    async with pool.acquire() as connection, connection.transaction():
+        await connection.execute(f'''
+            INSERT INTO {MESSAGE} (id, user_id, room_id, content, created)
+            SELECT m.id, m.user_id, m.room_id, m.content, now()
+            FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[])
+                AS m(id, user_id, room_id, content)
+            ''', [m.id for m in messages], [m.user_id for m in messages],
+            [m.room_id for m in messages], [m.content for m in messages])
+        await connection.execute(f'''
+            UPDATE {STATUS} s SET read_cursor = GREATEST(s.read_cursor, c.cursor)
+            FROM unnest($1::bigint[], $2::bigint[], $3::bigint[]) AS c(room_id, user_id, cursor)
+            WHERE s.room_id = c.room_id AND s.user_id = c.user_id
+            ''', [room_id for room_id, _ in cursors], [user_id for _, user_id in cursors],
+            list(cursors.values()))
+        await connection.execute(f'''
+            UPDATE {ROOM} r SET last_message_id = n.id
+            FROM unnest($1::bigint[], $2::bigint[]) AS n(room_id, id)
+            WHERE r.id = n.room_id AND (r.last_message_id IS NULL OR r.last_message_id < n.id)
+            ''', list(newest), list(newest.values()))
+        members = await connection.fetch(
+            f'SELECT room_id, user_id FROM {STATUS} WHERE room_id = ANY($1) AND NOT block',
+            list(newest))
+    return recipients(senders, ((row['room_id'], row['user_id']) for row in members))
+
+
+async def read_room(user_id, room_id, when, cursor=None):
+    """
+    Mark the messages of the room up to the cursor, or created up to when without one,
+    read by the user, the same UPDATE as UserRoomStatusManager.read_room
+    """
+    pool = await get_pool()
+    if cursor is None:
+        seen, args = 'created <= $3', ()
+    else:
+        seen, args = 'id <= $4', (cursor,)
+    await pool.execute(f'''
+        UPDATE {STATUS} SET
+            last_view = GREATEST(last_view, $3),
+            read_cursor = GREATEST(read_cursor, COALESCE((
+                SELECT id FROM {MESSAGE} WHERE room_id = $2 AND {seen}
+                ORDER BY id DESC LIMIT 1), 0))
+        WHERE user_id = $1 AND room_id = $2
+        ''', user_id, room_id, when, *args)
+    return
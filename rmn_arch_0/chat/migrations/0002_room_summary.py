@@ -0,0 +1,46 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:50
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_summaries(apps, schema_editor):
+    """
+    Set the last message of existing rooms, and the read cursors from last_view
+    """
+    Room = apps.get_model('chat', 'Room')
+    Message = apps.get_model('chat', 'Message')
+    UserRoomStatus = apps.get_model('chat', 'UserRoomStatus')
+    Room.objects.update(last_message=models.Subquery(
+        Message.objects.filter(room_id=models.OuterRef('pk')).order_by('-id').values('id')[:1]))
+    UserRoomStatus.objects.update(read_cursor=Coalesce(models.Subquery(
+        Message.objects.filter(
+            models.Q(created__lt=models.OuterRef('last_view')) | models.Q(user_id=models.OuterRef('user_id')),
+            room_id=models.OuterRef('room_id'),
+        ).order_by('-id').values('id')[:1]), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_message',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='userroomstatus',
+            name='read_cursor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='chat_messag_room_id_12c833_idx'),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,49 @@
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models, connection
-from django.db.models import OuterRef, Subquery
+from django.db import connection, models, transaction
+from django.db.models import BooleanField, DateTimeField, ExpressionWrapper, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 
+from rmn_arch_0.users.cards import CardsQuerySet
 from rmn_arch_0.users.models import User, Settings
+from .unread import cached_reads, mark_read, mark_unread
+
+
+def cached_read_room_ids(user, unread):
+    """
+    Return the ids of the rooms whose last message the user read according to the read receipts
+    cached until their read cursors are written
+    @param  unread: {room id: id of the last message} of the rooms unread in the database
+    """
+    reads = cached_reads(user.id, list(unread))
+    return {room_id for room_id, cursor in reads.items() if cursor >= unread[room_id]}
+
+
+def summarize(messages):
+    """
+    Return what the room summaries need from the given saved messages
+    @return: ({room id: newest message id}, {(room id, sender id): newest message id},
+              {room id: set of sender ids})
+    """
+    newest = {}
+    cursors = {}
+    senders = {}
+    for message in messages:
+        newest[message.room_id] = max(newest.get(message.room_id, 0), message.id)
+        key = (message.room_id, message.user_id)
+        cursors[key] = max(cursors.get(key, 0), message.id)
+        senders.setdefault(message.room_id, set()).add(message.user_id)
+    return newest, cursors, senders
+
+
+def recipients(senders, members):
+    """
+    Return the ids of the members to flag unread, all but those who only sent the new messages
+    @param  senders: {room id: set of sender ids}, as returned by summarize
+    @param  members: (room id, user id) of the non-blocking members of the rooms
+    """
+    return {user_id for room_id, user_id in members if senders[room_id] != {user_id}}
 
 
 class RoomManager(models.Manager):
@@ -44,24 +84,6 @@ class RoomManager(models.Manager):
         user1 = User.objects.get(username=user1_name)
         return self.create(user0, user1)
 
-    ROOM_AND_MSG_QUERY = """
-        SELECT
-            DISTINCT ON (m.room_id)
-            r.*,
-            m.id AS last_msg,
-            m.content AS last_msg_content,
-            CASE 
-                WHEN (m.user_id <> %s AND m.created >= s.last_view) THEN true
-                ELSE false
-            END AS unread
-        FROM chat_message m
-            INNER JOIN chat_room r ON m.room_id = r.id
-            INNER JOIN chat_userroomstatus s ON r.id = s.room_id AND s.user_id = %s
-        WHERE
-            s.block = false
-        ORDER BY m.room_id, m.id desc
-    """
-
     def get_user_rooms(self, user):
         """
         Returns all non-block rooms for given user order by last message sent
@@ -71,33 +93,41 @@ class RoomManager(models.Manager):
             unread              bool, whether the message has been read
         NOTE implementation will only return rooms that has at least one message
         """
-        return self.raw(
-            f"""
-            SELECT sub_query.* FROM (
-                {self.ROOM_AND_MSG_QUERY}
-            ) as sub_query
-            ORDER BY last_msg desc;
-            """,
-            (user.id, user.id)
-        )
+        unread = Q(last_message_id__gt=F('userroomstatus__read_cursor'))
+        if settings.CHAT_READ_CACHE:
+            read = cached_read_room_ids(user, dict(self.unread_statuses(user).values_list(
+                'room_id', 'room__last_message_id')))
+            if read:
+                unread &= ~Q(pk__in=read)
+        return self.filter(
+            userroomstatus__user=user,
+            userroomstatus__block=False,
+            last_message__isnull=False,
+        ).annotate(
+            last_msg=F('last_message_id'),
+            last_msg_content=F('last_message__content'),
+            unread=ExpressionWrapper(unread, output_field=BooleanField()),
+        ).order_by('-last_message_id')
 
     def has_new_message(self, user):
         """
         Return True if given user has new unread message, False otherwise
         """
-        with connection.cursor() as cursor:
-            cursor.execute(
-                f"""
-                SELECT 1 FROM (
-                    {self.ROOM_AND_MSG_QUERY}
-                ) as sub_query
-                WHERE sub_query.unread = true
-                LIMIT 1;
-                """,
-                (user.id, user.id)
-            )
-            res = cursor.fetchone()
-        return True if res else False
+        stats = self.unread_statuses(user)
+        if not settings.CHAT_READ_CACHE:
+            return stats.exists()
+        unread = dict(stats.values_list('room_id', 'room__last_message_id'))
+        return len(unread) > len(cached_read_room_ids(user, unread))
+
+    def unread_statuses(self, user):
+        """
+        Return the UserRoomStatuses of given user's non-blocked rooms with messages past the cursor
+        """
+        return UserRoomStatus.objects.filter(
+            user=user,
+            block=False,
+            room__last_message_id__gt=F('read_cursor'),
+        )
 
 
 class Room(models.Model):
@@ -105,6 +135,9 @@ class Room(models.Model):
     Individual Chat Room
     """
     name = models.CharField(max_length=64, unique=True)
+    # summary of the room, maintained by MessageManager.update_summaries
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, blank=True, null=True,
+        editable=False, related_name='+')
 
     objects = RoomManager()
 
@@ -131,6 +164,27 @@ class Room(models.Model):
         return self.userroomstatus_set.exclude(user=user)[0]
 
 
+class UserRoomStatusManager(models.Manager):
+    def read_room(self, user_id, room_id, when, cursor=None):
+        """
+        Mark the messages of the room up to the cursor, or created up to when without one,
+        read by the user in a single UPDATE, the last view and read cursor only move forward
+        so late or repeated receipts are harmless
+        @param  cursor: id of the last message seen, only ids of the room's messages are kept
+        @return: number of statuses updated
+        """
+        seen = Message.objects.filter(room_id=OuterRef('room_id'))
+        if cursor is None:
+            seen = seen.filter(created__lte=when)
+        else:
+            seen = seen.filter(id__lte=cursor)
+        return self.filter(user_id=user_id, room_id=room_id).update(
+            last_view=Greatest(F('last_view'), Value(when, output_field=DateTimeField())),
+            read_cursor=Greatest(F('read_cursor'), Coalesce(Subquery(
+                seen.order_by('-id').values('id')[:1]), 0)),
+        )
+
+
 class UserRoomStatus(models.Model):
     """
     Status of individual users in a particular chat room
@@ -138,8 +192,11 @@ class UserRoomStatus(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
     last_view = models.DateTimeField(auto_now_add=True)
+    read_cursor = models.BigIntegerField(default=0)     # id of the last message read
     block = models.BooleanField(default=False)
-    
+
+    objects = UserRoomStatusManager()
+
     class Meta:
         verbose_name_plural = 'User room statuses'
 
@@ -148,18 +205,85 @@ class UserRoomStatus(models.Model):
 
     def update_last_view(self):
         """
-        Updates when the user view the room
+        Updates when the user view the room, marking the room's messages read
         """
         self.last_view = timezone.now()
-        self.save()
+        UserRoomStatus.objects.read_room(self.user_id, self.room_id, self.last_view)
+        self.refresh_from_db(fields=['read_cursor'])
         return
 
     def set_block(self, block):
         """
-        Set the user blocking status
+        Set the user blocking status, the user's cached unread flag is dropped
         """
         self.block = block
         self.save()
+        mark_read(self.user)
+        return
+
+
+class MessageQuerySet(CardsQuerySet):
+    def delete(self):
+        """
+        Override delete to point the rooms of the deleted messages to their newest remaining one,
+        in one UPDATE for all of them
+        """
+        with transaction.atomic():
+            room_ids = set(self.values_list('room_id', flat=True))
+            deleted = super().delete()
+            Message.objects.reset_summaries(room_ids)
+        return deleted
+
+
+class MessageManager(models.Manager.from_queryset(MessageQuerySet)):
+    def update_summaries(self, messages):
+        """
+        Point the rooms' last_message to the newest of the given messages, advance
+        the senders' read cursors past their own messages, and flag the recipients unread
+        @param  messages: list of saved Messages
+        """
+        newest, cursors, senders = summarize(messages)
+        for (room_id, user_id), cursor in cursors.items():
+            UserRoomStatus.objects.filter(room_id=room_id, user_id=user_id).update(
+                read_cursor=Greatest(F('read_cursor'), cursor))
+        for room_id, message_id in newest.items():
+            Room.objects.filter(
+                Q(last_message__isnull=True) | Q(last_message_id__lt=message_id), pk=room_id,
+            ).update(last_message_id=message_id)
+        mark_unread(recipients(senders, UserRoomStatus.objects.filter(
+            room_id__in=newest, block=False).values_list('room_id', 'user_id')))
+        return
+
+    def reserve_ids(self, count):
+        """
+        Take count ids from the message id sequence in one query, for messages saved later
+        @return: the ids, in increasing order
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [self.model._meta.db_table, count])
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def bulk_save(self, messages):
+        """
+        Insert the given unsaved messages in one query, in order, and update the room summaries
+        in the same transaction, their ids are set once saved unless reserved beforehand
+        @param  messages: list of unsaved Messages
+        @return: the saved messages
+        """
+        with transaction.atomic():
+            messages = self.bulk_create(messages)
+            self.update_summaries(messages)
+        return messages
+
+    def reset_summaries(self, room_ids):
+        """
+        Point the rooms' last_message to their newest remaining message, used after deletions,
+        deleted messages set it to NULL meanwhile
+        """
+        Room.objects.filter(pk__in=room_ids).update(last_message=Subquery(
+            self.filter(room_id=OuterRef('pk')).order_by('-id').values('id')[:1]))
         return
 
 
@@ -172,5 +296,32 @@ class Message(models.Model):
     content = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
+    objects = MessageManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'id']),
+        ]
+
     def __str__(self):
         return f'Message for {self.room} by {self.user}'
+
+    def save(self, **kwargs):
+        """
+        Override save to update the room summary in the same transaction
+        """
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(**kwargs)
+            if adding:
+                Message.objects.update_summaries([self])
+        return
+
+    def delete(self, **kwargs):
+        """
+        Override delete to point the room to its newest remaining message
+        """
+        with transaction.atomic():
+            deleted = super().delete(**kwargs)
+            Message.objects.reset_summaries([self.room_id])
+        return deleted
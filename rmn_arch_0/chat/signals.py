@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from rmn_arch_0.users.models import User
+from .models import Message, UserRoomStatus
+
+
+@receiver(pre_delete, sender=User)
+def remember_user_rooms(sender, instance, **kwargs):
+    """
+    Remember the rooms of a deleted user, whose messages are deleted with them
+    """
+    instance._chat_room_ids = list(UserRoomStatus.objects.filter(user=instance).values_list(
+        'room_id', flat=True))
+    return
+
+
+@receiver(post_delete, sender=User)
+def reset_user_rooms(sender, instance, **kwargs):
+    """
+    Point the rooms of a deleted user to their newest remaining message, once for all of them
+    instead of once per deleted message
+    """
+    Message.objects.reset_summaries(getattr(instance, '_chat_room_ids', []))
+    return
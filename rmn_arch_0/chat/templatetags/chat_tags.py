@@ -1,11 +1,11 @@
 from django import template
-from rmn_arch_0.chat.models import Room
+from rmn_arch_0.chat.unread import has_unread
 
 register = template.Library()
 
 def has_new_message(user):
     if user.is_authenticated:
-        return Room.objects.has_new_message(user)
+        return has_unread(user)
     else:
         return False
 
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+UNREAD_TIMEOUT = 60 * 60 * 24
+
+
+def unread_key(user_id):
+    return f'chat_unread:{user_id}'
+
+
+def read_key(user_id, room_id):
+    return f'chat_read:{user_id}:{room_id}'
+
+
+def has_unread(user):
+    """
+    Return whether user has new unread message, from the cache, the database on a miss
+    """
+    from .models import Room
+
+    unread = cache.get(unread_key(user.id))
+    if unread is None:
+        unread = Room.objects.has_new_message(user)
+        cache.set(unread_key(user.id), unread, UNREAD_TIMEOUT)
+    return unread
+
+
+def flag_unread(user_ids):
+    """
+    Flag the users as having unread messages
+    """
+    keys = {unread_key(user_id): True for user_id in user_ids}
+    if keys:
+        cache.set_many(keys, UNREAD_TIMEOUT)
+    return
+
+
+def mark_unread(user_ids):
+    """
+    Flag the users as having unread messages once the current transaction commits
+    """
+    if user_ids:
+        transaction.on_commit(lambda: flag_unread(user_ids))
+    return
+
+
+def mark_read(user):
+    """
+    Drop the flag of user after reading a room, recomputed on the next has_unread
+    as other rooms may still be unread
+    """
+    cache.delete(unread_key(user.id))
+    return
+
+
+def cache_read(user_id, room_id, cursor):
+    """
+    Remember that user read the room up to the message id cursor, consulted by the unread computation
+    until the debounced read receipt is written, does nothing unless CHAT_READ_CACHE is set
+    """
+    if not settings.CHAT_READ_CACHE:
+        return
+    cache.set(read_key(user_id, room_id), cursor, UNREAD_TIMEOUT)
+    return
+
+
+def cached_reads(user_id, room_ids):
+    """
+    Return {room id: id of the last message read} of the read receipts cached for user
+    in the given rooms
+    """
+    if not settings.CHAT_READ_CACHE or not room_ids:
+        return {}
+    keys = {read_key(user_id, room_id): room_id for room_id in room_ids}
+    return {keys[key]: cursor for key, cursor in cache.get_many(list(keys)).items()}
+
+
+def forget_reads(user_id, room_ids):
+    """
+    Drop the cached read receipts of user in the given rooms, once they are written
+    """
+    if not settings.CHAT_READ_CACHE or not room_ids:
+        return
+    cache.delete_many([read_key(user_id, room_id) for room_id in room_ids])
+    return
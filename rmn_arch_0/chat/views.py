@@ -1,11 +1,12 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse, HttpResponse
+from django.http import Http404, JsonResponse, HttpResponse
+from django.db.models import Prefetch
 from django.shortcuts import render, get_object_or_404
 from django.views.generic import View, ListView
 
 import json
 
-from .models import Room, Message
+from .models import Room, Message, UserRoomStatus
 from rmn_arch_0.users.models import User
 
 
@@ -18,21 +19,22 @@ class ChatView(LoginRequiredMixin, ListView):
     context_object_name = 'rooms'
 
     def get_queryset(self):
-        return Room.objects.get_user_rooms(self.request.user)
+        return Room.objects.get_user_rooms(self.request.user).prefetch_related(Prefetch(
+            'userroomstatus_set', queryset=UserRoomStatus.objects.select_related('user__profile')))
 
     def get_context_data(self, tar_user=None, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
         if tar_user != None:
             tar_room_name = Room.get_room_name(user, tar_user)
-            # if not self.object_list.filter(name=tar_room_name).exists():
-            # TODO temp fix, Room.object_list should be a query set
             room_names = [room.name for room in self.object_list]
             if tar_room_name not in room_names:
                 context['new_room_name'] = tar_room_name
                 context['tar_user'] = tar_user
         for room in self.object_list:
-            room.other_user = room.get_other_user_stat(user).user
+            # from the prefetched statuses, instead of get_other_user_stat per room
+            room.other_user = [stat.user for stat in room.userroomstatus_set.all()
+                if stat.user_id != user.id][0]
             if tar_user == room.other_user:
                 room.extra_css_class = ' active'
         return context
@@ -48,16 +50,44 @@ class ChatView(LoginRequiredMixin, ListView):
 
 class ChatContentAJAXView(LoginRequiredMixin, ListView):
     """
-    Get given chat room content, TODO paginate by timestamp
+    Get given chat room content, the newest paginate_by messages
+        optionally accepts a before url param, the id of the oldest message loaded,
+        to get the older messages only when scrolling back
     """
     template_name = 'chat/chat_content.html'
+    page_template_name = 'chat/chat_messages.html'
     context_object_name = 'msgs'
+    paginate_by = 30
+    cursor_kwarg = 'before'
 
     def get_queryset(self):
         self.room = get_object_or_404(Room, name=self.kwargs['room_name'])
-        return self.room.message_set.all()
+        queryset = self.room.message_set.with_cards().order_by('-id')
+        before = self.request.GET.get(self.cursor_kwarg)
+        if before:
+            try:
+                queryset = queryset.filter(id__lt=int(before))
+            except ValueError:
+                raise Http404('Invalid cursor')
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Fetch one extra message to know whether older messages exist, in a single LIMIT query
+        Returns the messages in chronological order
+        """
+        msgs = list(queryset[:page_size + 1])
+        self.before = msgs[page_size - 1].id if len(msgs) > page_size else None
+        msgs = msgs[:page_size][::-1]
+        return (None, None, msgs, self.before is not None)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['id'] = self.room.name
+        context['before'] = self.before
         return context
+
+    def get_template_names(self):
+        if self.request.GET.get(self.cursor_kwarg):
+            return [self.page_template_name]
+        return [self.template_name]
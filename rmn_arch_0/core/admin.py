@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import OutboxEmail
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    date_hierarchy = 'created'
+    list_display = ['subject', 'status', 'attempts', 'send_after', 'created',]
+    list_filter = ['status',]
@@ -0,0 +1,79 @@
+from django.core.files.base import ContentFile
+
+from io import BytesIO
+import os
+from PIL import Image, ImageOps
+
+
+# name: (width, height, crop), cropped variants fill the box exactly,
+# the others are scaled down to fit inside it
+VARIANTS = {
+    'tile': (480, 480, True),
+    'modal': (1080, 1080, False),
+    'avatar': (96, 96, True),
+}
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXT = 'webp'
+VARIANT_QUALITY = 80
+
+
+def variant_name(name, variant):
+    """
+    Storage name of the given variant, stored next to the original, keeping its extension so
+    originals differing only by it do not share variants
+    e.g. uploads/posts/<uuid>/a.jpg -> uploads/posts/<uuid>/a_jpg_tile.webp
+    """
+    root, ext = os.path.splitext(name)
+    if ext:
+        root = f'{root}_{ext[1:]}'
+    return f'{root}_{variant}.{VARIANT_EXT}'
+
+
+def variant_url(file, variant):
+    """
+    Return the url of the given variant of file
+    """
+    return file.storage.url(variant_name(file.name, variant))
+
+
+def resize(image, variant):
+    """
+    Return a resized copy of image for the given variant
+    """
+    width, height, crop = VARIANTS[variant]
+    if crop:
+        return ImageOps.fit(image, (width, height), Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail((width, height), Image.LANCZOS)
+    return image
+
+
+def make_variants(file, variants):
+    """
+    Generate and store the given variants of file, overwriting existing ones
+    @param file: FieldFile of the original image
+    @param variants: list of variant names in VARIANTS
+    @return: list of the stored variant names
+    """
+    with file.open('rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    names = []
+    for variant in variants:
+        buffer = BytesIO()
+        resize(image, variant).save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+        name = variant_name(file.name, variant)
+        # storage.save picks a new name if taken
+        file.storage.delete(name)
+        names.append(file.storage.save(name, ContentFile(buffer.getvalue())))
+    return names
+
+
+def delete_variants(file, variants=VARIANTS):
+    """
+    Delete the given variants of file, missing ones are ignored
+    """
+    for variant in variants:
+        file.storage.delete(variant_name(file.name, variant))
+    return
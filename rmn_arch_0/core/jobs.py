@@ -0,0 +1,29 @@
+from django.apps import apps
+from django.conf import settings
+
+from datetime import timedelta
+from importlib import import_module
+
+from rmn_arch_0.jobs.registry import job, periodic
+
+
+@job
+def make_image_variants(model, pk):
+    """
+    Generate the image variants of the given ImageVariantsMixIn instance
+    @param model: model label, e.g. posts.PostImage
+    @param pk: primary key of the instance, skipped if deleted meanwhile
+    """
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    if instance is not None and not instance.variants_ready:
+        instance.make_variants()
+    return
+
+
+@periodic(timedelta(days=1))
+def clear_expired_sessions():
+    """
+    Delete the expired sessions in bulk, same as the clearsessions command
+    """
+    import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
+    return
@@ -0,0 +1,24 @@
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .models import OutboxEmail
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """
+    Email backend writing messages to the OutboxEmail table instead of sending them,
+    so they are committed or rolled back with the current transaction and the request never
+    waits on the mail server; the send_outbox command delivers them with OUTBOX_EMAIL_BACKEND
+    """
+    def send_messages(self, email_messages):
+        """
+        Store the messages, return the number stored
+        """
+        emails = [OutboxEmail.from_message(message) for message in email_messages
+            if message.recipients()]
+        try:
+            OutboxEmail.objects.bulk_create(emails)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            return 0
+        return len(emails)
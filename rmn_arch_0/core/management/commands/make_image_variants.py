@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from rmn_arch_0.posts.models import PostImage
+from rmn_arch_0.users.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Generate the pending resized image variants of post and profile images, e.g. for existing uploads'
+    models = [PostImage, Profile]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+            help='Number of pending images loaded per query')
+
+    def process(self, model, batch_size):
+        """
+        Generate the variants of all pending instances of model, return the number processed
+        """
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(model.pending_variants().filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            for instance in batch:
+                try:
+                    instance.make_variants()
+                    total += 1
+                except Exception as e:
+                    # left pending, retried on the next run
+                    self.stderr.write(f'Failed to process {instance}: {e!r}')
+            last_id = batch[-1].id
+        return total
+
+    def handle(self, *args, **options):
+        for model in self.models:
+            total = self.process(model, options['batch_size'])
+            self.stdout.write(f'Generated variants for {total} {model._meta.verbose_name_plural}')
+        return
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+import time
+
+from rmn_arch_0.core.models import OutboxEmail
+
+
+class Command(BaseCommand):
+    help = 'Deliver the emails stored by OutboxEmailBackend in batches, each over one connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+            help='Number of emails claimed and sent per connection')
+        parser.add_argument('--rate', type=float, default=settings.OUTBOX_RATE_LIMIT,
+            help='Maximum number of emails sent per second, 0 for unlimited')
+        parser.add_argument('--interval', type=float, default=5,
+            help='Seconds to wait before polling again when no email is due')
+        parser.add_argument('--once', action='store_true',
+            help='Exit once no email is due instead of polling')
+
+    def handle(self, *args, **options):
+        connection = get_connection(settings.OUTBOX_EMAIL_BACKEND)
+        total = 0
+        while True:
+            count = OutboxEmail.objects.send_batch(
+                connection, options['batch_size'], options['rate'])
+            total += count
+            if count:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully processed {total} emails'))
+        return
@@ -0,0 +1,237 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import models, transaction
+from django.utils import timezone
+
+from base64 import b64decode, b64encode
+from datetime import timedelta
+import time
+import traceback
+
+from .images import make_variants, variant_url
+from .jobs import make_image_variants
+
+
+class ImageVariantsMixIn(models.Model):
+    """
+    Mixin for models with an image served as resized variants,
+    the variants are generated after upload by the make_image_variants job
+    """
+    IMAGE_FIELD = 'image'
+    VARIANTS = []
+
+    variants_ready = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the image name as loaded, used to detect a changed image on save
+        """
+        instance = super().from_db(db, field_names, values)
+        file = instance.__dict__.get(cls.IMAGE_FIELD)
+        instance._loaded_image = getattr(file, 'name', file)
+        return instance
+
+    @classmethod
+    def pending_variants(cls):
+        """
+        Return the queryset of instances whose variants are not generated yet
+        """
+        field = cls.IMAGE_FIELD
+        return cls.objects.filter(variants_ready=False).exclude(
+            **{f'{field}__isnull': True}).exclude(**{field: ''})
+
+    def variant_url(self, variant):
+        """
+        Return the url of the given variant once generated, the original image url until then
+        """
+        file = getattr(self, self.IMAGE_FIELD)
+        if self.variants_ready:
+            return variant_url(file, variant)
+        return file.url
+
+    def make_variants(self):
+        """
+        Generate the variants of the image and mark them ready
+        """
+        file = getattr(self, self.IMAGE_FIELD)
+        make_variants(file, self.VARIANTS)
+        # the image may have been replaced meanwhile, its variants are still pending then
+        type(self).objects.filter(pk=self.pk, **{self.IMAGE_FIELD: file.name}).update(
+            variants_ready=True)
+        self.variants_ready = True
+        return
+
+    def save(self, **kwargs):
+        """
+        Override save to mark the variants pending and enqueue their generation when the image changes
+        """
+        name = getattr(self, self.IMAGE_FIELD).name
+        changed = name != getattr(self, '_loaded_image', None)
+        if changed:
+            self.variants_ready = False
+        super().save(**kwargs)
+        if changed and name:
+            make_image_variants.enqueue(model=self._meta.label, pk=self.pk)
+        self._loaded_image = getattr(self, self.IMAGE_FIELD).name
+        return
+
+
+class OutboxEmailManager(models.Manager):
+    """
+    Custom manager for delivering OutboxEmails
+    """
+    def claim(self, batch_size):
+        """
+        Lock and return up to batch_size due emails, skipping the ones locked by other senders
+        Must be called in a transaction, the emails stay locked until it ends
+        """
+        return list(self.select_for_update(skip_locked=True).filter(
+            status=OutboxEmail.PENDING, send_after__lte=timezone.now()
+            ).order_by('send_after', 'id')[:batch_size])
+
+    def send_batch(self, connection, batch_size=None, rate=None):
+        """
+        Claim and send a batch of due emails over the given connection in one transaction
+        Sent emails are deleted, failed ones are retried with backoff up to OutboxEmail.MAX_ATTEMPTS
+        @param connection: email backend instance used to deliver, opened once for the batch
+        @param batch_size: maximum number of emails to send, OUTBOX_BATCH_SIZE by default
+        @param rate: maximum number of emails per second, OUTBOX_RATE_LIMIT by default, 0 for unlimited
+        @return: number of emails claimed
+        """
+        if batch_size is None:
+            batch_size = settings.OUTBOX_BATCH_SIZE
+        if rate is None:
+            rate = settings.OUTBOX_RATE_LIMIT
+        with transaction.atomic():
+            emails = self.claim(batch_size)
+            if not emails:
+                return 0
+            sent = []
+            failed = []
+            start = time.monotonic()
+            try:
+                connection.open()
+                for i, email in enumerate(emails):
+                    if rate:
+                        time.sleep(max(0, start + i / rate - time.monotonic()))
+                    try:
+                        connection.send_messages([email.to_message(connection)])
+                        sent.append(email.id)
+                    except Exception:
+                        email.fail(traceback.format_exc())
+                        failed.append(email)
+            except Exception:
+                # could not connect, retry everything not sent yet
+                error = traceback.format_exc()
+                for email in emails:
+                    if email.id not in sent and email not in failed:
+                        email.fail(error)
+                        failed.append(email)
+            finally:
+                connection.close()
+            self.filter(id__in=sent).delete()
+            self.bulk_update(failed, ['status', 'attempts', 'send_after', 'last_error'])
+        return len(emails)
+
+
+class OutboxEmail(models.Model):
+    """
+    Model for storing emails written by OutboxEmailBackend, delivered by the send_outbox command
+    """
+    PENDING = 'pending'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (FAILED, 'Failed'),
+    ]
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = timedelta(minutes=1)
+
+    subject = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list, blank=True)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    alternatives = models.JSONField(default=list, blank=True)
+    attachments = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=8, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = OutboxEmailManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after']),
+        ]
+
+    def __str__(self):
+        return f'Email {self.subject} to {", ".join(self.to)}'
+
+    @classmethod
+    def from_message(cls, message):
+        """
+        Return an unsaved OutboxEmail storing the given EmailMessage
+        Only (filename, content, mimetype) attachments are supported
+        """
+        attachments = []
+        for attachment in message.attachments:
+            if not isinstance(attachment, tuple):
+                raise ValueError('MIMEBase attachments can not be stored in the outbox')
+            filename, content, mimetype = attachment
+            if isinstance(content, str):
+                content = content.encode()
+            attachments.append([filename, b64encode(content).decode(), mimetype])
+        return cls(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email,
+            to=list(message.to),
+            cc=list(message.cc),
+            bcc=list(message.bcc),
+            reply_to=list(message.reply_to),
+            headers=message.extra_headers,
+            alternatives=[list(alt) for alt in getattr(message, 'alternatives', [])],
+            attachments=attachments,
+            )
+
+    def to_message(self, connection=None):
+        """
+        Return the stored email as an EmailMultiAlternatives
+        """
+        message = EmailMultiAlternatives(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email,
+            to=self.to,
+            cc=self.cc,
+            bcc=self.bcc,
+            reply_to=self.reply_to,
+            headers=self.headers,
+            alternatives=[tuple(alt) for alt in self.alternatives],
+            connection=connection,
+            )
+        for filename, content, mimetype in self.attachments:
+            message.attach(filename, b64decode(content), mimetype)
+        return message
+
+    def fail(self, error):
+        """
+        Record a failed attempt, the email is retried with exponential backoff until MAX_ATTEMPTS
+        """
+        self.attempts += 1
+        self.last_error = error
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            self.send_after = timezone.now() + self.RETRY_DELAY * 2 ** (self.attempts - 1)
+        return
@@ -0,0 +1,33 @@
+from django.contrib.postgres.search import SearchQuery
+
+import re
+
+
+# text search configurations, the search_vector triggers in the migrations use the same ones
+TEXT_CONFIG = 'english'     # descriptions, stemmed
+NAME_CONFIG = 'simple'      # usernames and names, only lower cased
+
+MAX_QUERY_LENGTH = 100
+
+
+def text_query(q):
+    """
+    Return the SearchQuery matching descriptions for the user input q, None if q is blank
+    q is parsed like a web search, i.e. words, "quoted phrases", or and -excluded words
+    """
+    q = q.strip()[:MAX_QUERY_LENGTH]
+    if not q:
+        return None
+    return SearchQuery(q, config=TEXT_CONFIG, search_type='websearch')
+
+
+def prefix_query(q):
+    """
+    Return the SearchQuery matching names starting with every word of the user input q,
+    e.g. 'jo sm' matches John Smith, None if q has no words
+    """
+    words = re.findall(r'\w+', q[:MAX_QUERY_LENGTH])
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), config=NAME_CONFIG,
+        search_type='raw')
@@ -0,0 +1,16 @@
+from django.dispatch import receiver
+
+from django_cleanup.signals import cleanup_pre_delete
+
+from .images import delete_variants
+
+
+@receiver(cleanup_pre_delete)
+def delete_image_variants(sender, file, **kwargs):
+    """
+    Delete the resized variants along with the original image,
+    on both instance deletion and image replacement
+    """
+    if file.name:
+        delete_variants(file)
+    return
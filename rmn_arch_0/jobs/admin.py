@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    date_hierarchy = 'created'
+    list_display = ['name', 'status', 'attempts', 'run_at', 'created',]
+    list_filter = ['status', 'name',]
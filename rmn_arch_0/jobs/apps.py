@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'rmn_arch_0.jobs'
+
+    def ready(self):
+        # import jobs.py of every app so their jobs are registered
+        autodiscover_modules('jobs')
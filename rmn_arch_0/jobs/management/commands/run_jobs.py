@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+import time
+
+from rmn_arch_0.jobs.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Run enqueued jobs as a worker, several workers can run concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10,
+            help='Number of jobs claimed and run per transaction')
+        parser.add_argument('--interval', type=float, default=1,
+            help='Seconds to wait before polling again when no job is due')
+        parser.add_argument('--once', action='store_true',
+            help='Exit once no job is due instead of polling')
+
+    def handle(self, *args, **options):
+        Job.objects.schedule_periodic()
+        total = 0
+        while True:
+            count = Job.objects.run_batch(options['batch_size'])
+            total += count
+            if count:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully ran {total} jobs'))
+        return
@@ -0,0 +1,124 @@
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from datetime import timedelta
+import traceback
+
+
+class JobManager(models.Manager):
+    """
+    Custom manager for enqueuing and running Jobs
+    """
+    def enqueue(self, name, delay=None, **payload):
+        """
+        Enqueue a job, it is visible to workers once the current transaction commits
+        @param name: registered name of the job
+        @param delay: optional timedelta to wait before running the job
+        @param payload: json serializable keyword arguments of the job
+        @return: the created Job
+        """
+        run_at = timezone.now()
+        if delay is not None:
+            run_at += delay
+        return self.create(name=name, payload=payload, run_at=run_at)
+
+    def schedule_periodic(self):
+        """
+        Enqueue the periodic jobs that have no pending run
+        Workers starting together are serialized by an advisory lock, so each job is enqueued once
+        @return: number of jobs enqueued
+        """
+        from .registry import PERIODIC
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [Job.SCHEDULE_LOCK])
+            scheduled = set(self.filter(name__in=PERIODIC, status=Job.PENDING).values_list(
+                'name', flat=True))
+            for name in PERIODIC:
+                if name not in scheduled:
+                    self.enqueue(name)
+        return len(PERIODIC) - len(scheduled)
+
+    def claim(self, batch_size):
+        """
+        Lock and return up to batch_size due jobs, skipping the ones locked by other workers
+        Must be called in a transaction, the jobs stay locked until it ends
+        """
+        return list(self.select_for_update(skip_locked=True).filter(
+            status=Job.PENDING, run_at__lte=timezone.now()).order_by('run_at', 'id')[:batch_size])
+
+    def run_batch(self, batch_size=10):
+        """
+        Claim and run a batch of due jobs in one transaction, each job in its own savepoint
+        Successful jobs are deleted, failed ones are retried with backoff up to Job.MAX_ATTEMPTS
+        The next run of a periodic job is always enqueued, a failed run is not retried instead,
+        so there is a single pending run of each periodic job
+        @param batch_size: maximum number of jobs to run
+        @return: number of jobs claimed
+        """
+        from .registry import PERIODIC, REGISTRY
+
+        with transaction.atomic():
+            jobs = self.claim(batch_size)
+            done = []
+            failed = []
+            for job in jobs:
+                try:
+                    with transaction.atomic():
+                        REGISTRY[job.name](**job.payload)
+                    done.append(job.id)
+                except Exception:
+                    job.fail(traceback.format_exc(), retry=job.name not in PERIODIC)
+                    failed.append(job)
+                if job.name in PERIODIC:
+                    self.enqueue(job.name, delay=PERIODIC[job.name], **job.payload)
+            self.filter(id__in=done).delete()
+            self.bulk_update(failed, ['status', 'attempts', 'run_at', 'last_error'])
+        return len(jobs)
+
+
+class Job(models.Model):
+    """
+    Model for storing deferred work, run by the run_jobs command
+    """
+    PENDING = 'pending'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (FAILED, 'Failed'),
+    ]
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = timedelta(seconds=30)
+    SCHEDULE_LOCK = 0x6a6f6273     # advisory lock key serializing schedule_periodic
+
+    name = models.CharField(max_length=128)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=8, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = JobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f'Job {self.name} {self.id}'
+
+    def fail(self, error, retry=True):
+        """
+        Record a failed attempt, the job is retried with exponential backoff until MAX_ATTEMPTS,
+        unless retry is False
+        """
+        self.attempts += 1
+        self.last_error = error
+        if not retry or self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            self.run_at = timezone.now() + self.RETRY_DELAY * 2 ** (self.attempts - 1)
+        return
@@ -0,0 +1,29 @@
+from .models import Job
+
+
+REGISTRY = {}
+PERIODIC = {}
+
+
+def job(func):
+    """
+    Decorator registering func as a job, run with the keyword arguments it is enqueued with
+    Adds func.enqueue(delay=None, **kwargs) to run it in a worker after the current transaction
+    """
+    name = f'{func.__module__}.{func.__name__}'
+    REGISTRY[name] = func
+    func.job_name = name
+    func.enqueue = lambda delay=None, **kwargs: Job.objects.enqueue(name, delay=delay, **kwargs)
+    return func
+
+
+def periodic(interval):
+    """
+    Decorator registering func as a job rerun every interval (a timedelta),
+    each run enqueues the next one, the first is enqueued when a run_jobs worker starts
+    """
+    def decorator(func):
+        job(func)
+        PERIODIC[func.job_name] = interval
+        return func
+    return decorator
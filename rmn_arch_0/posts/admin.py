@@ -29,6 +29,7 @@ class PostAdmin(admin.ModelAdmin):
         'created',
         ]
     list_filter = ['anonymous', 'reportable', 'show',]
+    list_select_related = ['user', 'stats']
     readonly_fields = ['user']
     search_fields = ['uuid',]
     inlines = [PostImageInline,]
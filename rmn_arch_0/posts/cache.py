@@ -0,0 +1,24 @@
+from django.core.cache import cache
+from django.db import transaction
+
+import uuid
+
+
+HOME_CACHE_GENERATION_KEY = 'home_posts_generation'
+
+
+def home_cache_generation():
+    """
+    Return the current generation of the cached home pages, part of their cache keys
+    """
+    return cache.get_or_set(HOME_CACHE_GENERATION_KEY, lambda: uuid.uuid4().hex, None)
+
+
+def invalidate_home_cache():
+    """
+    Start a new generation of cached home pages, the old entries expire on their own
+    Done again on commit, so a page cached from the uncommitted state is not kept
+    """
+    cache.delete(HOME_CACHE_GENERATION_KEY)
+    transaction.on_commit(lambda: cache.delete(HOME_CACHE_GENERATION_KEY))
+    return
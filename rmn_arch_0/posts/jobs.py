@@ -0,0 +1,34 @@
+from rmn_arch_0.jobs.registry import job, periodic
+
+from .models import Post, PostRank, TimelineEntry
+
+
+@job
+def send_report_notification(post_id):
+    """
+    Notify the user that their Post has been hidden due to reports, raise to retry on failure
+    """
+    post = Post.objects.select_related('user').get(pk=post_id)
+    post.report_notification(fail_silently=False)
+    return
+
+
+@job
+def fanout_post(post_id):
+    """
+    Push a new post to the timelines of the followers of its author, skipped if deleted meanwhile
+    """
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None:
+        TimelineEntry.objects.fanout(post)
+    return
+
+
+@periodic(PostRank.REFRESH_INTERVAL)
+def refresh_rankings():
+    """
+    Recompute the stored top posts of every rank period
+    """
+    for period, _ in PostRank.PERIODS:
+        PostRank.objects.refresh(period)
+    return
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rmn_arch_0.posts.models import TimelineEntry
+from rmn_arch_0.users.models import Relations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the follow timelines from the current follows, in chunks of users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100,
+            help='Number of users rebuilt per transaction')
+        parser.add_argument('--start-id', type=int, default=0,
+            help='Only rebuild users with id greater than this, useful for resuming')
+
+    def handle(self, *args, **options):
+        last_id = options['start_id']
+        total = 0
+        while True:
+            relations = list(Relations.objects.filter(user_id__gt=last_id).order_by(
+                'user_id').prefetch_related('follows')[:options['chunk_size']])
+            if not relations:
+                break
+            with transaction.atomic():
+                for relation in relations:
+                    TimelineEntry.objects.trim(relation.user_id)
+                    TimelineEntry.objects.backfill(relation.user_id,
+                        [user.id for user in relation.follows.all()])
+            total += len(relations)
+            last_id = relations[-1].user_id
+            self.stdout.write(f'Rebuilt {total} timelines, last user id {last_id}')
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {total} timelines'))
+        return
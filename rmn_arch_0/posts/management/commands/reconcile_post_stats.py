@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from rmn_arch_0.posts.models import Post, PostStats
+
+
+class Command(BaseCommand):
+    help = 'Backfill or reconcile PostStats counters from the related rows, in chunks of posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+            help='Number of posts reconciled per transaction')
+        parser.add_argument('--start-id', type=int, default=0,
+            help='Only reconcile posts with id greater than this, useful for resuming')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = options['start_id']
+        total = 0
+        while True:
+            post_ids = list(Post.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', flat=True)[:chunk_size])
+            if not post_ids:
+                break
+            total += PostStats.objects.reconcile(post_ids)
+            last_id = post_ids[-1]
+            self.stdout.write(f'Reconciled {total} posts, last id {last_id}')
+        self.stdout.write(self.style.SUCCESS(f'Successfully reconciled {total} posts'))
+        return
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+CHUNK_SIZE = 1000
+
+
+def create_stats(apps, schema_editor):
+    """
+    Create the PostStats of existing posts with their counters computed from the related rows,
+    in chunks of posts, as PostStatsManager.reconcile does
+    """
+    Post = apps.get_model('posts', 'Post')
+    PostStats = apps.get_model('posts', 'PostStats')
+    Rating = apps.get_model('posts', 'Rating')
+    rate_fields = {rate: f'rate_{rate}_count' for rate in range(1, 6)}
+    last_id = 0
+    while True:
+        post_ids = list(Post.objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', flat=True)[:CHUNK_SIZE])
+        if not post_ids:
+            break
+        stats = {post_id: PostStats(post_id=post_id) for post_id in post_ids}
+        ratings = Rating.objects.filter(post_id__in=post_ids).values('post_id').annotate(
+            count=models.Count('id'),
+            sum=models.Sum('rate'),
+            **{field: models.Count('id', filter=models.Q(rate=rate))
+                for rate, field in rate_fields.items()},
+        )
+        for row in ratings:
+            stat = stats[row['post_id']]
+            stat.rating_count = row['count']
+            stat.rate_sum = row['sum']
+            for field in rate_fields.values():
+                setattr(stat, field, row[field])
+        for model, field in [
+                ('PostImage', 'image_count'),
+                ('Comment', 'comment_count'),
+                ('Report', 'report_count')]:
+            counts = apps.get_model('posts', model).objects.filter(
+                post_id__in=post_ids).values('post_id').annotate(count=models.Count('id'))
+            for row in counts:
+                setattr(stats[row['post_id']], field, row['count'])
+        PostStats.objects.bulk_create(stats.values())
+        last_id = post_ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostStats',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='posts.post')),
+                ('image_count', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+                ('report_count', models.PositiveIntegerField(default=0)),
+                ('rate_sum', models.PositiveIntegerField(default=0)),
+                ('rate_1_count', models.PositiveIntegerField(default=0)),
+                ('rate_2_count', models.PositiveIntegerField(default=0)),
+                ('rate_3_count', models.PositiveIntegerField(default=0)),
+                ('rate_4_count', models.PositiveIntegerField(default=0)),
+                ('rate_5_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Post stats',
+            },
+        ),
+        migrations.RunPython(create_stats, migrations.RunPython.noop),
+    ]
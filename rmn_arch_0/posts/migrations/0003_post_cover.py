@@ -0,0 +1,32 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_covers(apps, schema_editor):
+    """
+    Set the cover of existing posts to their first image
+    """
+    Post = apps.get_model('posts', 'Post')
+    PostImage = apps.get_model('posts', 'PostImage')
+    Post.objects.filter(cover__isnull=True).update(
+        cover=models.Subquery(PostImage.objects.filter(
+                post=models.OuterRef('pk')
+            ).order_by('id').values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_poststats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='cover',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='posts.postimage'),
+        ),
+        migrations.RunPython(set_covers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_cover'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postimage',
+            name='variants_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_image_variants_ready'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rating',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='PostRank',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=8)),
+                ('position', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('rating_count', models.PositiveIntegerField()),
+                ('rate_sum', models.PositiveIntegerField()),
+                ('computed', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.post')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='postrank',
+            constraint=models.UniqueConstraint(fields=('period', 'position'), name='unique_period_position'),
+        ),
+    ]
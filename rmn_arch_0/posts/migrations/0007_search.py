@@ -0,0 +1,59 @@
+# Generated by Django 3.2.5 on 2026-10-18 09:26
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# keep search_vector in sync with description on every write, then fill it for existing rows
+# the configuration is rmn_arch_0.core.search.TEXT_CONFIG
+# searches are ordered by id, with the default statistics the frequency of rare words is
+# overestimated and the planner walks the primary key backwards filtering every row instead of
+# using the GIN index, the largest statistics target keeps the estimates of rare words low enough
+SEARCH_TRIGGERS = '''
+    ALTER TABLE {table} ALTER COLUMN search_vector SET STATISTICS 10000;
+    CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF description ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE
+    tsvector_update_trigger(search_vector, 'pg_catalog.english', description);
+    UPDATE {table} SET search_vector = to_tsvector('pg_catalog.english', description);
+'''
+DROP_SEARCH_TRIGGERS = '''
+    DROP TRIGGER {table}_search_vector ON {table};
+    ALTER TABLE {table} ALTER COLUMN search_vector SET STATISTICS -1;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            SEARCH_TRIGGERS.format(table='posts_post'),
+            DROP_SEARCH_TRIGGERS.format(table='posts_post'),
+        ),
+        migrations.RunSQL(
+            SEARCH_TRIGGERS.format(table='posts_comment'),
+            DROP_SEARCH_TRIGGERS.format(table='posts_comment'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='posts_comme_search__630017_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='posts_post_search__e0bb56_gin'),
+        ),
+    ]
@@ -1,14 +1,23 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.core.mail import send_mail
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, Greatest
 from django.templatetags.static import static
 from django.urls import reverse
+from django.utils import timezone
 
 from django_extensions.db.models import TimeStampedModel
+from datetime import timedelta
 import uuid
 
-from rmn_arch_0.users.models import User
+from rmn_arch_0.core.models import ImageVariantsMixIn
+from rmn_arch_0.users.cards import CardsQuerySet
+from rmn_arch_0.users.models import User, Relations
+from .cache import invalidate_home_cache
 
 
 def post_img_path(instance, filename):
@@ -35,15 +44,54 @@ class AnonymousUserMixIn(models.Model):
     def user_display_name(self):
         """
         Return the user.name if anaymous == false, else self.ANONYMOUS_USER
+        From the user card when attached by with_cards
         """
-        return self.ANONYMOUS_USER if self.anonymous else self.user.name
-    
+        if self.anonymous:
+            return self.ANONYMOUS_USER
+        card = getattr(self, 'user_card', None)
+        return card['name'] if card else self.user.name
+
     @property
     def user_display_image_url(self):
         """
         Return the user.profile_image_url if anaymous is false, else default_profile_img.png
+        From the user card when attached by with_cards
+        """
+        if self.anonymous:
+            return self.ANONYMOUS_IMAGE
+        card = getattr(self, 'user_card', None)
+        return card['img_url'] if card else self.user.profile_image_url
+
+
+class PostQuerySet(CardsQuerySet):
+    def with_cover(self):
+        """
+        Select the cover image, so thumbnail_image_url needs no query
+        """
+        return self.select_related('cover')
+
+    def with_images(self):
         """
-        return self.ANONYMOUS_IMAGE if self.anonymous else self.user.profile_image_url
+        Prefetch the images in order, so post.postimage_set.all needs no query per post
+        """
+        return self.prefetch_related(
+            models.Prefetch('postimage_set', queryset=PostImage.objects.order_by('id')))
+
+    def with_user(self):
+        """
+        Select the user and profile, so user_display_name/image_url need no query
+        """
+        return self.select_related('user__profile')
+
+    def update_cover(self):
+        """
+        Set cover to the first image for posts without cover, in a single UPDATE
+        Return the number of posts updated
+        """
+        return self.filter(cover__isnull=True).update(
+            cover=Subquery(PostImage.objects.filter(
+                    post=OuterRef('pk')
+                ).order_by('id').values('pk')[:1]))
 
 
 class Post(AnonymousUserMixIn, TimeStampedModel):
@@ -58,50 +106,74 @@ class Post(AnonymousUserMixIn, TimeStampedModel):
     show = models.BooleanField(default=True)
     description = models.CharField(max_length=100, blank=True)
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    cover = models.ForeignKey('PostImage', on_delete=models.SET_NULL, blank=True, null=True,
+        editable=False, related_name='+')
+    search_vector = SearchVectorField(null=True, editable=False)    # set by a trigger on write
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
 
     def __str__(self):
         return f'Post {str(self.uuid)[:8]}'
 
     @property
     def image_count(self):
-        return self.postimage_set.count()
+        return self.stats.image_count
 
     @property
     def rating_count(self):
-        return self.rating_set.count()
+        return self.stats.rating_count
 
     @property
     def comment_count(self):
-        return self.comment_set.count()
+        return self.stats.comment_count
 
     @property
     def report_count(self):
-        return self.report_set.count()
+        return self.stats.report_count
+
+    @property
+    def rating_histogram(self):
+        """
+        Return a dict of rate -> number of ratings with that rate
+        """
+        return {
+            rate: getattr(self.stats, PostStats.rate_field(rate))
+            for rate in range(Rating.MIN_RATING, Rating.MAX_RATING + 1)
+        }
 
     @property
     def avg_rate(self):
         """
-        Return the average rating as a float
+        Return the average rating as a float, None if there is no rating
         """
-        return self.rating_set.aggregate(models.Avg('rate'))['rate__avg']
+        if self.stats.rating_count == 0:
+            return None
+        return self.stats.rate_sum / self.stats.rating_count
 
     @property
     def rank_rate(self):
         """
         Return the rating used for rankings as a float
-        note this should only be used for testing, actual ranking should be done
+        note this is for a single post, rankings over many posts should be done
         with database query
         """
-        rate_sum = self.rating_set.aggregate(models.Sum('rate'))['rate__sum']
         stable_sum = self.STABLE_RATING * self.NUM_STABLE_RATING
-        return (rate_sum + stable_sum) / (self.rating_count + self.NUM_STABLE_RATING)
+        return ((self.stats.rate_sum + stable_sum)
+            / (self.stats.rating_count + self.NUM_STABLE_RATING))
 
     @property
     def thumbnail_image_url(self):
         """
-        Return the first image url as thumbnail
+        Return the cover image url as thumbnail, the first image url if cover is not set
         """
-        return self.postimage_set.first().image.url
+        if self.cover_id is not None:
+            return self.cover.tile_url
+        return self.postimage_set.first().tile_url
 
     def get_absolute_url(self):
         """
@@ -109,7 +181,7 @@ class Post(AnonymousUserMixIn, TimeStampedModel):
         """
         return reverse('posts:post_detail', kwargs={'uuid':self.uuid})
 
-    def report_notification(self):
+    def report_notification(self, fail_silently=True):
         """
         Notify the user that their Post has been hidden due to reports
         Return 1 if successful, 0 otherwise
@@ -119,7 +191,7 @@ class Post(AnonymousUserMixIn, TimeStampedModel):
                 f'Your Post {self.uuid} has been hidden due to user reports', #TODO refine
                 None,
                 [self.user.email],
-                fail_silently=True
+                fail_silently=fail_silently
                 )
 
     def rating_summary(self):
@@ -142,11 +214,166 @@ class Post(AnonymousUserMixIn, TimeStampedModel):
         return res
 
 
-class PostImage(models.Model):
+class PostStatsManager(models.Manager):
+    def increment(self, post_id, **deltas):
+        """
+        Atomically add the given deltas to the counters of the given post
+        Counters do not go below 0, so a drifted counter never fails the write, reconcile fixes it
+        @param  post_id: int    id of the post
+        @param  deltas: int     keyed by counter field name, can be negative
+        @return number of rows updated
+        """
+        return self.filter(post_id=post_id).update(**{
+            field: F(field) + delta if delta >= 0 else Greatest(F(field) + delta, 0)
+            for field, delta in deltas.items()
+        })
+
+    def increment_returning(self, post_id, field, delta=1):
+        """
+        Atomically add delta to one counter of the given post and return its new value,
+        with a single UPDATE ... RETURNING, the counter does not go below 0 as in increment
+        @param  post_id: int    id of the post
+        @param  field: str      one of PostStats.COUNTER_FIELDS
+        @return the new value, None if the post has no PostStats
+        """
+        if field not in self.model.COUNTER_FIELDS:
+            raise ValueError(f'{field} is not a counter of {self.model.__name__}')
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE {self.model._meta.db_table} SET {field} = GREATEST({field} + %s, 0)
+                WHERE post_id = %s RETURNING {field}
+                ''', [delta, post_id])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def rate(self, post_id, rate, old_rate=None):
+        """
+        Apply a new rating, or the change of a rating, to the count, sum and histogram of the given post
+        @param  post_id: int    id of the post
+        @param  rate: int       rate as saved
+        @param  old_rate: int   rate before the change, None for a new rating
+        @return number of rows updated
+        """
+        if old_rate is None:
+            return self.increment(post_id, **{
+                'rating_count': 1,
+                'rate_sum': rate,
+                self.model.rate_field(rate): 1,
+            })
+        if old_rate != rate:
+            return self.increment(post_id, **{
+                'rate_sum': rate - old_rate,
+                self.model.rate_field(old_rate): -1,
+                self.model.rate_field(rate): 1,
+            })
+        return 0
+
+    def reconcile(self, post_ids):
+        """
+        Recompute the counters of the given posts from their related rows,
+        creating any missing PostStats along the way
+        The PostStats rows are locked first, so concurrent increments wait for
+        this transaction and are applied on top of the recomputed values
+        @param  post_ids: list  ids of the posts
+        @return number of PostStats reconciled
+        """
+        rate_fields = [
+            self.model.rate_field(rate)
+            for rate in range(Rating.MIN_RATING, Rating.MAX_RATING + 1)
+        ]
+        with transaction.atomic():
+            self.bulk_create(
+                [self.model(post_id=post_id) for post_id in post_ids],
+                ignore_conflicts=True)
+            stats = {
+                stat.post_id: stat
+                for stat in self.select_for_update().filter(post_id__in=post_ids)
+            }
+            for stat in stats.values():
+                for field in self.model.COUNTER_FIELDS:
+                    setattr(stat, field, 0)
+
+            ratings = Rating.objects.filter(post_id__in=post_ids).values('post_id').annotate(
+                count=Count('id'),
+                sum=Sum('rate'),
+                **{
+                    field: Count('id', filter=Q(rate=rate))
+                    for rate, field in enumerate(rate_fields, Rating.MIN_RATING)
+                },
+            )
+            for row in ratings:
+                stat = stats[row['post_id']]
+                stat.rating_count = row['count']
+                stat.rate_sum = row['sum']
+                for field in rate_fields:
+                    setattr(stat, field, row[field])
+
+            for model, field in [
+                    (PostImage, 'image_count'),
+                    (Comment, 'comment_count'),
+                    (Report, 'report_count')]:
+                counts = model.objects.filter(post_id__in=post_ids).values('post_id').annotate(
+                    count=Count('id'))
+                for row in counts:
+                    setattr(stats[row['post_id']], field, row['count'])
+
+            self.bulk_update(stats.values(), self.model.COUNTER_FIELDS)
+        return len(stats)
+
+
+class PostStats(models.Model):
+    """
+    Denormalized counters of a Post, maintained whenever its related rows are written
+    Kept seperate from Post so saving a Post never overwrites the counters
+    """
+    COUNTER_FIELDS = [
+        'image_count',
+        'rating_count',
+        'comment_count',
+        'report_count',
+        'rate_sum',
+        'rate_1_count',
+        'rate_2_count',
+        'rate_3_count',
+        'rate_4_count',
+        'rate_5_count',
+    ]
+
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True,
+        related_name='stats')
+    image_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    report_count = models.PositiveIntegerField(default=0)
+    rate_sum = models.PositiveIntegerField(default=0)
+    rate_1_count = models.PositiveIntegerField(default=0)
+    rate_2_count = models.PositiveIntegerField(default=0)
+    rate_3_count = models.PositiveIntegerField(default=0)
+    rate_4_count = models.PositiveIntegerField(default=0)
+    rate_5_count = models.PositiveIntegerField(default=0)
+
+    objects = PostStatsManager()
+
+    class Meta:
+        verbose_name_plural = 'Post stats'
+
+    def __str__(self):
+        return f'Stats for {self.post}'
+
+    @staticmethod
+    def rate_field(rate):
+        """
+        Return the name of the histogram field counting the given rate
+        """
+        return f'rate_{rate}_count'
+
+
+class PostImage(ImageVariantsMixIn):
     """
     Model for storing post images
     """
     MAX_IMAGES = 9
+    VARIANTS = ['tile', 'modal']
 
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     image = models.ImageField(upload_to=post_img_path)
@@ -154,6 +381,14 @@ class PostImage(models.Model):
     def __str__(self):
         return f'Image {self.image} for {self.post}'
 
+    @property
+    def tile_url(self):
+        return self.variant_url('tile')
+
+    @property
+    def modal_url(self):
+        return self.variant_url('modal')
+
     def clean(self):
         """
         Raise ValidationError if maximun number of image for this post is reached
@@ -165,9 +400,79 @@ class PostImage(models.Model):
     def save(self, **kwargs):
         """
         Override save to call full_clean -> clean defined above
+        Saved in a transaction with the PostStats update
         """
         self.full_clean()
-        return super().save(**kwargs)
+        with transaction.atomic():
+            return super().save(**kwargs)
+
+
+class RatingManager(models.Manager):
+    """
+    Custom manager for writing Ratings in a single statement
+    """
+    def upsert(self, post_id, rate, user=None, session_key=None):
+        """
+        Create or update the rating of the user or session on the post with one
+        INSERT ... ON CONFLICT DO UPDATE, then apply it to the PostStats of the post
+        Validated here instead of full_clean, anonymity read from the user's settings,
+        which request.user carries already, a rating never goes back to not anonymous
+        @param post_id: int         id of the post
+        @param rate: int            from Rating.MIN_RATING to Rating.MAX_RATING
+        @param user: User           the rating user, or
+        @param session_key: str     the rating session, exactly one of them should be given
+        @return: the saved Rating
+        @raise ValidationError: if rate is invalid or not exactly one of user and session_key is given
+        """
+        rate = self.model._meta.get_field('rate').to_python(rate)
+        if rate is None or not self.model.MIN_RATING <= rate <= self.model.MAX_RATING:
+            raise ValidationError(
+                f'Rate should be an integer from {self.model.MIN_RATING} to {self.model.MAX_RATING}')
+        if (user is None) == (session_key is None):
+            raise ValidationError('One of user or session_key should be set, not both')
+        user_id = user.id if user is not None else None
+        anonymous = user is not None and user.settings.rate_anon
+        key, key_value = ('user_id', user_id) if user is not None else ('session_key', session_key)
+        table = self.model._meta.db_table
+        # old locks the existing row and reads its rate before the insert, scanning it in the
+        # SELECT makes sure of that, it is empty if the conflicting row was inserted by
+        # a transaction commited meanwhile, in which case the statement is retried
+        sql = f'''
+            WITH old AS MATERIALIZED (
+                SELECT rate FROM {table} WHERE {key} = %(key)s AND post_id = %(post_id)s FOR UPDATE
+            )
+            INSERT INTO {table} (created, user_id, session_key, post_id, rate, anonymous)
+            SELECT %(created)s, %(user_id)s, %(session_key)s, %(post_id)s, %(rate)s, %(anonymous)s
+            FROM (SELECT count(*) FROM old) AS locked
+            ON CONFLICT ({key}, post_id) DO UPDATE SET
+                rate = EXCLUDED.rate,
+                anonymous = {table}.anonymous OR EXCLUDED.anonymous
+            RETURNING id, created, anonymous, xmax = 0, (SELECT rate FROM old)
+            '''
+        params = {
+            'key': key_value,
+            'created': timezone.now(),
+            'user_id': user_id,
+            'session_key': session_key,
+            'post_id': post_id,
+            'rate': rate,
+            'anonymous': anonymous,
+        }
+        while True:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    pk, created, anonymous, inserted, old_rate = cursor.fetchone()
+                if inserted or old_rate is not None:
+                    PostStats.objects.rate(post_id, rate, None if inserted else old_rate)
+                    break
+                transaction.set_rollback(True)
+        rating = self.model(id=pk, created=created, user_id=user_id, session_key=session_key,
+            post_id=post_id, rate=rate, anonymous=anonymous)
+        rating._state.adding = False
+        rating._state.db = self.db
+        rating._loaded_rate = rate
+        return rating
 
 
 class Rating(AnonymousUserMixIn):
@@ -177,7 +482,7 @@ class Rating(AnonymousUserMixIn):
     MIN_RATING = 1
     MAX_RATING = 5
 
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)     # for rank windows
     user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
     session_key = models.CharField(max_length=40, blank=True, null=True)   # allows null in db for uniquness
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
@@ -186,6 +491,8 @@ class Rating(AnonymousUserMixIn):
         MaxValueValidator(MAX_RATING),
     ])
 
+    objects = RatingManager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['user', 'post'], name='unique_user'),
@@ -194,7 +501,16 @@ class Rating(AnonymousUserMixIn):
     
     def __str__(self):
         return f'Rating {self.rate} by {self.user if self.user else self.session_key}, for {self.post}'
-    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the rate as loaded, used to update the PostStats histogram on delete
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_rate = instance.__dict__.get('rate')
+        return instance
+
     def clean(self):
         """
         Pass if and only if one of user or session_key is set, otherwise riase ValidationError
@@ -207,11 +523,17 @@ class Rating(AnonymousUserMixIn):
         """
         Override save to call full_clean -> clean defined above
         Respect user anonymity settings if applicable
+        Saved in a transaction with the PostStats update, the previous rate is read and locked
+        in it, as the one loaded with this instance may be stale
         """
         self.full_clean()
         if self.user and self.user.settings.rate_anon:
             self.anonymous = True
-        return super().save(**kwargs)
+        with transaction.atomic():
+            if not self._state.adding:
+                self._loaded_rate = Rating.objects.select_for_update().filter(
+                    pk=self.pk).values_list('rate', flat=True).first()
+            return super().save(**kwargs)
 
 
 class Comment(AnonymousUserMixIn, TimeStampedModel):
@@ -220,6 +542,14 @@ class Comment(AnonymousUserMixIn, TimeStampedModel):
     """
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     description = models.CharField(max_length=100)
+    search_vector = SearchVectorField(null=True, editable=False)    # set by a trigger on write
+
+    objects = CardsQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
 
     def __str__(self):
         return f'Comment by {self.user}, for {self.post}'
@@ -227,10 +557,48 @@ class Comment(AnonymousUserMixIn, TimeStampedModel):
     def save(self, **kwargs):
         """
         Respect user anonymity settings if applicable
+        Saved in a transaction with the PostStats update
         """
         if self.user.settings.comment_anon:
             self.anonymous = True
-        return super().save(**kwargs)
+        with transaction.atomic():
+            return super().save(**kwargs)
+
+
+class ReportManager(models.Manager):
+    """
+    Custom manager for writing Reports in a single statement
+    """
+    def upsert(self, user, post, reason, description):
+        """
+        Create or update the report of the user on the post with one INSERT ... ON CONFLICT DO UPDATE,
+        a new report is counted in the PostStats of the post and may hide it, see Report.record
+        The reason and description are expected to be validated by ReportForm
+        @param user: User   the reporting user
+        @param post: Post   the reported post
+        @return: the saved Report
+        """
+        now = timezone.now()
+        table = self.model._meta.db_table
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'''
+                    INSERT INTO {table} (created, modified, user_id, post_id, reason, description)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (user_id, post_id) DO UPDATE SET
+                        modified = EXCLUDED.modified,
+                        reason = EXCLUDED.reason,
+                        description = EXCLUDED.description
+                    RETURNING id, created, xmax = 0
+                    ''', [now, now, user.id, post.id, reason, description])
+                pk, created, inserted = cursor.fetchone()
+            report = self.model(id=pk, created=created, modified=now, user_id=user.id, post=post,
+                reason=reason, description=description)
+            report._state.adding = False
+            report._state.db = self.db
+            if inserted:
+                report.record()
+        return report
 
 
 class Report(TimeStampedModel):
@@ -257,6 +625,8 @@ class Report(TimeStampedModel):
     reason = models.CharField(max_length=2, choices=REASONS, default=R_OTHER)
     description = models.CharField(max_length=500)
 
+    objects = ReportManager()
+
     class Meta():
         constraints = [
             models.UniqueConstraint(fields=['user', 'post'], name='unique_user_report'),
@@ -267,15 +637,196 @@ class Report(TimeStampedModel):
 
     def save(self, **kwargs):
         """
-        Override save to check if given post has been reported excessively
-        if the post is reportable and has been reported more than threshold, it will be hidden
-        and notification will be sent
-        """
-        super().save(**kwargs)
-        if (self.post.reportable 
-            and self.post.show
-            and self.post.report_set.count() > self.REPORT_THRESHOLD):
-            self.post.show = False
-            self.post.save()
-            self.post.report_notification()
+        Override save to count a new report and check if given post has been reported excessively,
+        see record
+        """
+        with transaction.atomic():
+            created = self._state.adding
+            super().save(**kwargs)
+            if created:
+                self.record()
+        return
+
+    def record(self):
+        """
+        Count this new report in the PostStats of the post, the new count is returned by the increment
+        If the post is reportable and has been reported more than threshold, it is hidden by
+        a conditional UPDATE, so only one of concurrent reports crossing the threshold hides it
+        and enqueues the notification job, which workers see once the transaction commits
+        """
+        from .jobs import send_report_notification     # posts.jobs imports this module
+
+        report_count = PostStats.objects.increment_returning(self.post_id, 'report_count')
+        if (report_count is not None
+            and report_count > self.REPORT_THRESHOLD
+            and Post.objects.filter(pk=self.post_id, show=True, reportable=True).update(show=False)):
+            if Report.post.is_cached(self):
+                self.post.show = False
+            invalidate_home_cache()
+            send_report_notification.enqueue(post_id=self.post_id)
         return
+
+
+class PostRankManager(models.Manager):
+    """
+    Custom manager for computing PostRanks
+    """
+    def compute(self, period, now=None):
+        """
+        Return the top PostRank.RANK_SIZE posts for the period as unsaved PostRanks
+        Only ratings created within the period window are aggregated, using the index on Rating.created
+        @param period: one of PostRank.WEEKLY or PostRank.MONTHLY
+        @param now: end of the window, current time by default
+        """
+        now = now or timezone.now()
+        stable_sum = Post.STABLE_RATING * Post.NUM_STABLE_RATING
+        rows = Rating.objects.filter(
+            created__gt=now - PostRank.WINDOWS[period],
+            created__lte=now,
+            post__show=True,
+            ).values('post_id').annotate(
+                rating_count=Count('id'),
+                rate_sum=Sum('rate'),
+            ).annotate(
+                score=Cast(F('rate_sum') + stable_sum, FloatField())
+                    / (F('rating_count') + Post.NUM_STABLE_RATING),
+            ).order_by('-score', '-rating_count', 'post_id')[:PostRank.RANK_SIZE]
+        return [self.model(period=period, position=i, computed=now, **row)
+            for i, row in enumerate(rows, 1)]
+
+    def refresh(self, period, now=None):
+        """
+        Replace the stored ranking of the period with a newly computed one
+        @return: number of ranked posts
+        """
+        ranks = self.compute(period, now)
+        with transaction.atomic():
+            self.filter(period=period).delete()
+            self.bulk_create(ranks)
+        return len(ranks)
+
+
+class PostRank(models.Model):
+    """
+    Model for storing the precomputed top posts of each rank period,
+    the rank score is Post.rank_rate over the ratings created within the period window
+    """
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    PERIODS = [
+        (WEEKLY, 'Weekly'),
+        (MONTHLY, 'Monthly'),
+    ]
+    WINDOWS = {
+        WEEKLY: timedelta(days=7),
+        MONTHLY: timedelta(days=30),
+    }
+    RANK_SIZE = 50
+    REFRESH_INTERVAL = timedelta(minutes=15)
+
+    period = models.CharField(max_length=8, choices=PERIODS)
+    position = models.PositiveSmallIntegerField()
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rating_count = models.PositiveIntegerField()
+    rate_sum = models.PositiveIntegerField()
+    computed = models.DateTimeField()
+
+    objects = PostRankManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'position'], name='unique_period_position'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_period_display()} rank {self.position}, {self.post}'
+
+
+class TimelineEntryManager(models.Manager):
+    """
+    Custom manager for maintaining the follow timelines
+    """
+    def fanout(self, post):
+        """
+        Push the post to the timelines of the followers of its author,
+        unless the author has more than TimelineEntry.FANOUT_LIMIT followers,
+        the author is then marked fanout_on_read and read from the posts table instead
+        @param post: a non anonymous Post
+        @return: number of timelines the post is pushed to
+        """
+        if Relations.objects.filter(user_id=post.user_id, fanout_on_read=True).exists():
+            return 0
+        followers = Relations.objects.filter(follows=post.user_id).values_list('user_id', flat=True)
+        count = followers.count()
+        if count > TimelineEntry.FANOUT_LIMIT:
+            Relations.objects.filter(user_id=post.user_id).update(fanout_on_read=True)
+            return 0
+        self.bulk_create([self.model(user_id=user_id, post_id=post.id, author_id=post.user_id)
+            for user_id in followers.iterator()], batch_size=1000, ignore_conflicts=True)
+        return count
+
+    def backfill(self, user_id, author_ids):
+        """
+        Push the latest TimelineEntry.BACKFILL_SIZE posts of each author to the timeline of user,
+        used when user starts following authors, fanout_on_read authors are skipped
+        """
+        entries = []
+        for author_id in Relations.objects.filter(user_id__in=author_ids,
+            fanout_on_read=False).values_list('user_id', flat=True):
+            post_ids = Post.objects.filter(user_id=author_id, anonymous=False).order_by(
+                '-id').values_list('id', flat=True)[:TimelineEntry.BACKFILL_SIZE]
+            entries += [self.model(user_id=user_id, post_id=post_id, author_id=author_id)
+                for post_id in post_ids]
+        self.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+        return len(entries)
+
+    def trim(self, user_id, author_ids=None):
+        """
+        Remove the posts of the given authors from the timeline of user, all if author_ids is None
+        """
+        entries = self.filter(user_id=user_id)
+        if author_ids is not None:
+            entries = entries.filter(author_id__in=author_ids)
+        return entries.delete()[0]
+
+    def timeline(self, user):
+        """
+        Return the queryset of the posts of the users followed by user, newest first
+        Posts of fanout_on_read authors are merged in from the posts table
+        """
+        posts = Post.objects.filter(show=True, anonymous=False).order_by('-id')
+        fanout_on_read = list(user.relations.follows.filter(
+            relations__fanout_on_read=True).values_list('id', flat=True))
+        if not fanout_on_read:
+            return posts.filter(timeline_entries__user=user)
+        return posts.filter(
+            Q(id__in=self.filter(user=user).values('post_id')) | Q(user_id__in=fanout_on_read))
+
+
+class TimelineEntry(models.Model):
+    """
+    Model for storing the follow timeline of each user, one row per post of a followed user,
+    pushed by a job when the post is created
+    """
+    FANOUT_LIMIT = 5000
+    BACKFILL_SIZE = 100
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    objects = TimelineEntryManager()
+
+    class Meta:
+        verbose_name_plural = 'Timeline entries'
+        constraints = [
+            # also the index a timeline page is read from
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_user_timeline_post'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'author']),
+        ]
+
+    def __str__(self):
+        return f'{self.post} in timeline of {self.user}'
@@ -0,0 +1,125 @@
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from rmn_arch_0.users.models import Relations
+
+from .cache import invalidate_home_cache
+from .jobs import fanout_post
+from .models import Post, PostStats, PostImage, Rating, Comment, Report, TimelineEntry
+
+
+# PostStats counter maintained for each related model
+COUNTER_FIELDS = {
+    PostImage: 'image_count',
+    Comment: 'comment_count',
+    Report: 'report_count',
+}
+
+
+@receiver(post_save, sender=Post)
+def create_post_stats(sender, instance, created, raw=False, **kwargs):
+    """
+    Create the PostStats for every new post
+    """
+    if created and not raw:
+        # by id, so the instance does not cache the zeroed stats
+        PostStats.objects.create(post_id=instance.pk)
+    return
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_home_posts(sender, instance, **kwargs):
+    """
+    Invalidate the cached home pages when a post is created, hidden, shown or deleted
+    """
+    invalidate_home_cache()
+    return
+
+
+@receiver(post_save, sender=Post)
+def enqueue_post_fanout(sender, instance, created, raw=False, **kwargs):
+    """
+    Push every new non anonymous post to the follower timelines in a job
+    """
+    if created and not raw and not instance.anonymous:
+        fanout_post.enqueue(post_id=instance.pk)
+    return
+
+
+@receiver(m2m_changed, sender=Relations.follows.through)
+def update_timeline(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Backfill the timeline on follow, trim it on unfollow
+    only changes made through Relations.follows are handled
+    """
+    if reverse:
+        return
+    if action == 'post_add':
+        TimelineEntry.objects.backfill(instance.user_id, pk_set)
+    elif action == 'post_remove':
+        TimelineEntry.objects.trim(instance.user_id, pk_set)
+    elif action == 'post_clear':
+        TimelineEntry.objects.trim(instance.user_id)
+    return
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_save, sender=Comment)
+def increment_post_counter(sender, instance, created, raw=False, **kwargs):
+    """
+    Increment the PostStats counter of the related post on creation
+    Reports are counted by Report.record, which needs the new count
+    """
+    if created and not raw:
+        PostStats.objects.increment(instance.post_id, **{COUNTER_FIELDS[sender]: 1})
+    return
+
+
+@receiver(post_delete, sender=PostImage)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Report)
+def decrement_post_counter(sender, instance, **kwargs):
+    """
+    Decrement the PostStats counter of the related post on deletion
+    """
+    PostStats.objects.increment(instance.post_id, **{COUNTER_FIELDS[sender]: -1})
+    return
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+def update_post_cover(sender, instance, **kwargs):
+    """
+    Set the cover of the related post if it is not set, or no longer set
+    """
+    if Post.objects.filter(pk=instance.post_id).update_cover():
+        invalidate_home_cache()
+    return
+
+
+@receiver(post_save, sender=Rating)
+def update_post_rating_stats(sender, instance, created, raw=False, **kwargs):
+    """
+    Update the rating count, sum and histogram of the related post
+    on creation or change of rate
+    """
+    if raw:
+        return
+    PostStats.objects.rate(instance.post_id, instance.rate, None if created else instance._loaded_rate)
+    instance._loaded_rate = instance.rate
+    return
+
+
+@receiver(post_delete, sender=Rating)
+def remove_post_rating_stats(sender, instance, **kwargs):
+    """
+    Remove the rating from the count, sum and histogram of the related post
+    """
+    rate = getattr(instance, '_loaded_rate', None) or instance.rate
+    PostStats.objects.increment(instance.post_id, **{
+        'rating_count': -1,
+        'rate_sum': -rate,
+        PostStats.rate_field(rate): -1,
+    })
+    return
@@ -10,6 +10,9 @@ from .views import (
     PostReportAJAXView,
     PostRateAJAXView,
     UserPostsView,
+    PostSearchView,
+    CommentSearchView,
+    UserSearchView,
 )
 
 app_name = 'posts'
@@ -25,4 +28,7 @@ urlpatterns = [
     path('posts/<uuid:uuid>/report/', PostReportAJAXView.as_view(), name='post_report'),
     path('posts/rate/', PostRateAJAXView.as_view(), name='rate'),
     path('users/<str:username>/posts/', UserPostsView.as_view(), name='user_posts'),
+    path('search/', PostSearchView.as_view(), name='search'),
+    path('search/comments/', CommentSearchView.as_view(), name='search_comments'),
+    path('search/users/', UserSearchView.as_view(), name='search_users'),
 ]
@@ -1,35 +1,118 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db.models import Case, When, F, Q, IntegerField
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.safestring import mark_safe
 from django.views.generic import TemplateView, ListView, View
 from django.urls import reverse
 
 import json
 import random
 
+from .cache import home_cache_generation
 from .forms import PostForm, CommentForm, ReportForm
-from .models import Post, PostImage, Rating, Comment, Report
-from rmn_arch_0.users.models import User
+from .models import Post, PostImage, PostRank, Rating, Comment, Report, TimelineEntry
+from rmn_arch_0.core.search import text_query, prefix_query
+from rmn_arch_0.users.models import User, Profile
+
+
+class CursorPage:
+    """
+    A page of a keyset paginated list, provides the parts of django Page used by the templates
+    """
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
 
 
 class ElPaginatedListView(ListView):
     """
     Endlessly paginated list view
     Requires page_template_name to be set, which would be used for pages after the first
+    Optionally set cursor_ordering (e.g. '-id') to paginate by keyset on that unique field
+    instead of OFFSET/LIMIT, the queryset must be ordered by it first
+        pages after the first are requested with ?after=<token> instead of ?page=<num>
+        no COUNT is done, so every page costs the same
+    The paginate_hook context is the token of the next page in cursor mode,
+    whether there is a next page otherwise
     """
     page_template_name = ''
+    cursor_ordering = None
+    cursor_kwarg = 'after'
+
+    def encode_cursor(self, value):
+        """
+        Return the opaque token for the given value of the cursor field
+        """
+        return urlsafe_base64_encode(force_bytes(value))
+
+    def decode_cursor(self, queryset, token):
+        """
+        Return the value of the cursor field for the given token, raise Http404 if invalid
+        """
+        field = queryset.model._meta.get_field(self.cursor_ordering.lstrip('-'))
+        try:
+            return field.to_python(urlsafe_base64_decode(token).decode())
+        except (ValueError, ValidationError):
+            raise Http404('Invalid page cursor')
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginate by keyset if cursor_ordering is set, by django Paginator otherwise
+        """
+        if not self.cursor_ordering:
+            return super().paginate_queryset(queryset, page_size)
+
+        field = self.cursor_ordering.lstrip('-')
+        token = self.request.GET.get(self.cursor_kwarg)
+        if token:
+            lookup = 'lt' if self.cursor_ordering.startswith('-') else 'gt'
+            queryset = queryset.filter(**{f'{field}__{lookup}': self.decode_cursor(queryset, token)})
+        object_list = list(queryset[:page_size + 1])    # one extra to check for next page
+        next_cursor = None
+        if len(object_list) > page_size:
+            object_list = object_list[:page_size]
+            next_cursor = self.encode_cursor(getattr(object_list[-1], field))
+        page = CursorPage(object_list, next_cursor)
+        return (None, page, page.object_list, page.has_next())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['page_template_name'] = self.page_template_name
+        page = context['page_obj']
+        if self.cursor_ordering:
+            context['paginate_hook'] = page.next_cursor
+        else:
+            context['paginate_hook'] = page is not None and page.has_next()
         return context
 
+    def is_first_page(self):
+        """
+        Whether the full page is requested, instead of a subsequent page_template_name
+        """
+        page_num = self.request.GET.get(self.page_kwarg)
+        return (page_num == None or page_num == '1') and not self.request.GET.get(self.cursor_kwarg)
+
     def get(self, request, **kwargs):
-        page_num = request.GET.get('page')
-        if page_num == None or page_num == 1:
+        if self.is_first_page():
             return super().get(request, **kwargs)
         else:
             self.object_list = self.get_queryset()
@@ -37,59 +120,154 @@ class ElPaginatedListView(ListView):
             return render(request, self.page_template_name, context)
 
 
-class HomeView(ElPaginatedListView):
+class ViewerRatingMixin:
+    """
+    Mixin for views showing posts with the current user/session user's ratings
+    """
+    def get_viewer_rates(self, posts):
+        """
+        Return a dict of post id -> rate of the current user/session user for the given posts
+        Done in one lookup on the user or session_key indexes, no query if the viewer has
+        neither
+        """
+        if self.request.user.is_authenticated:
+            ratings = Rating.objects.filter(user=self.request.user)
+        elif self.request.session.session_key:
+            ratings = Rating.objects.filter(session_key=self.request.session.session_key)
+        else:
+            return {}
+        return dict(ratings.filter(
+                post_id__in=[post.id for post in posts]
+            ).values_list('post_id', 'rate'))
+
+    def attach_viewer_rates(self, posts):
+        """
+        Set post.rate to the current user/session user's rate for each of the given posts,
+        None if not rated
+        """
+        rates = self.get_viewer_rates(posts)
+        for post in posts:
+            post.rate = rates.get(post.id)
+        return
+
+
+class HomeView(ViewerRatingMixin, ElPaginatedListView):
     """
     Home page
+    The rendered pages of posts are cached for viewers without ratings, see get_page_cache_key
     """
     template_name = 'posts/home.html'
     page_template_name = 'posts/home_posts.html'
     paginate_by = 20
+    cursor_ordering = '-id'
     context_object_name = 'posts'
+    page_cache_timeout = 60 * 5
+    page_cache_key = None
+    visited_cookie = 'visited'
+    visited_cookie_age = 60 * 60 * 24 * 365
 
     def get_queryset(self):
         """
-        Returns the posts objects order by newest (-id), annotate the current
-        user/session user's ratings if applicable
+        Returns the posts objects order by newest (-id), the current user/session
+        user's ratings are attached per page in get_context_data
+        """
+        return Post.objects.with_cover().filter(show=True).order_by('-id')
+
+    @staticmethod
+    def page_boundary_key(page_cache_key, cursor):
+        """
+        Return the key marking cursor as the start of a page emitted with the cached pages of the
+        generation of page_cache_key
+        """
+        return f'{page_cache_key.rsplit(":", 1)[0]}:{cursor}:emitted'
+
+    def get_page_cache_key(self):
+        """
+        Return the cache key of the requested page of posts, None if the page is not cached,
+        i.e. if the viewer may have ratings to show, is logged in or has rated in the current
+        session, or if the cursor is not the start of a page emitted by a cached page, so that
+        arbitrary cursors cannot fill the cache
+        The key holds the decoded cursor, every token of the same id shares it
         """
-        q = Q(pk__in=[])    # Django ORM recognises this, always evaluates to False
         if self.request.user.is_authenticated:
-            q = Q(rating__user=self.request.user)
-        elif self.request.session.session_key:
-            q = Q(rating__session_key=self.request.session.session_key)
-        return Post.objects.annotate(
-            rate = Case(
-                When(q, then = F('rating__rate')),
-                output_field = IntegerField()
-            )
-        ).filter(show = True
-        ).order_by('-id', 'rate'
-        ).distinct('id')
+            return None
+        session_key = self.request.session.session_key
+        if session_key and Rating.objects.filter(session_key=session_key).exists():
+            return None
+        token = self.request.GET.get(self.cursor_kwarg)
+        cursor = self.decode_cursor(self.get_queryset(), token) if token else ''
+        key = f'home_posts:{home_cache_generation()}:{cursor}'
+        if token and not cache.get(self.page_boundary_key(key, cursor)):
+            return None
+        return key
+
+    def is_first_visit(self):
+        """
+        Return whether the viewer is new, i.e. is not logged in and has neither a session
+        nor the visited cookie, no session is created for them
+        """
+        return not (self.request.user.is_authenticated
+            or self.request.session.session_key
+            or self.request.get_signed_cookie(self.visited_cookie, default=None,
+                salt=self.visited_cookie))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        self.attach_viewer_rates(context['posts'])
 
-        # randomly features some images
+        # randomly features some images, seeded by the cache key so a cached page is reproducible
+        rand = random.Random(self.page_cache_key)
         last_featured = 0
         for i, post in enumerate(context['posts']):
-            if (last_featured + 4 < i and random.random() < 0.5):
+            if (last_featured + 4 < i and rand.random() < 0.5):
                 last_featured = i
                 post.extra_css_class = ' featured'
-
-        # check whether the user is new
-        if not (self.request.user.is_authenticated or self.request.session.session_key):
-            self.request.session.create()
-            context['first_visit'] = True
         return context
 
+    def get(self, request, **kwargs):
+        self.page_cache_key = self.get_page_cache_key()
+        if self.page_cache_key is None:
+            # logged in, rated or an uncached next page, so not a first visit
+            return super().get(request, **kwargs)
+
+        page = cache.get(self.page_cache_key)
+        if page is None:
+            self.object_list = self.get_queryset()
+            context = self.get_context_data()
+            page = render_to_string(self.page_template_name, context, request)
+            cache.set(self.page_cache_key, page, self.page_cache_timeout)
+            if context['paginate_hook']:
+                cache.set(self.page_boundary_key(self.page_cache_key, context['posts'][-1].id), True,
+                    self.page_cache_timeout)
+        if not self.is_first_page():
+            return HttpResponse(page)
+        first_visit = self.is_first_visit()
+        response = render(request, self.template_name, {
+            'view': self,
+            'page_html': mark_safe(page),
+            'first_visit': first_visit,
+            })
+        if first_visit:
+            response.set_signed_cookie(self.visited_cookie, '1', salt=self.visited_cookie,
+                max_age=self.visited_cookie_age, secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True, samesite='Lax')
+        return response
+
 
 class RankView(TemplateView):
     """
-    Page showing weekly/monthly ranings
+    Page showing weekly/monthly ranings, read from the PostRanks refreshed by a periodic job
     """
     template_name = 'posts/rank.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        ranks = PostRank.objects.filter(post__show=True).select_related(
+            'post__cover').order_by('period', 'position')
+        context['rankings'] = [
+            (name, [rank for rank in ranks if rank.period == period])
+            for period, name in PostRank.PERIODS
+        ]
         return context
 
 
@@ -100,14 +278,11 @@ class FollowView(LoginRequiredMixin, ElPaginatedListView):
     template_name = 'posts/follow.html'
     page_template_name = 'posts/list_post.html'
     paginate_by = 10
+    cursor_ordering = '-id'
     context_object_name = 'posts'
 
     def get_queryset(self):
-        return Post.objects.filter(
-            user__in = self.request.user.relations.follows.all(),
-            show = True,
-            anonymous=False, #TODO test me
-        ).order_by('-id')
+        return TimelineEntry.objects.timeline(self.request.user).with_cards().with_images()
 
 
 class PostCreateModalView(LoginRequiredMixin, TemplateView):
@@ -139,7 +314,7 @@ class PostCreateModalView(LoginRequiredMixin, TemplateView):
         return self.render_to_response(context)
 
 
-class PostDetailModalView(ElPaginatedListView):
+class PostDetailModalView(ViewerRatingMixin, ElPaginatedListView):
     """
     Display indiviudal post as a modal content
     note this is subclass ListView (instead of DetailView) to facilitate pagniating comments
@@ -147,35 +322,29 @@ class PostDetailModalView(ElPaginatedListView):
     template_name = 'posts/post_detail_post.html'
     page_template_name = 'posts/post_detail_comments.html'
     paginate_by = 10
+    cursor_ordering = 'id'
     context_object_name = 'comments'
 
     def get_object(self):
         """
         Return the actual Post object
         """
-        return get_object_or_404(Post, uuid=self.kwargs['uuid'], show=True)
+        return get_object_or_404(
+            Post.objects.with_user().with_images().select_related('stats'),
+            uuid=self.kwargs['uuid'], show=True)
 
     def get_queryset(self):
         """
         Return the comments related to the given post
         """
         self.object = self.get_object()
-        return Comment.objects.filter(post=self.object).order_by('id')
+        return Comment.objects.filter(post=self.object).select_related('user').with_cards().order_by('id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['post'] = self.object
         # get current user/session user's rating
-        rating = None
-        if self.request.user.is_authenticated:
-            rating = Rating.objects.filter(
-                    user=self.request.user, post=self.object
-                ).first()
-        elif self.request.session.session_key:
-            rating = Rating.objects.filter(
-                    session_key=self.request.session.session_key, post=self.object
-                ).first()
-        context['rate'] = rating.rate if rating else None
+        context['rate'] = self.get_viewer_rates([self.object]).get(self.object.id)
 
         context['comment_form'] = CommentForm(prefix='comment')
         context['report_form'] = ReportForm(prefix='report')
@@ -215,10 +384,9 @@ class PostReportAJAXView(LoginRequiredMixin, PostDetailModalView):
     """
     def post(self, request, **kwargs):
         post = Post.objects.get(uuid=self.kwargs['uuid'])
-        report, _ = Report.objects.get_or_create(user=request.user, post=post)
-        report_form = ReportForm(data=self.request.POST, instance=report, prefix='report')
+        report_form = ReportForm(data=self.request.POST, prefix='report')
         if report_form.is_valid():
-            report_form.save()
+            Report.objects.upsert(request.user, post, **report_form.cleaned_data)
             return HttpResponse(status=200)
         return HttpResponse(status=400)
 
@@ -239,24 +407,14 @@ class PostRateAJAXView(View):
         rate = payload.get('rate', None)
         if (uuid == None or rate == None):
             return HttpResponse(status=400)
-        post = get_object_or_404(Post, uuid=uuid)
+        post_id = get_object_or_404(Post.objects.only('id'), uuid=uuid).id
         try:
             if request.user.is_authenticated:
-                Rating.objects.update_or_create(
-                    user=request.user,
-                    post=post,
-                    defaults={
-                        'rate': rate,
-                    })
+                Rating.objects.upsert(post_id, rate, user=request.user)
             else:
                 if not request.session.session_key:
                     request.session.create()
-                Rating.objects.update_or_create(
-                    session_key=request.session.session_key,
-                    post=post,
-                    defaults={
-                        'rate': rate,
-                    })
+                Rating.objects.upsert(post_id, rate, session_key=request.session.session_key)
         except ValidationError:
             return HttpResponse(status=400)
         return HttpResponse(status=200)
@@ -269,14 +427,87 @@ class UserPostsView(ElPaginatedListView):
     template_name = 'posts/user_posts.html'
     page_template_name = 'posts/list_post.html'
     paginate_by = 10
+    cursor_ordering = '-id'
     context_object_name = 'posts'
 
     def get_queryset(self):
         user = User.objects.get(username=self.kwargs['username'])
         self.user = user
-        return Post.objects.filter(user=user, anonymous=False, show=True).order_by('-id')
+        return Post.objects.with_cards().with_images().filter(
+            user=user, anonymous=False, show=True).order_by('-id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['curr_user'] = self.user
         return context
+
+
+class SearchView(ElPaginatedListView):
+    """
+    Base of the search pages, lists what matches the q parameter newest first
+    Subclasses set search_query, which turns q into a SearchQuery, and get_search_queryset
+    Matches are looked up on the GIN index of search_vector and paginated by keyset,
+    so a page costs the same however large the table is
+    """
+    template_name = 'posts/search.html'
+    paginate_by = 10
+    cursor_ordering = '-id'
+    search_query = staticmethod(text_query)
+
+    def get_search_queryset(self, query):
+        """
+        Return the objects matching the given SearchQuery, ordered by cursor_ordering
+        """
+        raise NotImplementedError
+
+    def get_queryset(self):
+        self.q = self.request.GET.get('q', '')
+        query = self.search_query(self.q)
+        if query is None:
+            return self.model.objects.none()
+        return self.get_search_queryset(query)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['q'] = self.q
+        return context
+
+
+class PostSearchView(SearchView):
+    """
+    Search shown posts by description
+    """
+    model = Post
+    page_template_name = 'posts/list_post.html'
+    context_object_name = 'posts'
+
+    def get_search_queryset(self, query):
+        return Post.objects.with_cards().with_images().filter(
+            show=True, search_vector=query).order_by('-id')
+
+
+class CommentSearchView(SearchView):
+    """
+    Search the comments of shown posts by description
+    """
+    model = Comment
+    page_template_name = 'posts/search_comments.html'
+    context_object_name = 'comments'
+
+    def get_search_queryset(self, query):
+        return Comment.objects.with_cards().select_related('post').filter(
+            post__show=True, search_vector=query).order_by('-id')
+
+
+class UserSearchView(SearchView):
+    """
+    Search active users by prefixes of their username and name
+    """
+    model = Profile
+    page_template_name = 'posts/search_users.html'
+    context_object_name = 'profiles'
+    search_query = staticmethod(prefix_query)
+
+    def get_search_queryset(self, query):
+        return Profile.objects.select_related('user').filter(
+            user__is_active=True, search_vector=query).order_by('-id')
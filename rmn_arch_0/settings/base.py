@@ -55,6 +55,7 @@ INSTALLED_APPS = [
     # local apps
     'rmn_arch_0.chat',
     'rmn_arch_0.core',
+    'rmn_arch_0.jobs',
     'rmn_arch_0.posts',
     'rmn_arch_0.users',
 
@@ -67,7 +68,7 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'rmn_arch_0.users.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -100,6 +101,40 @@ CHANNEL_LAYERS = {
         },
     },
 }
+# 'user': chat messages are sent to the recipients' user groups, connect joins a single group
+# 'room': every connection joins the group of each of its rooms, messages are sent to the room group
+# all consumers must run the same mode, switching requires reconnecting every client
+CHAT_DELIVERY = 'user'
+# 'buffered': chat messages are delivered right away and written by a per worker write-behind
+# buffer with one bulk insert per CHAT_BUFFER_SIZE messages or CHAT_BUFFER_DELAY seconds,
+# messages still buffered are lost if the worker dies
+# 'sync': every message is written before it is delivered
+CHAT_MESSAGE_WRITE = 'buffered'
+CHAT_BUFFER_SIZE = 100
+CHAT_BUFFER_DELAY = 0.005
+# chat_read receipts of a connection are written at most once per CHAT_READ_INTERVAL seconds,
+# with CHAT_READ_CACHE the unread computation consults the receipts cached meanwhile
+CHAT_READ_INTERVAL = 1
+CHAT_READ_CACHE = True
+# a reconnecting chat client is sent the messages it missed in frames of CHAT_SYNC_BATCH messages,
+# past CHAT_SYNC_LIMIT missed messages it is told to reload instead
+CHAT_SYNC_BATCH = 50
+CHAT_SYNC_LIMIT = 500
+# run the chat consumers' connect, recipient and read receipt queries, and the buffered message
+# writes, on a per worker asyncpg pool of up to CHAT_DB_POOL_SIZE connections instead of the thread
+# serializing django database access
+CHAT_ASYNC_DB = True
+CHAT_DB_POOL_SIZE = 10
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f"redis://{env('REDIS_HOSTNAME')}:6379/1",
+    },
+}
+# sessions are only created on the first rating or login, read through the cache,
+# expired ones are cleared by a periodic job
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
 
 # Database
@@ -158,6 +193,10 @@ DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 # Email settings
 DEFAULT_FROM_EMAIL = 'noreply@rmn_arch_0.com'
 SERVER_EMAIL = 'root@rmn_arch_0.com'
+# backend used by send_outbox to deliver emails stored by rmn_arch_0.core.mail.OutboxEmailBackend
+OUTBOX_EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_RATE_LIMIT = 10      # emails per second
 
 
 # Custome User and django-allauth
@@ -168,6 +207,9 @@ AUTHENTICATION_BACKENDS = [
     # `allauth` specific authentication methods, such as login by e-mail
     'allauth.account.auth_backends.AuthenticationBackend',
 ]
+# seconds request.user is cached for by rmn_arch_0.users.middleware, without their password hash,
+# 0 to always query it
+AUTH_USER_CACHE_TIMEOUT = 60
 SITE_ID = 1
 LOGIN_REDIRECT_URL = '/'
 ACCOUNT_EMAIL_REQUIRED = True
@@ -31,12 +31,18 @@ LOGGING = {
         'level': 'INFO',
     },
 }
-# disable logging in testing
+# disable logging and use local memory cache in testing
 if len(sys.argv) > 1 and sys.argv[1] == 'test':
     logging.disable(logging.CRITICAL)
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
 
-# use console as email
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# use console as email, delivered through the outbox as in production
+EMAIL_BACKEND = 'rmn_arch_0.core.mail.OutboxEmailBackend'
+OUTBOX_EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # local static and media setting
 STATIC_URL = '/static/'
@@ -18,8 +18,10 @@ CSRF_COOKIE_SECURE = True
 SECURE_SSL_REDIRECT = True
 
 
-# AWS SES for EMAIL_BACKEND
-EMAIL_BACKEND = "anymail.backends.amazon_ses.EmailBackend"
+# emails are written to the outbox in the request and delivered through AWS SES by send_outbox
+EMAIL_BACKEND = 'rmn_arch_0.core.mail.OutboxEmailBackend'
+OUTBOX_EMAIL_BACKEND = "anymail.backends.amazon_ses.EmailBackend"
+OUTBOX_RATE_LIMIT = env.int('OUTBOX_RATE_LIMIT', 14)
 INSTALLED_APPS.append('anymail')
 
 
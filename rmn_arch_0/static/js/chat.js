@@ -5,6 +5,7 @@ const ERROR_MSG = 'Network error, please try again later';
 const CHAT_NEW = 'chat_new';
 const CHAT_MSG = 'chat_message';
 const CHAT_READ = 'chat_read';
+const CHAT_SYNC = 'chat_sync';
 
 
 /**
@@ -36,6 +37,7 @@ const ChatRoom = class {
         this.id = elem.id;
         this.room = elem;
         this.content = undefined;
+        this.last_msg = parseInt(elem.getAttribute('data-last-msg')) || 0;
         if (elem.getAttribute('data-new-convo')) {
             this.new = true;
             this.init_content();
@@ -57,6 +59,9 @@ const ChatRoom = class {
     init_content() {
         this.content = document.getElementById(`${this.id}_content`);
         this.msgs = this.content.querySelector('.msgs-room-msgs');
+        this.before = this.read_before(this.msgs);
+        this.loading = false;
+        this.msgs.addEventListener('scroll', () => this.scroll_handler(), false);
         this.input = this.content.querySelector('textarea');
         this.send = this.content.querySelector('button');
         this.input.addEventListener(
@@ -71,6 +76,53 @@ const ChatRoom = class {
         );
     }
 
+    /**
+     * Read and remove the cursor of older messages from given element
+     * @param {Object} elem element containing the chat_before json script
+     * @returns {number} id of the oldest message loaded, null if there is no older message
+     */
+    read_before(elem) {
+        const hook = elem.querySelector('#chat_before');
+        if (!hook)
+            return null;
+        hook.remove();
+        return JSON.parse(hook.textContent) || null;
+    }
+
+    /**
+     * Load older messages when scrolled to the top, keeping the scroll position
+     */
+    async scroll_handler() {
+        if (this.msgs.scrollTop !== 0 || !this.before || this.loading)
+            return;
+        this.loading = true;
+        let res = await fetch(
+            window.dj_data.urls.chat.chat_content.replace(window.dj_data.url_key, this.id)
+            + `?before=${this.before}`);
+        if (res.ok) {
+            const older = document.createElement('div');
+            older.innerHTML = await res.text();
+            this.before = this.read_before(older);
+            const height = this.msgs.scrollHeight;
+            this.msgs.prepend(...older.childNodes);
+            this.msgs.scrollTop = this.msgs.scrollHeight - height;
+        }
+        this.loading = false;
+    }
+
+    /**
+     * Id of the last message seen in this room, sent when (re)connecting to get the missed ones
+     * and with the read receipts
+     * @returns {number} id of the last message seen, 0 if none
+     */
+    last_seen() {
+        if (this.content) {
+            for (let msg of this.msgs.querySelectorAll('.msgs-room-msg[data-id]'))
+                this.last_msg = Math.max(this.last_msg, parseInt(msg.getAttribute('data-id')));
+        }
+        return this.last_msg;
+    }
+
     /**
      * Change parent chat to not ready, display error message
      * TODO better handle error
@@ -93,7 +145,8 @@ const ChatRoom = class {
     }
 
     /**
-     * Send CHAT_READ mesage through websocket, to update last_view status
+     * Send CHAT_READ mesage through websocket, with the id of the last message seen
+     * to update last_view status and the read cursor
      */
     msg_read() {
         if (!this.chat.ready)
@@ -103,6 +156,7 @@ const ChatRoom = class {
             to: this.id,
             type: CHAT_READ,
             body: "read",
+            id: this.last_seen(),
         }));
     }
 
@@ -159,6 +213,11 @@ const ChatRoom = class {
      */
     onmessage(content) {
         this.new = false;
+        if (content.id) {
+            if (this.content && this.msgs.querySelector(`[data-id="${content.id}"]`))
+                return; // already received
+            this.last_msg = Math.max(this.last_msg, content.id);
+        }
         if (this.content) {
             let scroll = (this.msgs.scrollTop === (this.msgs.scrollHeight - this.msgs.offsetHeight));
             this.build_msg(content);
@@ -174,16 +233,27 @@ const ChatRoom = class {
         this.chat.room_list.prepend(this.room);
     }
 
+    /**
+     * Add the message to content, before the newer ones if it has an id
+     * @param {Object} content websocket message content
+     */
     build_msg(content) {
         const msg = document.createElement('div');
         msg.innerHTML = `
-            <div class="msgs-room-msg${(content.from === this.chat.username) ? ' self' : ''}">
+            <div class="msgs-room-msg${(content.from === this.chat.username) ? ' self' : ''}"
+                ${content.id ? `data-id="${content.id}"` : ''}>
                 <img src="${this.chat.user_info_cache[content.from].img_url}"
                     alt="Profile Image for ${this.chat.user_info_cache[content.from].name}" class="img-circle m-profile-img">
                 <span class="msgs-text">${content.body}</span>
             </div>
         `;
         this.msgs.append(msg);
+        if (content.id) {
+            const newer = [...this.msgs.querySelectorAll('.msgs-room-msg[data-id]')].find(
+                (elem) => parseInt(elem.getAttribute('data-id')) > content.id);
+            if (newer)
+                newer.before(msg);
+        }
         msg.replaceWith(...msg.childNodes);
     }
 
@@ -230,16 +300,9 @@ const Chat = class {
 
         this.ws.onmessage = (event) => {
             const content = JSON.parse(event.data);
-            if (!('from' in content) ||
-                !('to' in content) ||
-                !('type' in content) ||
-                !('body' in content))
-                return; // ignore if the msg is malformed
-            if (!(content.to in this.rooms)) {
-                this.build_msgs_room(content);
-                this.rooms[content.to] = new ChatRoom(document.getElementById(content.to), this);
-            }
-            this.rooms[content.to].onmessage(content);
+            if (content.type === CHAT_SYNC)
+                return this.sync_handler(content);
+            this.deliver(content);
         };
 
         this.ws.onerror = (err) => {
@@ -257,12 +320,62 @@ const Chat = class {
         this.ws.onopen = () => {
             this.ready = true;
             this.timeout = 500;
+            this.sync();
             let active_room = this.room_list.querySelector(`.${ACTIVE}`);
             if (active_room)
                 this.rooms[active_room.id].msg_read();
         };
     }
 
+    /**
+     * Pass the message to its ChatRoom, building the room first if new
+     * @param {Object} content websocket message content
+     */
+    deliver(content) {
+        if (!('from' in content) ||
+            !('to' in content) ||
+            !('type' in content) ||
+            !('body' in content))
+            return; // ignore if the msg is malformed
+        if (!(content.to in this.rooms)) {
+            this.build_msgs_room(content);
+            this.rooms[content.to] = new ChatRoom(document.getElementById(content.to), this);
+        }
+        this.rooms[content.to].onmessage(content);
+    }
+
+    /**
+     * Send CHAT_SYNC with the last message seen in each room, to receive the missed ones
+     */
+    sync() {
+        const rooms = {};
+        let since = 0;
+        for (let [name, room] of Object.entries(this.rooms)) {
+            if (room.new)
+                continue;
+            rooms[name] = room.last_seen();
+            since = Math.max(since, rooms[name]);
+        }
+        this.ws.send(JSON.stringify({
+            from: this.username,
+            type: CHAT_SYNC,
+            body: {since: since, rooms: rooms},
+        }));
+    }
+
+    /**
+     * Handle a CHAT_SYNC batch of missed messages, reload the page if too many were missed
+     * @param {Object} content websocket message content
+     */
+    sync_handler(content) {
+        if (content.reset)
+            return window.location.reload();
+        for (let msg of content.messages || []) {
+            msg.type = CHAT_MSG;
+            this.deliver(msg);
+        }
+    }
+
     /**
      * Builds a new ChatRoom base on websocket message
      * @param {Object} content websocket message content
@@ -1,14 +1,16 @@
 /**
  * Paginator object, requires
  *  two views, first handle initial request, second handle subsequent ones
- *  #paginate_hook exposed in inner template being paginated containing whether there is a next page
- * @param {string} paginated_url    url to get following pages
+ *  #paginate_hook exposed in inner template being paginated containing either
+ *      the cursor token of the next page, followed with ?after=<token>
+ *      or whether there is a next page, followed with ?page=<num>
+ * @param {string} paginated_url    url to get following pages, may have a query string
  * @param {number} scroll_bottom    px from button of scroll_obj to load next page
  *                                  defaults to 250
  * @param {object} scorll_obj       object to attach scroll eventlistener to
  *                                  defaults to document
  * @param {string} paginate_hook    id of paginate_hook, where the paginated content will be loaded
- *                                  and contains whether there is a next page
+ *                                  and contains the next page cursor or whether there is a next page
  *                                  defaults to 'paginate_hook'
  */
 export const Paginator = class {
@@ -22,7 +24,7 @@ export const Paginator = class {
         this.scroll_bottom = scroll_bottom;
         this.scorll_obj = scorll_obj;
         this.paginate_hook = paginate_hook;
-        this.more = JSON.parse(document.getElementById(this.paginate_hook).innerHTML);
+        this.read_hook();
         this.enabled = true;
 
         this.scorll_obj.addEventListener(
@@ -34,7 +36,7 @@ export const Paginator = class {
                     this.check_scroll_px_from_bottom() <= this.scroll_bottom
                 ) {
                     this.enabled = false;
-                    let res = await fetch(`${paginated_url}?page=${this.page}`);
+                    let res = await fetch(this.next_page_url(paginated_url));
                     if (!res.ok) {
                         if (res.status === 404) {
                             this.more = false;
@@ -47,9 +49,7 @@ export const Paginator = class {
                         hook.after(content);
                         hook.remove();
                         content.replaceWith(...content.childNodes);
-                        this.more = JSON.parse(
-                            document.getElementById(this.paginate_hook).innerHTML
-                        );
+                        this.read_hook();
                         this.page++;
                     }
                     this.enabled = true;
@@ -59,6 +59,26 @@ export const Paginator = class {
         );
     }
 
+    /**
+     * Read the next page cursor, or whether there is a next page, from the paginate_hook
+     */
+    read_hook = () => {
+        this.next = JSON.parse(document.getElementById(this.paginate_hook).innerHTML);
+        this.more = Boolean(this.next);
+    };
+
+    /**
+     * @param {string} paginated_url    url to get following pages
+     * @returns url of the next page, by cursor if available, by page number otherwise
+     */
+    next_page_url = (paginated_url) => {
+        const separator = paginated_url.includes('?') ? '&' : '?';
+        if (typeof this.next === 'string') {
+            return `${paginated_url}${separator}after=${encodeURIComponent(this.next)}`;
+        }
+        return `${paginated_url}${separator}page=${this.page}`;
+    };
+
     /**
      * @returns current postion of the scroll bar from the bottom
      */
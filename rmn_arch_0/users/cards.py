@@ -0,0 +1,105 @@
+from django.core.cache import cache
+from django.db import models
+from django.templatetags.static import static
+
+from .models import User, Profile
+
+
+CARD_TIMEOUT = 60 * 60 * 24
+
+
+def card_key(user_id):
+    return f'user_card:{user_id}'
+
+
+def make_card(user):
+    """
+    Return the card of the given user, a dict of what is shown next to their content
+    """
+    try:
+        name, img_url = user.name, user.profile_image_url
+    except Profile.DoesNotExist:    # e.g. superusers created without a profile
+        name, img_url = '', static('images/default_profile_img.png')
+    return {
+        'username': user.username,
+        'name': name,
+        'img_url': img_url,
+    }
+
+
+def get_cards(user_ids):
+    """
+    Return {user id: card} of the given users, from the cache,
+    the missing ones loaded with a single query and cached
+    @param user_ids: iterable of user ids, duplicates and None are ignored
+    """
+    keys = {card_key(user_id): user_id for user_id in set(user_ids) if user_id is not None}
+    if not keys:
+        return {}
+    cards = {keys[key]: card for key, card in cache.get_many(keys).items()}
+    missing = [user_id for user_id in keys.values() if user_id not in cards]
+    if missing:
+        loaded = {user.id: make_card(user)
+            for user in User.objects.filter(id__in=missing).select_related('profile')}
+        cache.set_many({card_key(user_id): card for user_id, card in loaded.items()}, CARD_TIMEOUT)
+        cards.update(loaded)
+    return cards
+
+
+def get_card(user_id):
+    """
+    Return the card of the given user, None if the user does not exist
+    """
+    return get_cards([user_id]).get(user_id)
+
+
+def invalidate_cards(user_ids):
+    """
+    Drop the cached cards of the given users, to be called when their username, name or image change
+    """
+    cache.delete_many([card_key(user_id) for user_id in user_ids])
+    return
+
+
+def attach_cards(objects, field='user'):
+    """
+    Set <field>_card on each of objects to the card of its <field>_id, loading the cards in bulk
+    """
+    cards = get_cards(getattr(obj, f'{field}_id') for obj in objects)
+    for obj in objects:
+        setattr(obj, f'{field}_card', cards.get(getattr(obj, f'{field}_id')))
+    return
+
+
+class CardsQuerySet(models.QuerySet):
+    """
+    QuerySet attaching the user cards of its rows once fetched, see with_cards
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._card_fields = ()
+        self._cards_done = False
+
+    def with_cards(self, field='user'):
+        """
+        Attach <field>_card to every row once fetched, loaded with get_cards,
+        so AnonymousUserMixIn display names and images need no query per row
+        """
+        clone = self._chain()
+        clone._card_fields += (field,)
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._card_fields = self._card_fields
+        return clone
+
+    def _fetch_all(self):
+        super()._fetch_all()
+        if self._card_fields and not self._cards_done:
+            # values() and values_list() rows have no attributes to set
+            if self._iterable_class is models.query.ModelIterable:
+                for field in self._card_fields:
+                    attach_cards(self._result_cache, field)
+            self._cards_done = True
+        return
@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import middleware
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from .models import User
+
+
+def request_user_key(user_id):
+    return f'request_user:{user_id}'
+
+
+def invalidate_request_user(user_id):
+    """
+    Drop the cached request user, to be called when the user or their one-to-ones change
+    Done again on commit, so a user cached from the uncommitted state is not kept
+    """
+    key = request_user_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+    return
+
+
+def session_auth_hashes(user):
+    """
+    Return the current and legacy session auth hashes of user, the session holds one of them
+    """
+    return user.get_session_auth_hash(), user._legacy_get_session_auth_hash()
+
+
+def load_user(user_id):
+    """
+    Return (user, session_auth_hashes(user)), the user with their profile, settings and relations
+    selected in a single query, None if there is no such user
+    Cached for AUTH_USER_CACHE_TIMEOUT seconds if set, without the password hash, which is
+    left deferred and only loaded again if read
+    """
+    timeout = settings.AUTH_USER_CACHE_TIMEOUT
+    cached = cache.get(request_user_key(user_id)) if timeout else None
+    if cached is not None:
+        return cached
+    user = User.objects.select_related('profile', 'settings', 'relations').filter(
+        pk=user_id).first()
+    if user is None:
+        return None
+    hashes = session_auth_hashes(user)
+    if timeout:
+        password = user.__dict__.pop('password')
+        try:
+            cache.set(request_user_key(user_id), (user, hashes), timeout)
+        finally:
+            user.password = password
+    return user, hashes
+
+
+def get_user(request):
+    """
+    django.contrib.auth.get_user, loading the user with load_user
+    when the session's backend gets users from the User model
+    """
+    try:
+        user_id = auth._get_user_session_key(request)
+        backend_path = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+    backend = auth.load_backend(backend_path)
+    if not isinstance(backend, ModelBackend):
+        return auth.get_user(request)
+    loaded = load_user(user_id)
+    if loaded is None or not backend.user_can_authenticate(loaded[0]):
+        return AnonymousUser()
+    user, hashes = loaded
+    # verify the session, as django.contrib.auth.get_user
+    session_hash = request.session.get(auth.HASH_SESSION_KEY)
+    if not (session_hash and any(constant_time_compare(session_hash, h) for h in hashes)):
+        request.session.flush()
+        return AnonymousUser()
+    return user
+
+
+class AuthenticationMiddleware(middleware.AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware loading request.user together with their profile, settings
+    and relations, so reading them later in the request needs no query
+    """
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: self.get_user(request))
+        return
+
+    @staticmethod
+    def get_user(request):
+        if not hasattr(request, '_cached_user'):
+            request._cached_user = get_user(request)
+        return request._cached_user
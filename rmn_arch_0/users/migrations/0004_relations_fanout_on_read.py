@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_image_variants_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='relations',
+            name='fanout_on_read',
+            field=models.BooleanField(default=False),
+        ),
+    ]
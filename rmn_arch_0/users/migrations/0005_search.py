@@ -0,0 +1,72 @@
+# Generated by Django 3.2.5 on 2026-10-18 09:26
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# the search_vector of a profile holds the username, also split into its words, and the name
+# it is set when the profile is written and when the username changes
+# the configuration is rmn_arch_0.core.search.NAME_CONFIG
+# the statistics target is raised as for posts, see posts.0007_search
+SEARCH_TRIGGERS = '''
+    ALTER TABLE users_profile ALTER COLUMN search_vector SET STATISTICS 10000;
+
+    CREATE FUNCTION users_search_vector(username text, name text) RETURNS tsvector AS $$
+        SELECT to_tsvector('pg_catalog.simple', coalesce(username, '') || ' '
+            || regexp_replace(coalesce(username, ''), '[^[:alnum:]]+', ' ', 'g') || ' ' || name)
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE FUNCTION users_profile_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := users_search_vector(
+            (SELECT username FROM users_user WHERE id = NEW.user_id), NEW.name);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER users_profile_search_vector BEFORE INSERT OR UPDATE OF user_id, name
+    ON users_profile FOR EACH ROW EXECUTE PROCEDURE users_profile_search_vector();
+
+    CREATE FUNCTION users_user_search_vector() RETURNS trigger AS $$
+    BEGIN
+        UPDATE users_profile SET search_vector = users_search_vector(NEW.username, name)
+        WHERE user_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER users_user_search_vector AFTER UPDATE OF username ON users_user FOR EACH ROW
+    WHEN (OLD.username IS DISTINCT FROM NEW.username) EXECUTE PROCEDURE users_user_search_vector();
+
+    UPDATE users_profile p SET search_vector = users_search_vector(u.username, p.name)
+    FROM users_user u WHERE u.id = p.user_id;
+'''
+DROP_SEARCH_TRIGGERS = '''
+    DROP TRIGGER users_user_search_vector ON users_user;
+    DROP FUNCTION users_user_search_vector();
+    DROP TRIGGER users_profile_search_vector ON users_profile;
+    DROP FUNCTION users_profile_search_vector();
+    DROP FUNCTION users_search_vector(text, text);
+    ALTER TABLE users_profile ALTER COLUMN search_vector SET STATISTICS -1;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_relations_fanout_on_read'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(SEARCH_TRIGGERS, DROP_SEARCH_TRIGGERS),
+        migrations.AddIndex(
+            model_name='profile',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='users_profi_search__ea7035_gin'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, UserManager
 from django.contrib.auth.validators import ASCIIUsernameValidator
@@ -7,6 +9,8 @@ from django.utils import timezone
 
 from datetime import timedelta
 
+from rmn_arch_0.core.models import ImageVariantsMixIn
+
 
 def profile_img_path(instance, filename):
     """
@@ -50,7 +54,7 @@ class User(AbstractBaseUser, PermissionsMixin):
         otherwise return the default_profile_img.png url
         """
         if self.profile.image:
-            return self.profile.image.url
+            return self.profile.avatar_url
         else:
             return static('images/default_profile_img.png')
 
@@ -68,7 +72,7 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.relations.follows.count()
 
 
-class Profile(models.Model):
+class Profile(ImageVariantsMixIn):
     """
     Profile for individual users
     """
@@ -82,6 +86,7 @@ class Profile(models.Model):
         (OTHER, 'Other'),
         (NA, 'Prefer not to say'),
     ]
+    VARIANTS = ['avatar']
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=32)
@@ -89,10 +94,34 @@ class Profile(models.Model):
     birthday = models.DateField(blank=True, null=True)
     image = models.ImageField(blank=True, null=True, upload_to=profile_img_path)
     location = models.ForeignKey('cities_light.City', blank=True, null=True, on_delete=models.PROTECT)
+    # username and name, set by triggers on write of either
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
 
     def __str__(self):
         return f'Profile for {self.user}'
 
+    @property
+    def avatar_url(self):
+        return self.variant_url('avatar')
+
+    def make_variants(self):
+        """
+        Override make_variants to drop the cached user card and request user,
+        the image url becomes the avatar
+        """
+        from .cards import invalidate_cards
+        from .middleware import invalidate_request_user
+
+        super().make_variants()
+        invalidate_cards([self.user_id])
+        invalidate_request_user(self.user_id)
+        return
+
     @property
     def age(self):
         """
@@ -136,6 +165,9 @@ class Relations(models.Model):
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     follows = models.ManyToManyField(User, related_name='followers')
+    # posts of accounts with too many followers are read from the posts table instead of
+    # pushed to the follower timelines, see posts.TimelineEntry
+    fanout_on_read = models.BooleanField(default=False)
 
     class Meta:
         verbose_name_plural = 'Relations'
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cards import invalidate_cards
+from .middleware import invalidate_request_user
+from .models import User, Profile, Settings, Relations
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    """
+    Drop the cached request user when the user changes, e.g. their password or active status,
+    and their cached card showing the username
+    """
+    invalidate_request_user(instance.pk)
+    invalidate_cards([instance.pk])
+    return
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=Settings)
+@receiver(post_save, sender=Relations)
+def invalidate_user_one_to_one(sender, instance, **kwargs):
+    """
+    Drop the cached request user when one of the one-to-ones loaded with it changes
+    """
+    invalidate_request_user(instance.user_id)
+    return
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_card(sender, instance, **kwargs):
+    """
+    Drop the cached card showing the old name or image, whatever saved the profile
+    """
+    invalidate_cards([instance.user_id])
+    return
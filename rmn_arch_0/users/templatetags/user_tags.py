@@ -0,0 +1,11 @@
+from django import template
+from rmn_arch_0.users.cards import get_card
+
+register = template.Library()
+
+@register.simple_tag
+def user_card(user):
+    """
+    Return the cached card of the given user, e.g. {% user_card user as card %}{{ card.img_url }}
+    """
+    return get_card(user.id)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import sys
+import time
+from mando import command, main
+from pathlib import Path
+from types import SimpleNamespace
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+sys.path.append(BASE_DIR.as_posix())
+
+import django
+django.setup()
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test.utils import override_settings
+
+from rmn_arch_0.chat import db
+from rmn_arch_0.chat.consumers import ChatConsumer
+from rmn_arch_0.users.models import User
+
+
+def make_consumers(layer, delivery, connections, rooms):
+    """
+    Returns consumers as they are after loading their rooms in connect,
+    every connection belongs to a different user with the given number of rooms
+    """
+    consumers = []
+    for i in range(connections):
+        consumer = ChatConsumer()
+        consumer.channel_layer = layer
+        consumer.channel_name = f'bench!{i}'
+        consumer.user = SimpleNamespace(id=i)
+        consumer.delivery = delivery
+        consumer.rooms = {f'bench_{i}_{j}': j for j in range(rooms)}
+        consumers.append(consumer)
+    return consumers
+
+
+async def storm(consumers, method):
+    """
+    Returns the seconds taken to run the given group method of all consumers concurrently
+    """
+    start = time.perf_counter()
+    await asyncio.gather(*(getattr(consumer, method)() for consumer in consumers))
+    return time.perf_counter() - start
+
+
+async def reconnect(consumers):
+    """
+    Returns the seconds taken by all consumers to join, then to leave their groups
+    """
+    joined = await storm(consumers, 'join_groups')
+    left = await storm(consumers, 'leave_groups')
+    return joined, left
+
+
+@command
+def reconnect_storm(connections=500, rooms=100):
+    """
+    Time every connection joining then leaving its channel groups at once, as after a deploy,
+    under both CHAT_DELIVERY modes, against the configured CHANNEL_LAYERS
+    """
+    logging.getLogger().setLevel(logging.INFO)
+    layer = get_channel_layer()
+    for delivery in (ChatConsumer.ROOM_DELIVERY, ChatConsumer.USER_DELIVERY):
+        consumers = make_consumers(layer, delivery, connections, rooms)
+        joined, left = asyncio.run(reconnect(consumers))
+        logging.info(
+            f'{delivery} delivery: {connections} connections x {rooms} rooms, '
+            f'join {joined:.3f}s, leave {left:.3f}s')
+    return
+
+
+async def sockets_storm(users):
+    """
+    Returns the seconds taken to open a websocket per user concurrently, then to close them
+    """
+    communicators = []
+    for user in users:
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/messages/')
+        communicator.scope['user'] = user
+        communicators.append(communicator)
+    start = time.perf_counter()
+    await asyncio.gather(*(communicator.connect(timeout=60) for communicator in communicators))
+    connected = time.perf_counter() - start
+    start = time.perf_counter()
+    await asyncio.gather(*(communicator.disconnect(timeout=60) for communicator in communicators))
+    disconnected = time.perf_counter() - start
+    await db.close_pool()
+    return connected, disconnected
+
+
+@command
+def concurrent_sockets(sockets=200):
+    """
+    Time the given number of websockets of the latest users connecting at once to one worker,
+    with the consumer's queries run on the async pool and on the database thread (CHAT_ASYNC_DB)
+    """
+    logging.getLogger().setLevel(logging.INFO)
+    users = list(User.objects.order_by('-id')[:sockets])
+    for async_db in (False, True):
+        with override_settings(CHAT_ASYNC_DB=async_db):
+            connected, disconnected = asyncio.run(sockets_storm(users))
+        logging.info(
+            f'CHAT_ASYNC_DB={async_db}: {len(users)} sockets, '
+            f'connect {connected:.3f}s, disconnect {disconnected:.3f}s')
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import asyncio
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from rmn_arch_0.chat import db
+from rmn_arch_0.chat.buffer import MessageBuffer, get_buffer
+from rmn_arch_0.chat.consumers import ChatConsumer
+from rmn_arch_0.chat.models import Room, Message
+from rmn_arch_0.chat.unread import cached_reads, has_unread
+from rmn_arch_0.users.models import Settings
+from .._tools.utils import create_user
+
+
+IN_MEMORY_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class TestChatConsumer(TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.u0 = create_user('u0')
+        self.u1 = create_user('u1')
+        self.u2 = create_user('u2')
+        return
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/messages/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def disconnect(self, *communicators):
+        """
+        Disconnect the communicators, then close the async pool of the test's event loop
+        """
+        for communicator in communicators:
+            await communicator.disconnect()
+        await db.close_pool()
+        return
+
+    def new_chat(self, sender, receiver, body='hi'):
+        return {
+            'from': sender.username,
+            'to': Room.get_room_name(sender, receiver),
+            'type': ChatConsumer.CHAT_NEW,
+            'body': body,
+        }
+
+    async def test_chat_new_only_to_participants(self):
+        c0, c1, c2 = [await self.connect(user) for user in (self.u0, self.u1, self.u2)]
+        await c0.send_json_to(self.new_chat(self.u0, self.u1))
+        for communicator in (c0, c1):
+            event = await communicator.receive_json_from()
+            self.assertEqual(event['type'], ChatConsumer.CHAT_NEW)
+            self.assertEqual(event['user_info']['username'], 'u0')
+        self.assertTrue(await c2.receive_nothing())
+
+        # both joined the room group
+        await c1.send_json_to({'from': 'u1', 'to': event['to'], 'type': ChatConsumer.CHAT_MSG,
+            'body': 'hello'})
+        for communicator in (c0, c1):
+            hello = await communicator.receive_json_from()
+            self.assertEqual(hello['body'], 'hello')
+        self.assertTrue(await c2.receive_nothing())
+        await get_buffer().flush()
+        messages = await database_sync_to_async(list)(Message.objects.order_by('id'))
+        self.assertEqual([m.id for m in messages], [event['id'], hello['id']])
+        await self.disconnect(c0, c1, c2)
+        return
+
+    async def test_chat_new_blocked(self):
+        self.u1.settings.rec_new_msg = Settings.BLOCK
+        await database_sync_to_async(self.u1.settings.save)()
+        c0, c1 = [await self.connect(user) for user in (self.u0, self.u1)]
+        await c0.send_json_to(self.new_chat(self.u0, self.u1))
+        self.assertEqual((await c0.receive_json_from())['type'], ChatConsumer.CHAT_NEW)
+        self.assertTrue(await c1.receive_nothing())
+        await self.disconnect(c0, c1)
+        return
+
+    async def test_connect_groups(self):
+        c0 = await self.connect(self.u0)
+        await c0.send_json_to(self.new_chat(self.u0, self.u1))
+        await c0.receive_json_from()
+        await c0.disconnect()
+
+        c0 = await self.connect(self.u0)
+        layer = get_channel_layer()
+        self.assertIn(ChatConsumer.user_group(self.u0.id), layer.groups)
+        self.assertNotIn(Room.get_room_name(self.u0, self.u1), layer.groups)
+        await self.disconnect(c0)
+        self.assertNotIn(ChatConsumer.user_group(self.u0.id), layer.groups)
+        return
+
+    async def test_chat_read_debounced(self):
+        c0, c1 = [await self.connect(user) for user in (self.u0, self.u1)]
+        await c0.send_json_to(self.new_chat(self.u0, self.u1))
+        event = await c1.receive_json_from()
+        read = {'from': 'u1', 'to': event['to'], 'type': ChatConsumer.CHAT_READ, 'body': 'read',
+            'id': event['id']}
+        with override_settings(CHAT_READ_INTERVAL=0.2):
+            await c1.send_json_to(read)
+            await c1.send_json_to(read)
+            self.assertTrue(await c1.receive_nothing(0.05))
+            room = await database_sync_to_async(Room.objects.get)(name=event['to'])
+            stat = await database_sync_to_async(room.get_user_stat)(self.u1)
+            self.assertEqual(stat.read_cursor, 0)
+            # the unread computation already sees the cached receipt
+            self.assertFalse(await database_sync_to_async(Room.objects.has_new_message)(self.u1))
+            await asyncio.sleep(0.3)
+        await database_sync_to_async(stat.refresh_from_db)()
+        self.assertEqual(stat.read_cursor, room.last_message_id)
+        # written receipts are no longer cached
+        self.assertEqual(cached_reads(self.u1.id, [room.id]), {})
+        await self.disconnect(c0, c1)
+        return
+
+    async def test_chat_read_cursor(self):
+        c0, c1 = [await self.connect(user) for user in (self.u0, self.u1)]
+        await c0.send_json_to(self.new_chat(self.u0, self.u1))
+        room_name = (await c1.receive_json_from())['to']
+        await c0.receive_json_from()
+        ids = []
+        for body in ('a', 'b'):
+            await c0.send_json_to({'from': 'u0', 'to': room_name, 'type': ChatConsumer.CHAT_MSG,
+                'body': body})
+            ids.append((await c1.receive_json_from())['id'])
+            await c0.receive_json_from()
+        read = {'from': 'u1', 'to': room_name, 'type': ChatConsumer.CHAT_READ, 'body': 'read'}
+        # only the messages up to the receipt's id are read, the buffered ones included
+        await c1.send_json_to({**read, 'id': ids[0]})
+        await c1.disconnect()
+        room = await database_sync_to_async(Room.objects.get)(name=room_name)
+        stat = await database_sync_to_async(room.get_user_stat)(self.u1)
+        self.assertEqual(stat.read_cursor, ids[0])
+        self.assertTrue(await database_sync_to_async(Room.objects.has_new_message)(self.u1))
+
+        # without an id, up to the last message forwarded on the connection
+        c1 = await self.connect(self.u1)
+        await c0.send_json_to({'from': 'u0', 'to': room_name, 'type': ChatConsumer.CHAT_MSG,
+            'body': 'c'})
+        last = (await c1.receive_json_from())['id']
+        await c1.send_json_to(read)
+        await c1.disconnect()
+        await database_sync_to_async(stat.refresh_from_db)()
+        self.assertEqual(stat.read_cursor, last)
+        await self.disconnect(c0)
+        return
+
+    def create_messages(self, sender, receiver, cnt):
+        room = Room.objects.create(sender, receiver)
+        return [Message.objects.create(user=sender, room=room, content=f'm{i}') for i in range(cnt)]
+
+    async def test_chat_sync(self):
+        messages = await database_sync_to_async(self.create_messages)(self.u0, self.u1, 3)
+        room_name = Room.get_room_name(self.u0, self.u1)
+        c1 = await self.connect(self.u1)
+        with override_settings(CHAT_SYNC_BATCH=1):
+            await c1.send_json_to({'type': ChatConsumer.CHAT_SYNC,
+                'body': {'since': 0, 'rooms': {room_name: messages[0].id}}})
+            for message in messages[1:]:
+                event = await c1.receive_json_from()
+                self.assertEqual(event['type'], ChatConsumer.CHAT_SYNC)
+                self.assertEqual(event['messages'], [{'id': message.id, 'from': 'u0',
+                    'to': room_name, 'body': message.content}])
+        self.assertEqual(await c1.receive_json_from(), {'type': ChatConsumer.CHAT_SYNC, 'done': True})
+        await self.disconnect(c1)
+        return
+
+    async def test_chat_sync_unknown_room(self):
+        messages = await database_sync_to_async(self.create_messages)(self.u0, self.u1, 2)
+        c1 = await self.connect(self.u1)
+        await c1.send_json_to({'type': ChatConsumer.CHAT_SYNC,
+            'body': {'since': messages[0].id, 'rooms': {}}})
+        batch = (await c1.receive_json_from())['messages']
+        self.assertEqual([msg['id'] for msg in batch], [messages[1].id])
+        self.assertEqual(batch[0]['user_info']['username'], 'u0')
+        self.assertTrue((await c1.receive_json_from())['done'])
+        await self.disconnect(c1)
+        return
+
+    async def test_chat_sync_reset(self):
+        await database_sync_to_async(self.create_messages)(self.u0, self.u1, 3)
+        c1 = await self.connect(self.u1)
+        with override_settings(CHAT_SYNC_LIMIT=2):
+            await c1.send_json_to({'type': ChatConsumer.CHAT_SYNC, 'body': {'since': 0}})
+            self.assertEqual(await c1.receive_json_from(),
+                {'type': ChatConsumer.CHAT_SYNC, 'reset': True})
+        await self.disconnect(c1)
+        return
+
+
+@override_settings(CHAT_DELIVERY=ChatConsumer.ROOM_DELIVERY)
+class TestChatConsumerRoomDelivery(TestChatConsumer):
+    async def test_connect_groups(self):
+        c0 = await self.connect(self.u0)
+        await c0.send_json_to(self.new_chat(self.u0, self.u1))
+        await c0.receive_json_from()
+        await c0.disconnect()
+
+        c0 = await self.connect(self.u0)
+        layer = get_channel_layer()
+        self.assertIn(ChatConsumer.user_group(self.u0.id), layer.groups)
+        self.assertIn(Room.get_room_name(self.u0, self.u1), layer.groups)
+        await self.disconnect(c0)
+        self.assertNotIn(Room.get_room_name(self.u0, self.u1), layer.groups)
+        return
+
+
+@override_settings(CHAT_MESSAGE_WRITE=ChatConsumer.SYNC_WRITE)
+class TestChatConsumerSyncWrite(TestChatConsumer):
+    pass
+
+
+@override_settings(CHAT_ASYNC_DB=False)
+class TestChatConsumerSyncDB(TestChatConsumer):
+    pass
+
+
+class TestMessageBuffer(TransactionTestCase):
+    async_db = False
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.u0 = create_user('u0')
+        self.u1 = create_user('u1')
+        self.room = Room.objects.create_by_name(self.u0, Room.get_room_name(self.u0, self.u1))
+        return
+
+    def message(self, content, room_id=None):
+        return Message(user=self.u0, room_id=room_id or self.room.id, content=content)
+
+    def buffer(self, size, delay):
+        return MessageBuffer(size, delay, self.async_db)
+
+    async def test_flush_when_full(self):
+        buffer = self.buffer(size=2, delay=60)
+        await buffer.add(self.message('a'))
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 0)
+        await buffer.add(self.message('b'))
+        messages = await database_sync_to_async(list)(Message.objects.order_by('id'))
+        self.assertEqual([m.content for m in messages], ['a', 'b'])
+        await database_sync_to_async(self.room.refresh_from_db)()
+        self.assertEqual(self.room.last_message_id, messages[1].id)
+        stat = await database_sync_to_async(self.room.get_user_stat)(self.u0)
+        self.assertEqual(stat.read_cursor, messages[1].id)
+        self.assertTrue(await database_sync_to_async(has_unread)(self.u1))
+        self.assertFalse(await database_sync_to_async(has_unread)(self.u0))
+        self.assertIsNone(buffer.timer)
+        await db.close_pool()
+        return
+
+    async def test_flush_after_delay(self):
+        buffer = self.buffer(size=100, delay=0.01)
+        await buffer.add(self.message('a'))
+        await asyncio.sleep(0.1)
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 1)
+        await db.close_pool()
+        return
+
+    async def test_flush_keeps_valid_messages(self):
+        buffer = self.buffer(size=100, delay=60)
+        for message in (self.message('a'), self.message('b', room_id=self.room.id + 1),
+                self.message('c')):
+            await buffer.add(message)
+        await buffer.flush()
+        contents = await database_sync_to_async(list)(
+            Message.objects.order_by('id').values_list('content', flat=True))
+        self.assertEqual(contents, ['a', 'c'])
+        await db.close_pool()
+        return
+
+    async def test_reserved_ids(self):
+        buffer = self.buffer(size=2, delay=60)
+        messages = [self.message(content) for content in 'abc']
+        for message in messages:
+            await buffer.add(message)
+        ids = [message.id for message in messages]
+        self.assertEqual(ids, sorted(ids))
+        await buffer.flush()
+        saved = await database_sync_to_async(list)(
+            Message.objects.order_by('id').values_list('id', 'content'))
+        self.assertEqual(saved, list(zip(ids, 'abc')))
+        await db.close_pool()
+        return
+
+
+class TestMessageBufferAsyncDB(TestMessageBuffer):
+    async_db = True
@@ -1,9 +1,13 @@
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db.utils import IntegrityError
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from rmn_arch_0.chat.models import UserRoomStatus, Room, Message
+from rmn_arch_0.chat.unread import cache_read, cached_reads, forget_reads, has_unread, mark_read
 from rmn_arch_0.users.models import Settings
 from .._tools.utils import create_user
 
@@ -226,6 +230,78 @@ class TestRoom(TestCase):
         self.assertFalse(room in rooms)
         return
 
+    def test_last_message(self):
+        room = create_room_w_msg(self.u0, self.u1)
+        first = Message.objects.get()
+        room.refresh_from_db()
+        self.assertEqual(room.last_message, first)
+        self.assertEqual(room.get_user_stat(self.u0).read_cursor, first.id)
+        self.assertEqual(room.get_user_stat(self.u1).read_cursor, 0)
+
+        second = Message.objects.create(user=self.u1, room=room, content='second')
+        room.refresh_from_db()
+        self.assertEqual(room.last_message, second)
+        self.assertEqual(Room.objects.get_user_rooms(self.u0)[0].last_msg_content, 'second')
+
+        second.delete()
+        room.refresh_from_db()
+        self.assertEqual(room.last_message, first)
+        first.delete()
+        room.refresh_from_db()
+        self.assertIsNone(room.last_message)
+        return
+
+    def test_delete_user_messages(self):
+        room = create_room_w_msg(self.u0, self.u1)
+        first = Message.objects.get()
+        messages = Message.objects.bulk_save(
+            [Message(user=self.u1, room=room, content=str(i)) for i in range(20)])
+        # the same queries whatever the number of messages, with a single reset
+        with self.assertNumQueries(8):
+            Message.objects.filter(pk__in=[m.pk for m in messages[10:]]).delete()
+        room.refresh_from_db()
+        self.assertEqual(room.last_message, messages[9])
+
+        # one reset for the user's rooms, not one per deleted message
+        with CaptureQueriesContext(connection) as queries:
+            self.u1.delete()
+        self.assertEqual(len([q for q in queries if 'UPDATE "chat_room"' in q['sql']]), 2)
+        room.refresh_from_db()
+        self.assertEqual(room.last_message, first)
+        return
+
+    def test_get_user_rooms_queries(self):
+        create_room_w_msg(self.u0, self.u1)
+        # the rooms, and the unread ones to look up their cached read receipts
+        with self.assertNumQueries(2):
+            list(Room.objects.get_user_rooms(self.u0))
+        for i in range(3):
+            create_room_w_msg(create_user(f'u{i + 2}'), self.u0)
+        with self.assertNumQueries(2):
+            rooms = list(Room.objects.get_user_rooms(self.u0))
+        self.assertEqual(len(rooms), 4)
+        self.assertEqual([room.unread for room in rooms], [True, True, True, False])
+        return
+
+    def test_bulk_save(self):
+        room = Room.objects.create(self.u0, self.u1)
+        other = Room.objects.create(self.u0, create_user('u2'))
+        messages = [Message(user=(self.u0, self.u1)[i % 2], room=room, content=str(i))
+            for i in range(50)]
+        messages += [Message(user=self.u0, room=other, content=str(i)) for i in range(50)]
+        # a cursor update per room and sender, a last message update per room, one recipients query
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(9):
+            messages = Message.objects.bulk_save(messages)
+        room.refresh_from_db()
+        self.assertEqual(room.last_message, messages[49])
+        self.assertEqual(room.get_user_stat(self.u0).read_cursor, messages[48].id)
+        self.assertEqual(room.get_user_stat(self.u1).read_cursor, messages[49].id)
+        self.assertEqual(other.get_user_stat(self.u0).read_cursor, messages[99].id)
+        self.assertTrue(has_unread(self.u0))
+        self.assertTrue(has_unread(self.u1))
+        self.assertTrue(Room.objects.has_new_message(other.get_other_user_stat(self.u0).user))
+        return
+
     def test_has_new_message(self):
         create_room_w_msg(self.u0, self.u1)
         self.assertFalse(Room.objects.has_new_message(self.u0))
@@ -236,6 +312,101 @@ class TestRoom(TestCase):
         return
 
 
+class TestUnread(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.u0 = create_user('u0')
+        self.u1 = create_user('u1')
+        self.room = Room.objects.create(self.u0, self.u1)
+        return
+
+    def test_cached(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(has_unread(self.u1))
+        with self.assertNumQueries(0):
+            self.assertFalse(has_unread(self.u1))
+        return
+
+    def test_set_on_message(self):
+        self.assertFalse(has_unread(self.u0))
+        self.assertFalse(has_unread(self.u1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(user=self.u0, room=self.room, content='')
+        with self.assertNumQueries(0):
+            self.assertTrue(has_unread(self.u1))
+            self.assertFalse(has_unread(self.u0))
+        return
+
+    def test_blocked(self):
+        self.room.get_user_stat(self.u1).set_block(True)
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(user=self.u0, room=self.room, content='')
+        self.assertFalse(has_unread(self.u1))
+        return
+
+    def test_mark_read(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(user=self.u0, room=self.room, content='')
+        self.assertTrue(has_unread(self.u1))
+        self.room.get_user_stat(self.u1).update_last_view()
+        mark_read(self.u1)
+        self.assertFalse(has_unread(self.u1))
+        return
+
+    def test_read_room(self):
+        first = Message.objects.create(user=self.u0, room=self.room, content='')
+        when = timezone.now()
+        Message.objects.create(user=self.u0, room=self.room, content='')
+        UserRoomStatus.objects.read_room(self.u1.id, self.room.id, when)
+        stat = self.room.get_user_stat(self.u1)
+        self.assertEqual(stat.read_cursor, first.id)
+        self.assertEqual(stat.last_view, when)
+
+        # late receipts do not move the cursor back
+        UserRoomStatus.objects.read_room(self.u1.id, self.room.id, first.created)
+        self.assertEqual(self.room.get_user_stat(self.u1).read_cursor, first.id)
+        self.assertTrue(Room.objects.has_new_message(self.u1))
+        return
+
+    def test_read_room_cursor(self):
+        first = Message.objects.create(user=self.u0, room=self.room, content='')
+        Message.objects.create(user=self.u0, room=self.room, content='')
+        UserRoomStatus.objects.read_room(self.u1.id, self.room.id, timezone.now(), first.id)
+        self.assertEqual(self.room.get_user_stat(self.u1).read_cursor, first.id)
+        # a cursor past the room's messages only reads the existing ones
+        UserRoomStatus.objects.read_room(self.u1.id, self.room.id, timezone.now(), 10 ** 9)
+        self.assertEqual(self.room.get_user_stat(self.u1).read_cursor,
+            Message.objects.latest('id').id)
+        return
+
+    def test_cached_read(self):
+        message = Message.objects.create(user=self.u0, room=self.room, content='')
+        cache_read(self.u1.id, self.room.id, message.id)
+        self.assertFalse(Room.objects.has_new_message(self.u1))
+        self.assertFalse(Room.objects.get_user_rooms(self.u1)[0].unread)
+        Message.objects.create(user=self.u0, room=self.room, content='')
+        self.assertTrue(Room.objects.has_new_message(self.u1))
+        self.assertTrue(Room.objects.get_user_rooms(self.u1)[0].unread)
+        return
+
+    def test_forget_reads(self):
+        other = Room.objects.create(self.u0, create_user('u2'))
+        for room in (self.room, other):
+            message = Message.objects.create(user=self.u0, room=room, content='')
+            cache_read(self.u0.id, room.id, message.id)
+        forget_reads(self.u0.id, [self.room.id])
+        self.assertEqual(cached_reads(self.u0.id, [self.room.id, other.id]), {other.id: message.id})
+        return
+
+    @override_settings(CHAT_READ_CACHE=False)
+    def test_cached_read_disabled(self):
+        message = Message.objects.create(user=self.u0, room=self.room, content='')
+        cache_read(self.u1.id, self.room.id, message.id)
+        self.assertTrue(Room.objects.has_new_message(self.u1))
+        return
+
+
 def create_room_w_msg(u0, u1):
     """
     Returns a room created for u0 u1, with message created for u0
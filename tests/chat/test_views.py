@@ -0,0 +1,65 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rmn_arch_0.chat.models import Room, Message
+from rmn_arch_0.chat.views import ChatContentAJAXView
+from .._tools.utils import create_user
+
+
+class TestChatContentAJAXView(TestCase):
+    paginate_by = ChatContentAJAXView.paginate_by
+
+    def setUp(self):
+        super().setUp()
+        self.u0 = create_user('u0')
+        self.u0.set_password('password')
+        self.u0.save()
+        self.u1 = create_user('u1')
+        self.room = Room.objects.create(self.u0, self.u1)
+        self.url = reverse('chat:chat_content', kwargs={'room_name': self.room.name})
+        self.client.login(username='u0', password='password')
+        return
+
+    def create_msgs(self, num):
+        return [Message.objects.create(user=(self.u0, self.u1)[i % 2], room=self.room,
+            content=f'msg {i}') for i in range(num)]
+
+    def test_newest_page(self):
+        msgs = self.create_msgs(self.paginate_by + 5)
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(res.context['msgs']), msgs[-self.paginate_by:])
+        self.assertEqual(res.context['before'], msgs[5].id)
+        self.assertTemplateUsed(res, 'chat/chat_content.html')
+        return
+
+    def test_before(self):
+        msgs = self.create_msgs(self.paginate_by + 5)
+        res = self.client.get(f'{self.url}?before={msgs[5].id}')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(res.context['msgs']), msgs[:5])
+        self.assertEqual(res.context['before'], None)
+        self.assertTemplateNotUsed(res, 'chat/chat_content.html')
+        return
+
+    def test_invalid_before(self):
+        res = self.client.get(f'{self.url}?before=invalid')
+        self.assertEqual(res.status_code, 404)
+        return
+
+    def count_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        return len(queries)
+
+    def test_bounded_queries(self):
+        self.create_msgs(2)
+        num = self.count_queries()
+        self.create_msgs(self.paginate_by * 2)
+        self.assertEqual(self.count_queries(), num)
+        return
@@ -0,0 +1,112 @@
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives, get_connection, send_mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from datetime import timedelta
+import os
+
+from rmn_arch_0.core.jobs import clear_expired_sessions
+from rmn_arch_0.core.models import OutboxEmail
+
+OUTBOX_BACKEND = 'rmn_arch_0.core.mail.OutboxEmailBackend'
+LOCMEM_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+
+class FailingEmailBackend(EmailBackend):
+    """
+    Fail to send messages to fail@m.com
+    """
+    def send_messages(self, messages):
+        for message in messages:
+            if 'fail@m.com' in message.to:
+                raise ConnectionError('failed')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND=OUTBOX_BACKEND, OUTBOX_EMAIL_BACKEND=LOCMEM_BACKEND,
+    OUTBOX_RATE_LIMIT=0)
+class TestOutboxEmail(TestCase):
+    def send(self, to='to@m.com'):
+        message = EmailMultiAlternatives('subject', 'body', 'from@m.com', [to],
+            headers={'X-Test': '1'})
+        message.attach_alternative('<p>body</p>', 'text/html')
+        message.attach('a.txt', 'attachment', 'text/plain')
+        return message.send()
+
+    def test_backend_stores(self):
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, ['to@m.com'])
+        self.assertEqual(email.alternatives, [['<p>body</p>', 'text/html']])
+
+        message = email.to_message()
+        self.assertEqual(message.subject, 'subject')
+        self.assertEqual(message.extra_headers, {'X-Test': '1'})
+        self.assertEqual(message.alternatives, [('<p>body</p>', 'text/html')])
+        self.assertEqual(message.attachments, [('a.txt', 'attachment', 'text/plain')])
+        return
+
+    def test_rolled_back_with_transaction(self):
+        try:
+            with transaction.atomic():
+                send_mail('subject', 'body', None, ['to@m.com'])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(OutboxEmail.objects.exists())
+        return
+
+    def test_send_batch(self):
+        for _ in range(3):
+            self.send()
+        connection = get_connection(LOCMEM_BACKEND)
+        self.assertEqual(OutboxEmail.objects.send_batch(connection, 2), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(OutboxEmail.objects.send_batch(connection, 2), 1)
+        self.assertEqual(OutboxEmail.objects.send_batch(connection, 2), 0)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.assertEqual(mail.outbox[0].alternatives, [('<p>body</p>', 'text/html')])
+        return
+
+    def test_send_batch_retry(self):
+        self.send('fail@m.com')
+        self.send()
+        self.assertEqual(OutboxEmail.objects.send_batch(FailingEmailBackend()), 2)
+        self.assertEqual(len(mail.outbox), 1)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('ConnectionError: failed', email.last_error)
+        self.assertGreater(email.send_after, timezone.now())
+
+        for _ in range(OutboxEmail.MAX_ATTEMPTS - 1):
+            OutboxEmail.objects.update(send_after=timezone.now())
+            OutboxEmail.objects.send_batch(FailingEmailBackend())
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.FAILED)
+        return
+
+    def test_send_outbox_command(self):
+        for _ in range(3):
+            self.send()
+        call_command('send_outbox', '--once', stdout=open(os.devnull, 'w'))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(OutboxEmail.objects.exists())
+        return
+
+
+class TestClearExpiredSessions(TestCase):
+    def test_clear_expired_sessions(self):
+        Session.objects.create(session_key='expired', session_data='',
+            expire_date=timezone.now() - timedelta(days=1))
+        Session.objects.create(session_key='active', session_data='',
+            expire_date=timezone.now() + timedelta(days=1))
+        clear_expired_sessions()
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+        return
@@ -0,0 +1,116 @@
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from datetime import timedelta
+import os
+from unittest.mock import patch
+
+from rmn_arch_0.jobs.models import Job
+from rmn_arch_0.jobs.registry import PERIODIC, job
+from rmn_arch_0.users.models import User
+
+
+@job
+def create_user(username):
+    User.objects.create(username=username, email=f'{username}@m.com')
+    return
+
+
+@job
+def create_user_and_fail(username):
+    User.objects.create(username=username, email=f'{username}@m.com')
+    raise ValueError('failed')
+
+
+@job
+def succeed():
+    return
+
+
+@job
+def fail():
+    raise ValueError('failed')
+
+
+class TestJob(TestCase):
+    def test_enqueue(self):
+        job = create_user.enqueue(username='test')
+        self.assertEqual(job.name, 'tests.jobs.test_models.create_user')
+        self.assertEqual(job.payload, {'username': 'test'})
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertLessEqual(job.run_at, timezone.now())
+        return
+
+    def test_run_batch(self):
+        for i in range(3):
+            create_user.enqueue(username=f'test{i}')
+        self.assertEqual(Job.objects.run_batch(2), 2)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(Job.objects.run_batch(2), 1)
+        self.assertEqual(Job.objects.run_batch(2), 0)
+        self.assertEqual(User.objects.count(), 3)
+        return
+
+    def test_delay(self):
+        create_user.enqueue(delay=timedelta(minutes=1), username='test')
+        self.assertEqual(Job.objects.run_batch(), 0)
+        self.assertFalse(User.objects.exists())
+        return
+
+    def test_failure_rolled_back(self):
+        failing = create_user_and_fail.enqueue(username='failed')
+        create_user.enqueue(username='test')
+        self.assertEqual(Job.objects.run_batch(), 2)
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['test'])
+
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, Job.PENDING)
+        self.assertEqual(failing.attempts, 1)
+        self.assertIn('ValueError: failed', failing.last_error)
+        self.assertGreater(failing.run_at, timezone.now())
+        # not due until the retry delay passed
+        self.assertEqual(Job.objects.run_batch(), 0)
+        return
+
+    def test_max_attempts(self):
+        failing = create_user_and_fail.enqueue(username='failed')
+        for _ in range(Job.MAX_ATTEMPTS):
+            Job.objects.filter(pk=failing.pk).update(run_at=timezone.now())
+            self.assertEqual(Job.objects.run_batch(), 1)
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, Job.FAILED)
+        self.assertEqual(failing.attempts, Job.MAX_ATTEMPTS)
+        Job.objects.filter(pk=failing.pk).update(run_at=timezone.now())
+        self.assertEqual(Job.objects.run_batch(), 0)
+        return
+
+    def test_schedule_periodic(self):
+        self.assertEqual(Job.objects.schedule_periodic(), len(PERIODIC))
+        self.assertEqual(Job.objects.schedule_periodic(), 0)
+        self.assertEqual(Job.objects.filter(name__in=PERIODIC).count(), len(PERIODIC))
+        return
+
+    def test_periodic_chain(self):
+        periodic = {succeed.job_name: timedelta(minutes=1), fail.job_name: timedelta(minutes=1)}
+        with patch.dict(PERIODIC, periodic, clear=True):
+            self.assertEqual(Job.objects.schedule_periodic(), 2)
+            self.assertEqual(Job.objects.run_batch(), 2)
+            self.assertEqual(Job.objects.schedule_periodic(), 0)
+        failed = Job.objects.get(status=Job.FAILED)
+        self.assertEqual(failed.name, fail.job_name)
+        self.assertEqual(failed.attempts, 1)
+        # the next run of both, whether or not this one succeeded
+        pending = Job.objects.filter(status=Job.PENDING)
+        self.assertEqual(sorted(pending.values_list('name', flat=True)), sorted(periodic))
+        for pending_job in pending:
+            self.assertGreater(pending_job.run_at, timezone.now())
+        return
+
+    def test_run_jobs_command(self):
+        for i in range(3):
+            create_user.enqueue(username=f'test{i}')
+        call_command('run_jobs', '--once', '--batch-size', '2', stdout=open(os.devnull, 'w'))
+        self.assertFalse(Job.objects.filter(name=create_user.job_name).exists())
+        self.assertEqual(User.objects.count(), 3)
+        return
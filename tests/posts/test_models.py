@@ -1,21 +1,36 @@
+from django.apps import apps as django_apps
 from django.conf import settings
 from django.core import mail
+from django.core.management import call_command
 from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.templatetags.static import static
 from django.test import TestCase
+from django.utils import timezone
 from django.urls.base import reverse
 
+from datetime import timedelta
+from importlib import import_module
+import os
+import shutil
 from random import randrange
 
 from rmn_arch_0.posts.models import (
     AnonymousUserMixIn,
     Post,
+    PostRank,
+    PostStats,
     PostImage,
     Rating,
     Comment,
     Report,
     )
+from rmn_arch_0.core.images import variant_name
+from rmn_arch_0.core.search import text_query
+from rmn_arch_0.jobs.models import Job
+from rmn_arch_0.posts.jobs import send_report_notification
 from rmn_arch_0.users.models import User, Profile, Settings
+from .._tools.utils import TEST_IMG_PATH
 
 
 class UserPostTestCase(TestCase):
@@ -149,6 +164,20 @@ class TestPost(UserPostTestCase):
         self.assertEqual(self.post.thumbnail_image_url, f'/media/image_0.jpg')
         return
 
+    def test_cover(self):
+        images = [PostImage.objects.create(post=self.post, image=f'image_{i}.jpg') for i in range(3)]
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.cover, images[0])
+        self.assertEqual(self.post.thumbnail_image_url, '/media/image_0.jpg')
+        images[0].delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.cover, images[1])
+        for image in images[1:]:
+            image.delete()
+        self.post.refresh_from_db()
+        self.assertIsNone(self.post.cover)
+        return
+
     def test_get_absolute_url(self):
         self.user.username = 'testusername'
         self.assertEqual(self.user.get_absolute_url(),
@@ -216,7 +245,110 @@ class TestPost(UserPostTestCase):
         return
 
 
+class TestPostStats(UserPostTestCase):
+    def get_stats(self):
+        return PostStats.objects.get(post=self.post)
+
+    def test_created_with_post(self):
+        stats = self.get_stats()
+        for field in PostStats.COUNTER_FIELDS:
+            self.assertEqual(getattr(stats, field), 0)
+        return
+
+    def test_rating_histogram(self):
+        Rating.objects.create(post=self.post, session_key='k0', rate=1)
+        Rating.objects.create(post=self.post, session_key='k1', rate=5)
+        rating = Rating.objects.create(post=self.post, session_key='k2', rate=5)
+        self.assertEqual(self.post.rating_histogram, {1: 1, 2: 0, 3: 0, 4: 0, 5: 2})
+        self.assertEqual(self.get_stats().rate_sum, 11)
+        return
+
+    def test_rating_update(self):
+        rating = Rating.objects.create(post=self.post, session_key='k0', rate=2)
+        rating.rate = 4
+        rating.save()
+        Rating.objects.update_or_create(post=self.post, session_key='k0', defaults={'rate': 5})
+        stats = self.get_stats()
+        self.assertEqual(stats.rating_count, 1)
+        self.assertEqual(stats.rate_sum, 5)
+        self.assertEqual(stats.rate_2_count, 0)
+        self.assertEqual(stats.rate_4_count, 0)
+        self.assertEqual(stats.rate_5_count, 1)
+        return
+
+    def test_delete(self):
+        Rating.objects.create(post=self.post, session_key='k0', rate=3)
+        Rating.objects.create(post=self.post, session_key='k1', rate=4)
+        Comment.objects.create(post=self.post, user=self.user, description='')
+        PostImage.objects.create(post=self.post, image='.')
+        Rating.objects.get(session_key='k0').delete()
+        Comment.objects.all().delete()
+        PostImage.objects.all().delete()
+        stats = self.get_stats()
+        self.assertEqual(stats.rating_count, 1)
+        self.assertEqual(stats.rate_sum, 4)
+        self.assertEqual(stats.rate_3_count, 0)
+        self.assertEqual(stats.comment_count, 0)
+        self.assertEqual(stats.image_count, 0)
+        return
+
+    def test_reconcile(self):
+        for i in range(3):
+            Rating.objects.create(post=self.post, session_key=f'k{i}', rate=i + 1)
+        Comment.objects.create(post=self.post, user=self.user, description='')
+        other = Post.objects.create(user=self.user)
+        PostImage.objects.create(post=other, image='.')
+        PostStats.objects.all().update(rating_count=100, comment_count=7, image_count=0)
+        PostStats.objects.filter(post=other).delete()
+
+        call_command('reconcile_post_stats', chunk_size=1, stdout=open(os.devnull, 'w'))
+        stats = self.get_stats()
+        self.assertEqual(stats.rating_count, 3)
+        self.assertEqual(stats.rate_sum, 6)
+        self.assertEqual(stats.rate_2_count, 1)
+        self.assertEqual(stats.comment_count, 1)
+        self.assertEqual(stats.image_count, 0)
+        self.assertEqual(PostStats.objects.get(post=other).image_count, 1)
+        return
+
+    def test_stale_rating_update(self):
+        Rating.objects.create(post=self.post, session_key='k0', rate=3)
+        first, second = Rating.objects.get(), Rating.objects.get()
+        first.rate = 4
+        first.save()
+        second.rate = 5
+        second.save()
+        stats = self.get_stats()
+        self.assertEqual(stats.rate_sum, 5)
+        self.assertEqual([stats.rate_3_count, stats.rate_4_count, stats.rate_5_count], [0, 0, 1])
+        return
+
+    def test_drifted_counters(self):
+        Comment.objects.create(post=self.post, user=self.user, description='')
+        PostStats.objects.all().update(comment_count=0)
+        Comment.objects.all().delete()
+        self.assertEqual(self.get_stats().comment_count, 0)
+        return
+
+    def test_migration_backfill(self):
+        Rating.objects.create(post=self.post, session_key='k0', rate=2)
+        Rating.objects.create(post=self.post, session_key='k1', rate=5)
+        Comment.objects.create(post=self.post, user=self.user, description='')
+        PostStats.objects.all().delete()
+        import_module('rmn_arch_0.posts.migrations.0002_poststats').create_stats(django_apps, None)
+        stats = self.get_stats()
+        self.assertEqual((stats.rating_count, stats.rate_sum, stats.comment_count), (2, 7, 1))
+        self.assertEqual([stats.rate_2_count, stats.rate_5_count, stats.image_count], [1, 1, 0])
+        return
+
+
 class TestPostImage(UserPostTestCase):
+    def tearDown(self):
+        path = f'{settings.MEDIA_ROOT}/uploads/posts/{self.post.uuid}'
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        return super().tearDown()
+
     def test_clean_within_limit(self):
         for _ in range(PostImage.MAX_IMAGES):
             image = PostImage(post=self.post, image='.')
@@ -249,6 +381,66 @@ class TestPostImage(UserPostTestCase):
         return
 
 
+    def test_variants(self):
+        with open(TEST_IMG_PATH, 'rb') as img:
+            image = PostImage.objects.create(post=self.post,
+                image=SimpleUploadedFile('img.png', img.read(), content_type='image/png'))
+        self.assertFalse(image.variants_ready)
+        self.assertEqual(image.tile_url, image.image.url)
+        call_command('make_image_variants', stdout=open(os.devnull, 'w'))
+        image.refresh_from_db()
+        self.assertTrue(image.variants_ready)
+        self.assertEqual(image.tile_url,
+            image.image.storage.url(variant_name(image.image.name, 'tile')))
+        self.assertEqual(image.modal_url,
+            image.image.storage.url(variant_name(image.image.name, 'modal')))
+        tile = image.image.storage.path(variant_name(image.image.name, 'tile'))
+        self.assertTrue(os.path.exists(tile))
+        # files are deleted once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(os.path.exists(tile))
+        return
+
+    def test_variants_same_stem(self):
+        images = []
+        with open(TEST_IMG_PATH, 'rb') as img:
+            content = img.read()
+        for name in ('img.png', 'img.jpg'):
+            images.append(PostImage.objects.create(post=self.post,
+                image=SimpleUploadedFile(name, content, content_type='image/png')))
+        call_command('make_image_variants', stdout=open(os.devnull, 'w'))
+        tiles = [image.image.storage.path(variant_name(image.image.name, 'tile')) for image in images]
+        self.assertNotEqual(tiles[0], tiles[1])
+        self.assertTrue(all(os.path.exists(tile) for tile in tiles))
+        # deleting one keeps the variants of the other
+        with self.captureOnCommitCallbacks(execute=True):
+            images[0].delete()
+        self.assertFalse(os.path.exists(tiles[0]))
+        self.assertTrue(os.path.exists(tiles[1]))
+        return
+
+
+class TestPostSearch(UserPostTestCase):
+    def test_search_vector(self):
+        self.post.description = 'Running in the mountains'
+        self.post.save()
+        comment = Comment.objects.create(user=self.user, post=self.post, description='Lovely lakes')
+        self.assertTrue(Post.objects.filter(pk=self.post.pk, search_vector=text_query('run')).exists())
+        self.assertTrue(Post.objects.filter(search_vector=text_query('mountain -lake')).exists())
+        self.assertFalse(Post.objects.filter(search_vector=text_query('lake')).exists())
+        self.assertTrue(Comment.objects.filter(pk=comment.pk, search_vector=text_query('lake')).exists())
+        # updates of other fields leave it as is
+        Post.objects.filter(pk=self.post.pk).update(show=False)
+        self.post.refresh_from_db()
+        self.assertIsNotNone(self.post.search_vector)
+        self.post.description = 'Beach'
+        self.post.save()
+        self.assertFalse(Post.objects.filter(search_vector=text_query('mountain')).exists())
+        self.assertIsNone(text_query('  '))
+        return
+
+
 class TestRating(UserPostTestCase):
     def test_rating_min(self):
         rating = Rating(user=self.user, post=self.post, rate=Rating.MIN_RATING)
@@ -308,6 +500,48 @@ class TestRating(UserPostTestCase):
             rating.full_clean()
         return
 
+    def test_upsert(self):
+        session_key = '5egnljcgzyfrlnjvr953log61nmg5abc'
+        with self.assertNumQueries(4):   # upsert and stats update in a savepoint
+            rating = Rating.objects.upsert(self.post.id, 3, session_key=session_key)
+        Rating.objects.upsert(self.post.id, 2, user=self.user)
+        rating = Rating.objects.upsert(self.post.id, 5, session_key=session_key)
+        self.assertEqual(rating, Rating.objects.get(session_key=session_key))
+        self.assertEqual(Rating.objects.get(pk=rating.pk).rate, 5)
+        stats = PostStats.objects.get(post=self.post)
+        self.assertEqual(stats.rating_count, 2)
+        self.assertEqual(stats.rate_sum, 7)
+        self.assertEqual([stats.rate_2_count, stats.rate_3_count, stats.rate_5_count], [1, 0, 1])
+        # unchanged rate leaves the stats as they are
+        Rating.objects.upsert(self.post.id, 5, session_key=session_key)
+        self.assertEqual(PostStats.objects.get(post=self.post).rate_sum, 7)
+        return
+
+    def test_upsert_anonymous(self):
+        rating = Rating.objects.upsert(self.post.id, 3, user=self.user)
+        self.assertFalse(rating.anonymous)
+        self.settings.rate_anon = True
+        rating = Rating.objects.upsert(self.post.id, 4, user=self.user)
+        self.assertTrue(rating.anonymous)
+        self.settings.rate_anon = False
+        rating = Rating.objects.upsert(self.post.id, 4, user=self.user)
+        self.assertTrue(Rating.objects.get(pk=rating.pk).anonymous)
+        return
+
+    def test_upsert_invalid(self):
+        session_key = '5egnljcgzyfrlnjvr953log61nmg5abc'
+        for rate in [Rating.MIN_RATING - 1, Rating.MAX_RATING + 1, 'a', None]:
+            with self.assertRaises(ValidationError):
+                Rating.objects.upsert(self.post.id, rate, session_key=session_key)
+        with self.assertRaisesMessage(ValidationError,
+            'One of user or session_key should be set, not both'):
+            Rating.objects.upsert(self.post.id, 3)
+        with self.assertRaisesMessage(ValidationError,
+            'One of user or session_key should be set, not both'):
+            Rating.objects.upsert(self.post.id, 3, user=self.user, session_key=session_key)
+        self.assertFalse(Rating.objects.exists())
+        return
+
 
 class TestReport(UserPostTestCase):
     def test_uniqueness(self):
@@ -341,6 +575,9 @@ class TestReport(UserPostTestCase):
         report.save()
         self.assertTrue(report.post.reportable)
         self.assertFalse(report.post.show)
+        # the notification is sent by a job
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('run_jobs', '--once', stdout=open(os.devnull, 'w'))
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, f'Your Post {report.post.uuid} Has Been Hidden')
         self.assertEqual(mail.outbox[0].from_email, settings.DEFAULT_FROM_EMAIL)
@@ -363,6 +600,46 @@ class TestReport(UserPostTestCase):
         self.assertEqual(len(mail.outbox), 0)
         return
 
+    def test_upsert(self):
+        report = Report.objects.upsert(self.user, self.post, Report.R_SPAM, 'spam')
+        self.assertEqual(PostStats.objects.get(post=self.post).report_count, 1)
+        Report.objects.upsert(self.user, self.post, Report.R_HATE, 'hate')
+        self.assertEqual(PostStats.objects.get(post=self.post).report_count, 1)
+        saved = Report.objects.get()
+        self.assertEqual(saved, report)
+        self.assertEqual((saved.reason, saved.description), (Report.R_HATE, 'hate'))
+        self.assertGreater(saved.modified, saved.created)
+        return
+
+    def test_hidden_once(self):
+        PostStats.objects.filter(post=self.post).update(report_count=Report.REPORT_THRESHOLD)
+        users = [User.objects.create(username=f't{i}', email=f't{i}') for i in range(2)]
+        # the second report is saved with a post loaded before the first one hid it
+        reports = [Report(user=user, post=Post.objects.get(pk=self.post.pk), reason='r0',
+            description='test') for user in users]
+        for report in reports:
+            report.save()
+        self.assertFalse(reports[0].post.show)
+        self.assertTrue(reports[1].post.show)
+        self.assertEqual(PostStats.objects.get(post=self.post).report_count,
+            Report.REPORT_THRESHOLD + 2)
+        self.assertEqual(Job.objects.filter(name=send_report_notification.job_name).count(), 1)
+        return
+
+    def test_report_queries(self):
+        PostStats.objects.filter(post=self.post).update(report_count=Report.REPORT_THRESHOLD)
+        # savepoint, insert, increment, conditional hide, job, savepoint
+        with self.assertNumQueries(6):
+            Report.objects.upsert(self.user, self.post, Report.R_OTHER, 'test')
+        return
+
+    def test_upsert_auto_hidden(self):
+        PostStats.objects.filter(post=self.post).update(report_count=Report.REPORT_THRESHOLD)
+        Report.objects.upsert(self.user, self.post, Report.R_OTHER, 'test')
+        self.post.refresh_from_db()
+        self.assertFalse(self.post.show)
+        return
+
 
 class TestSettings(UserPostTestCase):
     def test_rate_anon(self):
@@ -382,3 +659,51 @@ class TestSettings(UserPostTestCase):
         comment = Comment.objects.create(user=self.user, post=self.post, description='')
         self.assertTrue(comment.anonymous)
         return
+
+
+class TestPostRank(UserPostTestCase):
+    def rate(self, post, rates, created=None):
+        for i, rate in enumerate(rates):
+            rating = Rating.objects.create(session_key=f'{post.id}_{i}', post=post, rate=rate)
+            if created:
+                Rating.objects.filter(pk=rating.pk).update(created=created)
+        return
+
+    def test_compute(self):
+        low, many, hidden = [Post.objects.create(user=self.user) for _ in range(3)]
+        self.rate(self.post, [5, 5])
+        self.rate(low, [1, 2, 3])
+        self.rate(many, [5] * 10)
+        self.rate(hidden, [5] * 20)
+        hidden.show = False
+        hidden.save()
+
+        ranks = PostRank.objects.compute(PostRank.WEEKLY)
+        self.assertEqual([rank.post_id for rank in ranks], [many.id, self.post.id, low.id])
+        self.assertEqual([rank.position for rank in ranks], [1, 2, 3])
+        self.assertEqual(ranks[0].rating_count, 10)
+        self.assertEqual(ranks[0].rate_sum, 50)
+        many.refresh_from_db()
+        self.assertAlmostEqual(ranks[0].score, many.rank_rate)
+        return
+
+    def test_windows(self):
+        post = Post.objects.create(user=self.user)
+        self.rate(self.post, [5], created=timezone.now() - timedelta(days=10))
+        self.rate(post, [4])
+        weekly = PostRank.objects.compute(PostRank.WEEKLY)
+        monthly = PostRank.objects.compute(PostRank.MONTHLY)
+        self.assertEqual([rank.post_id for rank in weekly], [post.id])
+        self.assertEqual([rank.post_id for rank in monthly], [self.post.id, post.id])
+        return
+
+    def test_refresh(self):
+        self.rate(self.post, [5])
+        self.assertEqual(PostRank.objects.refresh(PostRank.WEEKLY), 1)
+        post = Post.objects.create(user=self.user)
+        self.rate(post, [5, 5])
+        self.assertEqual(PostRank.objects.refresh(PostRank.WEEKLY), 2)
+        self.assertEqual(list(PostRank.objects.filter(period=PostRank.WEEKLY).order_by(
+            'position').values_list('post_id', flat=True)), [post.id, self.post.id])
+        self.assertFalse(PostRank.objects.filter(period=PostRank.MONTHLY).exists())
+        return
@@ -2,17 +2,26 @@ from django.conf import settings
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import urlsafe_base64_encode
 
 import json
 import os
 import random
 import shutil
+from unittest.mock import patch
 from uuid import uuid4
 
 from .._tools.utils import TEST_IMG_PATH, create_user, create_posts
-from rmn_arch_0.posts.models import Post, PostImage, Rating
+from rmn_arch_0.jobs.models import Job
+from rmn_arch_0.posts.cache import home_cache_generation
+from rmn_arch_0.posts.jobs import refresh_rankings
+from rmn_arch_0.posts.models import (
+    Post, PostImage, PostStats, Rating, Comment, Report, TimelineEntry)
 from rmn_arch_0.users.models import User, Settings
 
 
@@ -23,6 +32,10 @@ RATE = reverse('posts:rate')
 USER_POSTS = reverse('posts:user_posts', kwargs={'username':STR_TKN})
 POST_DETAIL = reverse('posts:post_detail_modal', kwargs={'uuid':STR_TKN})
 FOLLOW = reverse('posts:follow')
+RANK = reverse('posts:rank')
+SEARCH = reverse('posts:search')
+SEARCH_COMMENTS = reverse('posts:search_comments')
+SEARCH_USERS = reverse('posts:search_users')
 
 
 class BasePostTestCase(TestCase):
@@ -275,6 +288,31 @@ class TestPostRateAJAXView(BasePostTestCase):
         return
 
 
+class TestPostReportAJAXView(BasePostTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(user=self.user)
+        self.url = reverse('posts:post_report', kwargs={'uuid': self.post.uuid})
+        return
+
+    def test_report(self):
+        res = self.client.post(self.url, {'report-reason': Report.R_SPAM, 'report-description': 'spam'})
+        self.assertEqual(res.status_code, 200)
+        res = self.client.post(self.url, {'report-reason': Report.R_HATE, 'report-description': 'hate'})
+        self.assertEqual(res.status_code, 200)
+        report = Report.objects.get()
+        self.assertEqual((report.user, report.post), (self.user, self.post))
+        self.assertEqual((report.reason, report.description), (Report.R_HATE, 'hate'))
+        self.assertEqual(PostStats.objects.get(post=self.post).report_count, 1)
+        return
+
+    def test_invalid_report(self):
+        res = self.client.post(self.url, {'report-reason': 'r9', 'report-description': 'test'})
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(Report.objects.exists())
+        return
+
+
 class TestHomeView(TestCase):
     paginate_by = 20
 
@@ -288,6 +326,11 @@ class TestHomeView(TestCase):
             PostImage.objects.create(image='.', post=post)
         return
 
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        return
+
     def test_base_behaviour(self):
         res = self.client.get(HOME)
         self.assertEqual(res.status_code, 200)
@@ -298,7 +341,8 @@ class TestHomeView(TestCase):
         return
 
     def test_subsequent_page(self):
-        res = self.client.get(f'{HOME}?page=2')
+        res = self.client.get(HOME)
+        res = self.client.get(f'{HOME}?after={res.context["paginate_hook"]}')
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(res.context['posts']), self.paginate_by)
         posts = Post.objects.order_by('-created')
@@ -306,6 +350,33 @@ class TestHomeView(TestCase):
             self.assertEqual(posts[self.paginate_by + i].uuid, res.context['posts'][i].uuid)
         return
 
+    def test_last_page(self):
+        cursor = ''
+        uuids = []
+        while True:
+            res = self.client.get(f'{HOME}?after={cursor}' if cursor else HOME)
+            uuids += [post.uuid for post in res.context['posts']]
+            cursor = res.context['paginate_hook']
+            if not cursor:
+                break
+        self.assertEqual(len(uuids), self.posts_num)
+        self.assertEqual(uuids, [post.uuid for post in Post.objects.order_by('-id')])
+        return
+
+    def test_subsequent_page_no_count(self):
+        res = self.client.get(HOME)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(f'{HOME}?after={res.context["paginate_hook"]}')
+        self.assertEqual(res.status_code, 200)
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'])
+        return
+
+    def test_invalid_cursor(self):
+        res = self.client.get(f'{HOME}?after=invalid')
+        self.assertEqual(res.status_code, 404)
+        return
+
     def test_session_user(self):
         posts = Post.objects.order_by('-created')
         rated = {}
@@ -357,6 +428,18 @@ class TestHomeView(TestCase):
                 self.assertEqual(res.context['posts'][i].rate, None)
         return
 
+    def test_other_viewers_ratings(self):
+        posts = Post.objects.order_by('-id')
+        for i in range(3):
+            Rating.objects.create(session_key=f'other{i}', post=posts[0], rate=Rating.MAX_RATING)
+        Rating.objects.create(
+            session_key=self.client.session.session_key, post=posts[1], rate=Rating.MIN_RATING)
+        res = self.client.get(HOME)
+        self.assertEqual(res.context['posts'][0].rate, None)
+        self.assertEqual(res.context['posts'][1].rate, Rating.MIN_RATING)
+        self.assertEqual(len(res.context['posts']), self.paginate_by)
+        return
+
     def test_hidden_post(self):
         post = Post.objects.create(user=self.user)
         PostImage.objects.create(image='.', post=post)
@@ -370,6 +453,209 @@ class TestHomeView(TestCase):
         return
 
 
+class TestHomeCache(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = create_user()
+        self.user.set_password('password')
+        self.user.save()
+        self.posts = create_posts(self.user, 30)
+        # first visit sets the visited cookie
+        self.client.get(HOME)
+        return
+
+    def get(self, url=HOME):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return res, [q['sql'] for q in queries.captured_queries if 'posts_post' in q['sql']]
+
+    def posts_html(self, res):
+        """
+        Return the rendered posts, without the per request csrf token of the full page
+        """
+        content = res.content.decode()
+        if '<main class="grid">' in content:
+            content = content.split('<main class="grid">')[1].split('</main>')[0]
+        return content
+
+    def test_cached(self):
+        res, _ = self.get()
+        cached, queries = self.get()
+        self.assertEqual(queries, [])
+        self.assertEqual(self.posts_html(cached), self.posts_html(res))
+        self.assertContains(cached, self.posts[-1].get_absolute_url())
+
+        cursor = json.loads(cached.content.decode().split(
+            '<script id="paginate_hook" type="application/json">')[1].split('</script>')[0])
+        res, _ = self.get(f'{HOME}?after={cursor}')
+        cached, queries = self.get(f'{HOME}?after={cursor}')
+        self.assertEqual(queries, [])
+        self.assertEqual(self.posts_html(cached), self.posts_html(res))
+        self.assertContains(cached, self.posts[0].get_absolute_url())
+        return
+
+    def test_cursor_keys(self):
+        self.get()
+        # the first page shows the 20 newest posts
+        boundary = self.posts[-20].id
+        self.get(f'{HOME}?after={urlsafe_base64_encode(str(boundary).encode())}')
+        # another token of the same id shares the cached page
+        _, queries = self.get(f'{HOME}?after={urlsafe_base64_encode(f"0{boundary}".encode())}')
+        self.assertEqual(queries, [])
+
+        # cursors not emitted by the cached pages are not cached
+        cursor = urlsafe_base64_encode(str(boundary - 1).encode())
+        self.get(f'{HOME}?after={cursor}')
+        _, queries = self.get(f'{HOME}?after={cursor}')
+        self.assertNotEqual(queries, [])
+        self.assertIsNone(cache.get(f'home_posts:{home_cache_generation()}:{boundary - 1}'))
+        return
+
+    def test_featured_reproducible(self):
+        res, _ = self.get()
+        cache.delete(f'home_posts:{home_cache_generation()}:')
+        again, queries = self.get()
+        self.assertNotEqual(queries, [])
+        self.assertIn(' featured', self.posts_html(res))
+        self.assertEqual(self.posts_html(again), self.posts_html(res))
+        return
+
+    def test_invalidated(self):
+        self.get()
+        post = create_posts(self.user)[0]
+        res, queries = self.get()
+        self.assertNotEqual(queries, [])
+        self.assertContains(res, post.get_absolute_url())
+
+        post.show = False
+        post.save()
+        res, _ = self.get()
+        self.assertNotContains(res, post.get_absolute_url())
+        post.show = True
+        post.save()
+        res, _ = self.get()
+        self.assertContains(res, post.get_absolute_url())
+        return
+
+    def test_first_visit(self):
+        self.client.cookies.clear()
+        res, _ = self.get()
+        self.assertTrue(res.context['first_visit'])
+        self.assertIn('visited', res.cookies)
+        res, _ = self.get()
+        self.assertFalse(res.context['first_visit'])
+        self.assertFalse(Session.objects.exists())
+
+        # only rating creates the session
+        self.client.post(RATE, {'uuid': str(self.posts[0].uuid), 'rate': 5},
+            content_type='application/json')
+        self.assertEqual(Session.objects.count(), 1)
+        return
+
+    def test_viewer_with_ratings(self):
+        self.get()
+        Rating.objects.create(session_key=self.client.session.session_key,
+            post=self.posts[-1], rate=Rating.MAX_RATING)
+        res, queries = self.get()
+        self.assertNotEqual(queries, [])
+        self.assertEqual(res.context['posts'][0].rate, Rating.MAX_RATING)
+
+        self.client.login(username=self.user.username, password='password')
+        self.get()
+        res, queries = self.get()
+        self.assertNotEqual(queries, [])
+        return
+
+
+class TestFeedQueries(TestCase):
+    """
+    Rendering a feed page should cost a constant number of queries
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.follower = create_user('follower')
+        self.follower.set_password('password')
+        self.follower.save()
+        self.follower.relations.follows.add(self.user)
+        return
+
+    def create_posts(self, num):
+        for post in create_posts(self.user, num):
+            PostImage.objects.create(image='.', post=post)
+        return
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return len(queries)
+
+    def test_home(self):
+        self.create_posts(2)
+        # first visit sets the visited cookie
+        self.client.get(HOME)
+        num = self.count_queries(HOME)
+        self.create_posts(20)
+        self.assertEqual(self.count_queries(HOME), num)
+        return
+
+    def test_user_posts(self):
+        url = USER_POSTS.replace(STR_TKN, self.user.username)
+        self.create_posts(2)
+        num = self.count_queries(url)
+        self.create_posts(10)
+        self.assertEqual(self.count_queries(url), num)
+        return
+
+    def test_follow(self):
+        self.client.login(username='follower', password='password')
+        self.create_posts(2)
+        Job.objects.run_batch()
+        num = self.count_queries(FOLLOW)
+        self.create_posts(10)
+        Job.objects.run_batch(20)
+        self.assertEqual(self.count_queries(FOLLOW), num)
+        return
+
+
+class TestRankView(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.posts = create_posts(self.user, 3)
+        for i, post in enumerate(self.posts):
+            for j in range(i + 1):
+                Rating.objects.create(session_key=f'{i}_{j}', post=post, rate=5)
+        return
+
+    def test_empty(self):
+        res = self.client.get(RANK)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.context['rankings'], [('Weekly', []), ('Monthly', [])])
+        return
+
+    def test_rankings(self):
+        Job.objects.schedule_periodic()
+        Job.objects.run_batch()
+        # rescheduled for the next refresh
+        self.assertTrue(Job.objects.filter(name=refresh_rankings.job_name).exists())
+
+        self.posts[0].show = False
+        self.posts[0].save()
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(RANK)
+        self.assertEqual(res.status_code, 200)
+        weekly = [rank.post for rank in res.context['rankings'][0][1]]
+        self.assertEqual(weekly, [self.posts[2], self.posts[1]])
+        self.assertContains(res, self.posts[2].get_absolute_url())
+        self.assertFalse([q for q in queries.captured_queries if 'posts_rating' in q['sql']])
+        return
+
+
 class TestUserPostsView(TestCase):
     def test_single_user(self):
         u0 = create_user()
@@ -432,16 +718,189 @@ class TestPostDetailModalView(TestCase):
         self.assertEqual(res.status_code, 404)
         return
 
+    def test_comments_pages(self):
+        u0 = create_user()
+        post = create_posts(u0, 1)[0]
+        comments = [
+            Comment.objects.create(user=u0, post=post, description=str(i)) for i in range(15)]
+        url = POST_DETAIL.replace(STR_TKN, str(post.uuid))
+        res = self.client.get(url)
+        self.assertEqual([c.id for c in res.context['comments']], [c.id for c in comments[:10]])
+        res = self.client.get(f'{url}?after={res.context["paginate_hook"]}')
+        self.assertTemplateUsed(res, 'posts/post_detail_comments.html')
+        self.assertEqual([c.id for c in res.context['comments']], [c.id for c in comments[10:]])
+        self.assertIsNone(res.context['paginate_hook'])
+        return
+
+
+class TestFollowView(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('follower')
+        self.user.set_password('password')
+        self.user.save()
+        self.client.login(username='follower', password='password')
+        self.u0 = create_user('u0')
+        self.u1 = create_user('u1')
+        return
+
+    def get_posts(self):
+        res = self.client.get(FOLLOW)
+        self.assertEqual(res.status_code, 200)
+        return list(res.context['posts'])
+
+    def run_jobs(self):
+        while Job.objects.run_batch():
+            pass
+        return
 
-class TestFollowView(TestCase):#TODO test me
     def test_follow_no_user(self):
+        create_posts(self.u0)
+        self.run_jobs()
+        self.assertEqual(self.get_posts(), [])
         return
 
     def test_follow_single_user(self):
+        old = create_posts(self.u0, 2)
+        self.user.relations.follows.add(self.u0)
+        new = create_posts(self.u0)
+        create_posts(self.u1)
+        self.assertEqual(self.get_posts(), old[::-1])
+        self.run_jobs()
+        self.assertEqual(self.get_posts(), (old + new)[::-1])
         return
 
     def test_follow_multiple_user(self):
+        self.user.relations.follows.add(self.u0, self.u1)
+        posts = []
+        for _ in range(2):
+            posts += create_posts(self.u0) + create_posts(self.u1)
+        self.run_jobs()
+        self.assertEqual(self.get_posts(), posts[::-1])
+
+        self.user.relations.follows.remove(self.u1)
+        self.assertEqual(self.get_posts(), posts[-2::-2])
+        self.user.relations.follows.clear()
+        self.assertEqual(self.get_posts(), [])
         return
 
     def test_follow_with_hidden_post(self):
+        self.user.relations.follows.add(self.u0)
+        posts = create_posts(self.u0, 2)
+        Post.objects.create(user=self.u0, anonymous=True)
+        self.run_jobs()
+        posts[0].show = False
+        posts[0].save()
+        self.assertEqual(self.get_posts(), [posts[1]])
+        return
+
+    def test_follow_fanout_on_read(self):
+        self.user.relations.follows.add(self.u0, self.u1)
+        self.u0.relations.fanout_on_read = True
+        self.u0.relations.save()
+        posts = create_posts(self.u0) + create_posts(self.u1) + create_posts(self.u0)
+        self.run_jobs()
+        self.assertFalse(TimelineEntry.objects.filter(author=self.u0).exists())
+        self.assertEqual(self.get_posts(), posts[::-1])
+        return
+
+    def test_fanout_limit(self):
+        self.user.relations.follows.add(self.u0)
+        self.u1.relations.follows.add(self.u0)
+        with patch.object(TimelineEntry, 'FANOUT_LIMIT', 1):
+            posts = create_posts(self.u0)
+            self.run_jobs()
+        self.u0.relations.refresh_from_db()
+        self.assertTrue(self.u0.relations.fanout_on_read)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.get_posts(), posts)
+        return
+
+
+class TestSearchViews(TestCase):
+    paginate_by = 10
+
+    def setUp(self):
+        self.user = create_user('searcher')
+        self.user.profile.name = 'Search Er'
+        self.user.profile.save()
+        return
+
+    def test_post_search(self):
+        posts = create_posts(self.user, self.paginate_by + 2)
+        for post in posts:
+            post.description = 'old library'
+            post.save()
+        hidden = posts[-1]
+        hidden.show = False
+        hidden.save()
+        Post.objects.create(user=self.user, description='new museum')
+
+        res = self.client.get(SEARCH, {'q': 'libraries'})
+        self.assertEqual(res.status_code, 200)
+        self.assertTemplateUsed(res, 'posts/search.html')
+        shown = posts[:-1][::-1]
+        self.assertEqual(list(res.context['posts']), shown[:self.paginate_by])
+        cursor = res.context['paginate_hook']
+        self.assertTrue(cursor)
+
+        res = self.client.get(SEARCH, {'q': 'libraries', 'after': cursor})
+        self.assertTemplateUsed(res, 'posts/list_post.html')
+        self.assertTemplateNotUsed(res, 'posts/search.html')
+        self.assertEqual(list(res.context['posts']), shown[self.paginate_by:])
+        self.assertEqual(res.context['paginate_hook'], None)
+        return
+
+    def test_post_search_bounded_queries(self):
+        for post in create_posts(self.user, self.paginate_by):
+            post.description = 'library'
+            post.save()
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(SEARCH, {'q': 'library'})
+        # the search, images and cards, plus the session and user of the client
+        self.assertLessEqual(len(ctx.captured_queries), 5)
+        return
+
+    def test_empty_search(self):
+        create_posts(self.user)
+        with self.assertNumQueries(0):
+            res = self.client.get(SEARCH, {'q': ' '})
+        self.assertEqual(list(res.context['posts']), [])
+        self.assertEqual(self.client.get(SEARCH).status_code, 200)
+        return
+
+    def test_comment_search(self):
+        post, hidden = create_posts(self.user, 2)
+        hidden.show = False
+        hidden.save()
+        comment = Comment.objects.create(user=self.user, post=post, description='Great photos')
+        Comment.objects.create(user=self.user, post=hidden, description='Great photos')
+        Comment.objects.create(user=self.user, post=post, description='Nice')
+        res = self.client.get(SEARCH_COMMENTS, {'q': 'photo'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(res.context['comments']), [comment])
+        self.assertContains(res, 'Great photos')
+        return
+
+    def test_anonymous_comment_search(self):
+        post = create_posts(self.user)[0]
+        Comment.objects.create(user=self.user, post=post, description='Great photos', anonymous=True)
+        res = self.client.get(SEARCH_COMMENTS, {'q': 'photo'})
+        self.assertContains(res, Comment.ANONYMOUS_USER)
+        self.assertNotContains(res, self.user.profile.name)
+        return
+
+    def test_user_search(self):
+        inactive = create_user('searched')
+        inactive.is_active = False
+        inactive.save()
+        res = self.client.get(SEARCH_USERS, {'q': 'sea'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([profile.user for profile in res.context['profiles']], [self.user])
+        self.assertContains(res, '@searcher')
+        res = self.client.get(SEARCH_USERS, {'q': 'search er'})
+        self.assertEqual([profile.user for profile in res.context['profiles']], [self.user])
+        res = self.client.get(SEARCH_USERS, {'q': '!!'})
+        self.assertEqual(list(res.context['profiles']), [])
         return
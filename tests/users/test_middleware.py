@@ -0,0 +1,80 @@
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+import pickle
+
+from .._tools.utils import create_user
+from rmn_arch_0.users.middleware import AuthenticationMiddleware, request_user_key
+
+
+class TestAuthenticationMiddleware(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = create_user()
+        self.client.force_login(self.user)
+        return
+
+    def get_request_user(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        AuthenticationMiddleware(lambda request: None).process_request(request)
+        return request.user
+
+    def access_user(self, user):
+        return user.profile.name, user.settings.rec_new_msg, user.relations.fanout_on_read
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=0)
+    def test_single_query(self):
+        user = self.get_request_user()
+        with self.assertNumQueries(1):
+            self.assertEqual(user.id, self.user.id)
+            self.access_user(user)
+        return
+
+    def test_cached(self):
+        with self.assertNumQueries(1):
+            self.access_user(self.get_request_user())
+        with self.assertNumQueries(0):
+            self.access_user(self.get_request_user())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.settings.rate_anon = True
+            self.user.settings.save()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.get_request_user().settings.rate_anon)
+        return
+
+    def test_cached_without_password(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('secret')
+            self.user.save()
+        self.client.force_login(self.user)
+        self.get_request_user().is_authenticated
+        cached, _ = cache.get(request_user_key(self.user.id))
+        self.assertIn('password', cached.get_deferred_fields())
+        self.assertNotIn(self.user.password.encode(), pickle.dumps(cached))
+
+        user = self.get_request_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_authenticated)
+        # read again when needed, and not overwritten by saves
+        self.assertTrue(user.check_password('secret'))
+        user.first_name = 'name'
+        user.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('secret'))
+        return
+
+    def test_password_changed(self):
+        self.access_user(self.get_request_user())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('new password')
+            self.user.save()
+        self.assertFalse(self.get_request_user().is_authenticated)
+        return
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertFalse(self.get_request_user().is_authenticated)
+        return
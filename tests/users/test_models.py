@@ -1,14 +1,23 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.templatetags.static import static
 from django.test import TestCase
 from django.urls.base import reverse
 from django.utils import timezone
 
 from datetime import datetime
+import os
 from random import choice
+import shutil
 from string import ascii_letters
 
 from .._tools.utils import TEST_IMG_PATH, create_user, create_posts
+from rmn_arch_0.core.images import variant_name
+from rmn_arch_0.core.search import prefix_query
+from rmn_arch_0.users.cards import get_card, get_cards
+from rmn_arch_0.users.forms import ProfileForm
 from rmn_arch_0.users.models import User, Profile
 from rmn_arch_0.posts.models import Post
 
@@ -100,6 +109,12 @@ class TestUser(TestCase):
 
 
 class TestProfile(TestCase):
+    def tearDown(self):
+        path = f'{settings.MEDIA_ROOT}/uploads/user_username'
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        return super().tearDown()
+
     def test_age(self):
         today = timezone.now()
         age = 21
@@ -118,4 +133,89 @@ class TestProfile(TestCase):
         self.assertEqual(profile.age, None)
         return
 
+    def test_avatar_variant(self):
+        user = create_user()
+        profile = user.profile
+        with open(TEST_IMG_PATH, 'rb') as img:
+            profile.image = SimpleUploadedFile('img.png', img.read(), content_type='image/png')
+            profile.save()
+        self.assertEqual(user.profile_image_url, profile.image.url)
+        profile.make_variants()
+        self.assertEqual(user.profile_image_url,
+            profile.image.storage.url(variant_name(profile.image.name, 'avatar')))
+        profile = Profile.objects.get(user=user)
+        self.assertTrue(profile.variants_ready)
+        profile.image = 'other.png'
+        profile.save()
+        self.assertFalse(Profile.objects.get(user=user).variants_ready)
+        return
+
+    def test_search_vector(self):
+        user = create_user(username='john.doe')
+        user.profile.name = 'Mary Smith'
+        user.profile.save()
+        query = prefix_query('smi')
+        self.assertTrue(Profile.objects.filter(user=user, search_vector=query).exists())
+        # the username, also as separate words
+        for q in ['john.doe', 'doe', 'jo do']:
+            self.assertTrue(Profile.objects.filter(search_vector=prefix_query(q)).exists(), q)
+        user.username = 'jane'
+        user.save()
+        self.assertFalse(Profile.objects.filter(search_vector=prefix_query('john')).exists())
+        self.assertTrue(Profile.objects.filter(search_vector=prefix_query('jane sm')).exists())
+        return
+
+
+class TestCards(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.users = [create_user(f'u{i}') for i in range(3)]
+        return
+
+    def test_get_cards(self):
+        ids = [user.id for user in self.users]
+        with self.assertNumQueries(1):
+            cards = get_cards(ids + [None])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cards(ids), cards)
+        self.assertEqual(cards[ids[0]], {'username': 'u0', 'name': self.users[0].name,
+            'img_url': static('images/default_profile_img.png')})
+        return
+
+    def test_no_profile(self):
+        user = User.objects.create(username='admin', email='admin@m.com')
+        self.assertEqual(get_card(user.id)['name'], '')
+        return
+
+    def test_profile_form_invalidates(self):
+        user = self.users[0]
+        get_card(user.id)
+        form = ProfileForm(data={'name': 'new name', 'gender': ''}, instance=user.profile)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertEqual(get_card(user.id)['name'], 'new name')
+        return
+
+    def test_save_invalidates(self):
+        user = self.users[0]
+        get_card(user.id)
+        user.profile.name = 'new name'
+        user.profile.save()
+        self.assertEqual(get_card(user.id)['name'], 'new name')
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(get_card(user.id)['username'], 'renamed')
+        return
+
+    def test_with_cards(self):
+        for user in self.users:
+            create_posts(user)
+        get_cards(user.id for user in self.users)
+        with self.assertNumQueries(1):
+            posts = list(Post.objects.with_cards().order_by('id'))
+            self.assertEqual([post.user_display_name for post in posts],
+                [user.name for user in self.users])
+        return
+
 # TODO test Settings and Relations, add a few helper to Relations probably